@@ -0,0 +1,214 @@
+# agent_output.py
+import json
+import re
+from dataclasses import dataclass
+from itertools import islice
+from typing import Iterator, List, Optional, Tuple
+
+_DECODER = json.JSONDecoder()
+_FENCE = re.compile(r"```(?:json)?[ \t]*\n?(.*?)```", re.DOTALL | re.IGNORECASE)
+_STRUCTURAL = re.compile(r'[{}"\\]')
+_OBJECT_START = re.compile(r'\{\s*["}]')  # what a JSON object can start with
+FALLBACK_ATTEMPTS = 16
+_ASPECT_RATIO = re.compile(r"\s*(\d{1,2})\s*[:x×/]\s*(\d{1,2})\s*")
+
+Span = Tuple[int, int]  # [start, end) of a balanced {...} run
+
+
+def _decode_object(text: str, start: int, end: Optional[int] = None) -> Optional[Tuple[dict, int]]:
+    """
+    (object, end index) if a JSON object starts exactly at `start`. Decodes
+    a slice: a decode error computes its line number from the start of the
+    string, which would cost O(start) per failed candidate.
+    """
+    try:
+        obj, used = _DECODER.raw_decode(text[start:end])
+    except ValueError:
+        return None
+    return (obj, start + used) if isinstance(obj, dict) else None
+
+
+def _balanced_spans(text: str) -> Tuple[List[Tuple[Span, list]], List[list]]:
+    """
+    One left-to-right pass over the structural characters only.
+
+    Returns the top-level balanced spans (each with its nested child spans,
+    recursively) and, for braces that never close, their completed children.
+    String state is only tracked inside braces, so stray quotes in prose
+    cannot hide a later object.
+    """
+    top: List[Tuple[Span, list]] = []
+    stack: List[Tuple[int, list]] = []  # (start, children) per open brace
+    in_str = False
+    skip_to = -1
+    for m in _STRUCTURAL.finditer(text):
+        i = m.start()
+        if i < skip_to:
+            continue
+        ch = text[i]
+        if in_str:
+            if ch == "\\":
+                skip_to = i + 2
+            elif ch == '"':
+                in_str = False
+        elif ch == "{":
+            stack.append((i, []))
+        elif not stack:
+            continue  # quotes/braces in prose
+        elif ch == '"':
+            in_str = True
+        elif ch == "}":
+            start, children = stack.pop()
+            node = ((start, i + 1), children)
+            (stack[-1][1] if stack else top).append(node)
+    return top, [children for _, children in stack]
+
+
+def _span_objects(text: str, nodes: List[Tuple[Span, list]], depth: int) -> Iterator[Tuple[dict, Span]]:
+    """Spans that decode, in order; a span that does not is searched one level deeper (at most `depth`)."""
+    for (start, end), children in nodes:
+        found = _decode_object(text, start, end)
+        if found is not None:
+            yield found[0], (start, found[1])
+        elif depth > 0 and children:
+            yield from _span_objects(text, children, depth - 1)
+
+
+def iter_json_objects(text: str, max_depth: int = 2) -> Iterator[Tuple[dict, Span]]:
+    """
+    Candidate JSON objects in a model response that may include Markdown
+    fences, prose, or other wrappers, most likely first, as (object, span).
+
+    Lazy and linear in len(text): the response is scanned once, and each
+    candidate is decoded at most once per nesting level tried (`max_depth`
+    levels below a span that is not valid JSON, e.g. a `{placeholder}` in
+    prose). Because unbalanced quotes can throw the scan off (and make an
+    inner object look like the answer), the last candidates are at most
+    FALLBACK_ATTEMPTS plausible object starts decoded directly.
+    """
+    if not text:
+        return
+
+    # 1) Fast path: the response is (or starts with) the object
+    start = len(text) - len(text.lstrip())
+    if text.startswith("{", start):
+        found = _decode_object(text, start)
+        if found is not None:
+            yield found[0], (start, found[1])
+
+    # 2) Markdown code fences ```json ... ``` or ``` ... ```
+    for fence in _FENCE.finditer(text):
+        inner = fence.group(1)
+        brace = inner.find("{")
+        if brace != -1:
+            found = _decode_object(inner, brace)
+            if found is not None:
+                offset = fence.start(1)
+                yield found[0], (offset + brace, offset + found[1])
+
+    # 3) Balanced {...} runs anywhere that are valid JSON
+    top, unclosed = _balanced_spans(text)
+    yield from _span_objects(text, top, max_depth)
+    for children in unclosed:  # objects after a stray, never-closed "{"
+        yield from _span_objects(text, children, max_depth)
+
+    # 4) Unbalanced quotes in prose can hide an object from the scan
+    for m in islice(_OBJECT_START.finditer(text), FALLBACK_ATTEMPTS):
+        found = _decode_object(text, m.start())
+        if found is not None:
+            yield found[0], (m.start(), found[1])
+
+
+def find_json_object(text: str, max_depth: int = 2) -> Optional[Tuple[dict, Span]]:
+    """The most likely JSON object in a model response, as (object, span), or None."""
+    return next(iter_json_objects(text, max_depth), None)
+
+
+def extract_json_block(text: str) -> Optional[str]:
+    """The JSON object text found by `find_json_object`, or None."""
+    found = find_json_object(text)
+    if found is None:
+        return None
+    start, end = found[1]
+    return text[start:end]
+
+
+def _clean_str(value) -> Optional[str]:
+    if isinstance(value, str):
+        value = value.strip()
+        return value or None
+    return None
+
+
+@dataclass(frozen=True)
+class RewriteResult:
+    """Validated output of prompt_rewriter_agent (see its OUTPUT FORMAT)."""
+    rewritten_prompt: str
+    template_id: Optional[int] = None  # 1..10
+    template_name: Optional[str] = None
+    rationale: Optional[str] = None
+    aspect_ratio: Optional[str] = None  # normalized "W:H"
+    followups: Tuple[str, ...] = ()
+
+    MAX_FOLLOWUPS = 10
+
+    @classmethod
+    def from_dict(cls, obj) -> Optional["RewriteResult"]:
+        """Validate a parsed agent answer; None unless it carries a usable `rewritten_prompt`."""
+        if not isinstance(obj, dict):
+            return None
+        prompt = _clean_str(obj.get("rewritten_prompt"))
+        if prompt is None:
+            return None
+
+        template_id = obj.get("chosen_template_id")
+        if isinstance(template_id, str) and template_id.strip().isdigit():
+            template_id = int(template_id)
+        if isinstance(template_id, bool) or not isinstance(template_id, int) or not 1 <= template_id <= 10:
+            template_id = None
+
+        aspect_ratio = None
+        ratio = obj.get("suggested_aspect_ratio")
+        m = _ASPECT_RATIO.fullmatch(ratio) if isinstance(ratio, str) else None
+        if m and int(m.group(1)) > 0 and int(m.group(2)) > 0:
+            aspect_ratio = f"{int(m.group(1))}:{int(m.group(2))}"
+
+        followups = obj.get("optional_followups")
+        if isinstance(followups, str):
+            followups = [followups]
+        if not isinstance(followups, list):
+            followups = []
+        cleaned = tuple(f for f in map(_clean_str, followups) if f)[:cls.MAX_FOLLOWUPS]
+
+        return cls(
+            rewritten_prompt=prompt,
+            template_id=template_id,
+            template_name=_clean_str(obj.get("chosen_template_name")),
+            rationale=_clean_str(obj.get("rationale")),
+            aspect_ratio=aspect_ratio,
+            followups=cleaned,
+        )
+
+    @classmethod
+    def parse(cls, text: str) -> Optional["RewriteResult"]:
+        """
+        Agent response text -> validated result, or None. Candidates are
+        tried in order until one is a valid answer, so an inner object that
+        a stray quote made look like the answer does not hide the real one.
+        """
+        for obj, _ in iter_json_objects(text or ""):
+            result = cls.from_dict(obj)
+            if result is not None:
+                return result
+        return None
+
+    def to_dict(self) -> dict:
+        """Same keys as the agent's output format (what the rewrite cache stores)."""
+        return {
+            "chosen_template_id": self.template_id,
+            "chosen_template_name": self.template_name,
+            "rationale": self.rationale,
+            "rewritten_prompt": self.rewritten_prompt,
+            "suggested_aspect_ratio": self.aspect_ratio,
+            "optional_followups": list(self.followups),
+        }
@@ -0,0 +1,101 @@
+# assembly.py
+import hashlib
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Iterable, List, Optional, Set
+
+if TYPE_CHECKING:
+    from google.genai import types
+
+
+class ContentAssemblyError(ValueError):
+    """Raised when generate_content contents would be malformed."""
+
+
+@dataclass
+class ContentAssembly:
+    """Validated `contents` for one generation: reference images, then a single prompt."""
+    images: List["types.Part"]
+    prompt: str
+    duplicates_dropped: int = 0
+    source_bytes: int = 0  # size of the reference images before preprocessing
+
+    @property
+    def part_count(self) -> int:
+        return len(self.images) + 1
+
+    @property
+    def image_bytes(self) -> int:
+        return sum(len(p.inline_data.data) for p in self.images)
+
+    @property
+    def payload_bytes(self) -> int:
+        return self.image_bytes + len(self.prompt.encode("utf-8"))
+
+    @property
+    def bytes_saved(self) -> int:
+        """Upload bytes saved by reference preprocessing."""
+        return max(0, self.source_bytes - self.image_bytes)
+
+    def contents(self) -> list:
+        return [*self.images, self.prompt]
+
+    def fingerprint(self) -> str:
+        """Hash of the images (in order) and the prompt: equal for identical generation requests."""
+        h = hashlib.sha256()
+        for part in self.images:
+            blob = part.inline_data
+            h.update(f"{blob.mime_type}\0{len(blob.data)}\0".encode("utf-8"))
+            h.update(blob.data)
+        h.update(self.prompt.encode("utf-8"))
+        return h.hexdigest()
+
+
+@dataclass
+class ContentBuilder:
+    """
+    Collects reference images in order and a single text prompt.
+
+    Images are de-duplicated by their encoded bytes (the first occurrence
+    keeps its position). `build()` validates the result.
+    """
+    max_images: int = 32
+    _images: List["types.Part"] = field(default_factory=list)
+    _seen: Set[bytes] = field(default_factory=set)
+    _duplicates: int = 0
+    _source_bytes: int = 0
+    _prompt: Optional[str] = None
+
+    def add_images(self, parts: Iterable["types.Part"], source_sizes: Optional[List[int]] = None) -> "ContentBuilder":
+        """Append reference images; `source_sizes` are their pre-preprocessing sizes, if known."""
+        for i, part in enumerate(parts):
+            blob = getattr(part, "inline_data", None)
+            data = getattr(blob, "data", None)
+            if blob is None or not data:
+                raise ContentAssemblyError("Reference parts must carry inline image data.")
+            if not (blob.mime_type or "").startswith("image/"):
+                raise ContentAssemblyError(f"Unsupported reference mime type: {blob.mime_type!r}")
+            if data in self._seen:
+                self._duplicates += 1
+                continue
+            self._seen.add(data)
+            self._images.append(part)
+            self._source_bytes += source_sizes[i] if source_sizes else len(data)
+        return self
+
+    def set_prompt(self, prompt: str) -> "ContentBuilder":
+        self._prompt = prompt
+        return self
+
+    def build(self) -> ContentAssembly:
+        if not isinstance(self._prompt, str) or not self._prompt.strip():
+            raise ContentAssemblyError("A non-empty text prompt is required.")
+        if len(self._images) > self.max_images:
+            raise ContentAssemblyError(
+                f"Too many reference images: {len(self._images)} (max {self.max_images})."
+            )
+        return ContentAssembly(
+            images=list(self._images),
+            prompt=self._prompt.strip(),
+            duplicates_dropped=self._duplicates,
+            source_bytes=self._source_bytes,
+        )
@@ -0,0 +1,139 @@
+# benchmarks/fakes.py
+"""
+Local stand-ins for the Gemini client and the ADK prompt-rewriter agent.
+
+Both answer after a configurable (optionally jittered) delay with canned
+data, so the whole request pipeline can be exercised without network
+access or a real GEMINI_API_KEY. An in-memory S3 client stands in for
+boto3 when testing the S3 storage backend.
+"""
+import asyncio
+import json
+import random
+from io import BytesIO
+from types import SimpleNamespace
+from typing import AsyncGenerator, List, Optional
+
+from google.adk.agents import BaseAgent
+from google.adk.agents.invocation_context import InvocationContext
+from google.adk.events import Event
+from google.genai import errors, types
+from PIL import Image
+
+
+def make_image(width: int, height: int, fmt: str = "PNG", seed: int = 0) -> bytes:
+    """Photo-like test image: smooth gradients plus noise, so encoders do real work."""
+    rng = random.Random(seed)
+    gradient = Image.linear_gradient("L").resize((width, height))
+    noise = Image.effect_noise((width, height), 48)
+    img = Image.merge("RGB", (gradient, noise, gradient.rotate(rng.choice((90, 180, 270)))))
+    buff = BytesIO()
+    img.save(buff, format=fmt)
+    return buff.getvalue()
+
+
+class _Latency:
+    def __init__(self, latency: float, jitter: float):
+        self.latency = latency
+        self.jitter = jitter
+
+    async def sleep(self) -> None:
+        delay = self.latency + random.uniform(-self.jitter, self.jitter) if self.jitter else self.latency
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+class FakeModels(_Latency):
+    """
+    `client.aio.models` replacement: every call returns the same canned image.
+
+    A fraction `error_rate` of calls fail with 503 and a fraction
+    `rate_limit_rate` with 429 (quota exhausted); `rate_limited_calls` makes
+    the next that many calls answer 429 before any of that.
+    """
+
+    def __init__(self, image: bytes, latency: float, jitter: float = 0.0, error_rate: float = 0.0,
+                 rate_limit_rate: float = 0.0, rate_limited_calls: int = 0):
+        super().__init__(latency, jitter)
+        self.image = image
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.rate_limited_calls = rate_limited_calls
+        self.calls = 0
+        self.payload_bytes: List[int] = []
+        self.last_contents: Optional[list] = None  # what the latest call was sent
+
+    async def generate_content(self, model: str, contents: list, **kwargs) -> types.GenerateContentResponse:
+        self.calls += 1
+        self.last_contents = list(contents)
+        self.payload_bytes.append(sum(
+            len(c.inline_data.data) if isinstance(c, types.Part) and c.inline_data else len(str(c))
+            for c in contents
+        ))
+        await self.sleep()
+        if self.rate_limited_calls > 0 or (self.rate_limit_rate and random.random() < self.rate_limit_rate):
+            self.rate_limited_calls = max(0, self.rate_limited_calls - 1)
+            raise errors.ClientError(429, {"error": {"code": 429, "message": "fake quota exhausted",
+                                                     "status": "RESOURCE_EXHAUSTED"}})
+        if self.error_rate and random.random() < self.error_rate:
+            raise errors.ServerError(503, {"error": {"code": 503, "message": "fake overload", "status": "UNAVAILABLE"}})
+        part = types.Part(inline_data=types.Blob(mime_type="image/png", data=self.image))
+        return types.GenerateContentResponse(
+            candidates=[types.Candidate(content=types.Content(role="model", parts=[part]))]
+        )
+
+
+def fake_genai_client(image: bytes, latency: float, jitter: float = 0.0, error_rate: float = 0.0,
+                      rate_limit_rate: float = 0.0, rate_limited_calls: int = 0):
+    """Object shaped like `genai.Client` as far as main.py uses it (`client.aio.models`)."""
+    models = FakeModels(image, latency, jitter, error_rate, rate_limit_rate, rate_limited_calls)
+    return SimpleNamespace(aio=SimpleNamespace(models=models))
+
+
+class FakeRewriterAgent(BaseAgent):
+    """
+    ADK agent that answers like root_agent (a fenced JSON block) without
+    calling a model. Runs through the real Runner and session service.
+    """
+    latency: float = 0.0
+    jitter: float = 0.0
+
+    async def _run_async_impl(self, ctx: InvocationContext) -> AsyncGenerator[Event, None]:
+        await _Latency(self.latency, self.jitter).sleep()
+        raw = ctx.user_content.parts[0].text if ctx.user_content and ctx.user_content.parts else ""
+        answer = {
+            "chosen_template_id": 6,
+            "chosen_template_name": "Sequential Art",
+            "rationale": "benchmark stand-in",
+            "rewritten_prompt": f"Manga page, 4 panels, crisp ink lineart: {raw}",
+            "suggested_aspect_ratio": "4:5",
+            "optional_followups": [],
+        }
+        text = "Here is the rewrite:\n```json\n" + json.dumps(answer, indent=2) + "\n```"
+        yield Event(
+            author=self.name,
+            invocation_id=ctx.invocation_id,
+            content=types.Content(role="model", parts=[types.Part(text=text)]),
+        )
+
+
+class FakeS3Client:
+    """The slice of the boto3 S3 client S3Storage uses, backed by a dict."""
+
+    class NoSuchKey(Exception):
+        pass
+
+    def __init__(self):
+        self.objects = {}
+        self.exceptions = SimpleNamespace(NoSuchKey=self.NoSuchKey)
+
+    def put_object(self, Bucket, Key, Body, ContentType):
+        self.objects[(Bucket, Key)] = (Body, ContentType)
+
+    def get_object(self, Bucket, Key):
+        if (Bucket, Key) not in self.objects:
+            raise self.NoSuchKey(Key)
+        return {"Body": BytesIO(self.objects[(Bucket, Key)][0])}
+
+    def delete_object(self, Bucket, Key):
+        self.objects.pop((Bucket, Key), None)
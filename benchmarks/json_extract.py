@@ -0,0 +1,132 @@
+# benchmarks/json_extract.py
+"""
+Micro-benchmark: recovering the rewriter agent's JSON from its response text.
+
+Compares agent_output.extract_json_block (single scan + raw_decode) with the
+previous implementation, which restarted a full scan (and json.loads) from
+every "{" and is quadratic on responses with many stray braces.
+
+    python benchmarks/json_extract.py
+    python benchmarks/json_extract.py --scale 4 --legacy-limit 50000
+"""
+import argparse
+import json
+import re
+import sys
+import time
+from pathlib import Path
+from typing import Callable, Optional
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from agent_output import extract_json_block  # noqa: E402
+
+ANSWER = json.dumps({
+    "chosen_template_id": 6,
+    "chosen_template_name": "Sequential Art",
+    "rationale": "The user asked for manga panels.",
+    "rewritten_prompt": "A single manga page, 4 panels, crisp ink lineart, {speech balloons} with \"quotes\".",
+    "suggested_aspect_ratio": "4:5",
+    "optional_followups": ["Color or grayscale?", "Add sound effects?"],
+}, indent=2)
+
+TEMPLATE_PROSE = (
+    '[6] Sequential Art\n"A {panel_count}-panel [comic/manga] about [subject], {style} lineart, '
+    '[tone] with \\"captions\\" and {balloon} placement." '
+)
+
+
+def legacy_extract_json_block(text: str) -> Optional[str]:
+    """The implementation this replaces (kept here for comparison only)."""
+    try:
+        json.loads(text)
+        return text
+    except Exception:
+        pass
+    fence_match = re.search(r"```(?:json)?\s*(.*?)\s*```", text, re.DOTALL | re.IGNORECASE)
+    if fence_match:
+        candidate = fence_match.group(1).strip()
+        try:
+            json.loads(candidate)
+            return candidate
+        except Exception:
+            text = candidate
+    start = text.find("{")
+    while start != -1:
+        depth = 0
+        in_str = False
+        escape = False
+        for i, ch in enumerate(text[start:], start=start):
+            if in_str:
+                if escape:
+                    escape = False
+                elif ch == "\\":
+                    escape = True
+                elif ch == '"':
+                    in_str = False
+            else:
+                if ch == '"':
+                    in_str = True
+                elif ch == "{":
+                    depth += 1
+                elif ch == "}":
+                    depth -= 1
+                    if depth == 0:
+                        candidate = text[start:i + 1]
+                        try:
+                            json.loads(candidate)
+                            return candidate
+                        except Exception:
+                            break
+        start = text.find("{", start + 1)
+    return None
+
+
+def cases(scale: int) -> dict:
+    n = 1000 * scale
+    return {
+        "bare json": ANSWER,
+        "fenced after prose": "Sure! Here is the rewrite.\n\n```json\n" + ANSWER + "\n```\nLet me know.",
+        "templates + json": TEMPLATE_PROSE * (n // 10) + "\nResult: " + ANSWER,
+        "stray open braces": "{ " * n + ANSWER,
+        "nested invalid": "{" * n + "x" + "}" * n + " " + ANSWER,
+        "unclosed string": 'note: "{ ' * (n // 2) + ANSWER,
+        "no json": TEMPLATE_PROSE * (n // 10),
+    }
+
+
+def measure(fn: Callable[[str], Optional[str]], text: str, budget: float = 0.5) -> float:
+    """Seconds per call (repeats until `budget` seconds have passed, at least once)."""
+    runs = 0
+    started = time.perf_counter()
+    while True:
+        fn(text)
+        runs += 1
+        elapsed = time.perf_counter() - started
+        if elapsed >= budget:
+            return elapsed / runs
+
+
+def main() -> int:
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument("--scale", type=int, default=1, help="multiplies the size of the generated inputs")
+    p.add_argument("--legacy-limit", type=int, default=20000,
+                   help="skip the old implementation on inputs longer than this many characters")
+    args = p.parse_args()
+
+    print(f"{'case':<20} {'chars':>9} {'new ms':>10} {'old ms':>10} {'speedup':>9}  same")
+    for name, text in cases(args.scale).items():
+        new = measure(extract_json_block, text)
+        if len(text) <= args.legacy_limit:
+            old = measure(legacy_extract_json_block, text)
+            legacy = legacy_extract_json_block(text)
+            found = extract_json_block(text)
+            same = "yes" if legacy == found or (legacy and found and json.loads(legacy) == json.loads(found)) else "NO"
+            print(f"{name:<20} {len(text):>9} {new * 1000:>10.3f} {old * 1000:>10.3f} {old / new:>8.1f}x  {same}")
+        else:
+            print(f"{name:<20} {len(text):>9} {new * 1000:>10.3f} {'skipped':>10} {'':>9}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,327 @@
+# benchmarks/load_test.py
+"""
+Offline load test for the generation endpoints.
+
+The Gemini client and the ADK rewriter agent are replaced with local fakes
+(benchmarks/fakes.py) that answer after a configurable delay, so this runs
+without network access or a real API key. Requests go through the real
+FastAPI app in-process (httpx ASGI transport), including the scheduler,
+preprocessing, caches and storage (in a temporary directory).
+
+Each scenario runs in its own subprocess so CPU time and peak RSS are not
+polluted by the others. Children run with a fixed glibc mmap threshold so
+freed image buffers go back to the OS and RSS follows live memory;
+`mem_per_request_mb` is the p95 RSS growth while a request was in flight
+(sampled every few ms; with -c > 1 it includes overlapping requests).
+
+    python benchmarks/load_test.py                          # all scenarios
+    python benchmarks/load_test.py -s image -n 200 -c 16 --uploads 4
+    python benchmarks/load_test.py --save baseline.json
+    python benchmarks/load_test.py --baseline baseline.json  # exit 1 on regression
+    python benchmarks/load_test.py -s default --pool-size 8   # pre-generated pool
+    python benchmarks/load_test.py -s default --coalesce      # identical in-flight requests share a call
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from bisect import bisect_left, bisect_right
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT))
+
+SCENARIOS = {
+    "default": "/api/generate-default",
+    "manga-default": "/api/generate-manga-default",
+    "image": "/api/generate-image",
+}
+
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    """Nearest-rank percentile of an ascending list (q in 0..100)."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, min(len(sorted_values), round(q / 100 * len(sorted_values) + 0.5)))
+    return sorted_values[rank - 1]
+
+
+class RssSampler:
+    """Resident set size of this process, sampled from a thread (Linux /proc; no-op elsewhere)."""
+
+    def __init__(self, interval: float = 0.002):
+        self.interval = interval
+        self.enabled = os.path.exists("/proc/self/statm")
+        self.times: List[float] = []
+        self.values: List[int] = []
+        self._page = os.sysconf("SC_PAGE_SIZE") if self.enabled else 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def rss(self) -> int:
+        if not self.enabled:
+            return 0
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * self._page
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.times.append(time.perf_counter())
+            self.values.append(self.rss())
+
+    def start(self) -> None:
+        if self.enabled:
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self.enabled:
+            self._thread.join()
+
+    def growth(self, started: float, ended: float, base: int) -> int:
+        """Highest RSS sampled in [started, ended] minus `base` (bytes, >= 0)."""
+        lo, hi = bisect_left(self.times, started), bisect_right(self.times, ended)
+        return max(0, max(self.values[lo:hi], default=base) - base)
+
+
+def _isolate_state(workdir: Path, args) -> None:
+    """Point every on-disk cache/index at `workdir` (must run before main is imported)."""
+    os.environ.setdefault("GEMINI_API_KEY", "offline-benchmark")
+    os.environ["STORAGE_INDEX_PATH"] = str(workdir / "assets.sqlite3")
+    os.environ["JOB_DB_PATH"] = str(workdir / "jobs.sqlite3")
+    os.environ["REWRITE_CACHE_PATH"] = str(workdir / "rewrites.sqlite3")
+    os.environ.setdefault("STORAGE_BACKEND", "local")
+    os.environ["WARMUP"] = "0"  # the fakes below replace what warmup would load
+    os.environ["COALESCE_GENERATIONS"] = "1" if args.coalesce else "0"
+    os.environ["DEFAULT_POOL_SIZE"] = str(args.pool_size)
+    os.environ["DEFAULT_POOL_REFILL_CONCURRENCY"] = str(args.pool_refill_concurrency)
+
+
+def _install_fakes(main, args, workdir: Path) -> None:
+    """Swap the started app's upstream clients and storage for local stand-ins."""
+    from benchmarks.fakes import FakeRewriterAgent, fake_genai_client, make_image
+    from rewrite_cache import RewriteCache
+    from rewriter import PromptRewriter
+    from storage import AssetIndex, LocalStorage
+
+    image = make_image(args.image_edge, args.image_edge, seed=1)
+    main.client = fake_genai_client(image, args.gemini_latency, args.jitter, args.error_rate, args.rate_limit_rate)
+
+    agent = FakeRewriterAgent(name="fake_rewriter", latency=args.agent_latency, jitter=args.jitter)
+    main.SCHEDULER.configure(agent.name, main.SETTINGS.rewriter_max_concurrency, main.SETTINGS.rewriter_rpm)
+    cache = None
+    if args.rewrite_cache:
+        cache = RewriteCache(workdir / "fake_rewrites.sqlite3", fingerprint="benchmark")
+    main.PROMPT_REWRITER = PromptRewriter(agent, cache=cache, scheduler=main.SCHEDULER)
+
+    main.STORAGE = LocalStorage(workdir / "generated", AssetIndex(workdir / "assets.sqlite3"))
+
+
+def _request_kwargs(args, uploads: List[bytes], i: int) -> dict:
+    if args.scenario != "image":
+        return {}
+    data = {
+        "prompt": f"{args.prompt} #{i}",
+        "include_default_google_styles": str(args.google_styles).lower(),
+        "include_default_character": str(args.character).lower(),
+        "include_manga_styles": str(args.manga).lower(),
+    }
+    files = []
+    for j, upload in enumerate(uploads):
+        # --unique-uploads defeats the content-addressed Part cache
+        payload = upload + i.to_bytes(4, "big", signed=True) if args.unique_uploads else upload
+        files.append(("style_images", (f"ref{j}.jpg", payload, "image/jpeg")))
+    return {"data": data, "files": files or None}
+
+
+async def _drive(args, workdir: Path) -> dict:
+    import httpx
+
+    import main
+    from benchmarks.fakes import make_image
+
+    uploads = [make_image(args.upload_edge, args.upload_edge, "JPEG", seed=j) for j in range(args.uploads)]
+    path = SCENARIOS[args.scenario]
+    latencies: List[float] = []
+    windows: List[Tuple[float, float, int]] = []  # (start, end, RSS at start) per measured request
+    errors = 0
+    slots = asyncio.Semaphore(args.concurrency)
+
+    sampler = RssSampler()
+    sampler.start()
+    async with main.app.router.lifespan_context(main.app):
+        _install_fakes(main, args, workdir)
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as http:
+
+            async def one(i: int, record: bool) -> None:
+                nonlocal errors
+                async with slots:
+                    rss_before = sampler.rss()
+                    started = time.perf_counter()
+                    response = await http.post(path, **_request_kwargs(args, uploads, i))
+                    elapsed = time.perf_counter() - started
+                if not record:
+                    return
+                windows.append((started, started + elapsed, rss_before))
+                if response.status_code >= 400:
+                    errors += 1
+                else:
+                    latencies.append(elapsed)
+
+            await asyncio.gather(*(one(-1 - i, False) for i in range(args.warmup)))
+
+            cpu_started = time.process_time()
+            wall_started = time.perf_counter()
+            await asyncio.gather(*(one(i, True) for i in range(args.requests)))
+            wall = time.perf_counter() - wall_started
+            cpu = time.process_time() - cpu_started
+
+    sampler.stop()
+    latencies.sort()
+    growth = sorted(sampler.growth(*w) / (1024 * 1024) for w in windows)
+    ms = lambda seconds: round(seconds * 1000, 1)
+    payloads = main.client.aio.models.payload_bytes
+    return {
+        "scenario": args.scenario,
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "errors": errors,
+        "wall_seconds": round(wall, 3),
+        "throughput_rps": round(args.requests / wall, 2) if wall else 0.0,
+        "p50_ms": ms(percentile(latencies, 50)),
+        "p95_ms": ms(percentile(latencies, 95)),
+        "p99_ms": ms(percentile(latencies, 99)),
+        "max_ms": ms(latencies[-1]) if latencies else 0.0,
+        "cpu_ms_per_request": ms(cpu / args.requests) if args.requests else 0.0,
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "mem_per_request_mb": round(percentile(growth, 95), 1),
+        "avg_payload_kb": round(sum(payloads) / len(payloads) / 1024, 1) if payloads else 0.0,
+        "upstream_calls": len(payloads),
+    }
+
+
+def run_scenario(args) -> dict:
+    """Run one scenario in this process (quietly, unless --verbose)."""
+    with tempfile.TemporaryDirectory(prefix="nb-bench-") as tmp:
+        workdir = Path(tmp)
+        _isolate_state(workdir, args)
+        sink = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(open(os.devnull, "w"))
+        with sink:
+            return asyncio.run(_drive(args, workdir))
+
+
+def _child_argv(args, scenario: str, result_file: str) -> List[str]:
+    argv = [sys.executable, str(Path(__file__).resolve()), "--child", result_file, "-s", scenario]
+    for action in build_parser()._actions:
+        if action.dest in ("help", "scenarios", "child", "save", "baseline", "tolerance"):
+            continue
+        value = getattr(args, action.dest)
+        if isinstance(action, argparse._StoreTrueAction):
+            if value:
+                argv.append(action.option_strings[-1])
+        else:
+            argv += [action.option_strings[-1], str(value)]
+    return argv
+
+
+def compare(results: List[dict], baseline: List[dict], tolerance: float) -> List[str]:
+    """Regressions vs. a saved run: throughput down or p95 up by more than `tolerance`."""
+    problems = []
+    base = {r["scenario"]: r for r in baseline}
+    for r in results:
+        b = base.get(r["scenario"])
+        if b is None:
+            continue
+        if r["throughput_rps"] < b["throughput_rps"] * (1 - tolerance):
+            problems.append(f"{r['scenario']}: throughput {r['throughput_rps']} rps < baseline {b['throughput_rps']}")
+        if r["p95_ms"] > b["p95_ms"] * (1 + tolerance):
+            problems.append(f"{r['scenario']}: p95 {r['p95_ms']} ms > baseline {b['p95_ms']}")
+        if r["errors"] > b["errors"]:
+            problems.append(f"{r['scenario']}: {r['errors']} errors (baseline {b['errors']})")
+    return problems
+
+
+def print_table(results: List[dict]) -> None:
+    columns = ["scenario", "requests", "concurrency", "errors", "throughput_rps", "p50_ms", "p95_ms",
+               "p99_ms", "max_ms", "cpu_ms_per_request", "peak_rss_mb", "mem_per_request_mb", "avg_payload_kb", "upstream_calls"]
+    widths = [max(len(c), *(len(str(r[c])) for r in results)) for c in columns]
+    print("  ".join(c.ljust(w) for c, w in zip(columns, widths)))
+    for r in results:
+        print("  ".join(str(r[c]).ljust(w) for c, w in zip(columns, widths)))
+
+
+def build_parser() -> argparse.ArgumentParser:
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument("-s", "--scenarios", nargs="+", choices=list(SCENARIOS), default=list(SCENARIOS))
+    p.add_argument("-n", "--requests", type=int, default=50, help="measured requests per scenario")
+    p.add_argument("-c", "--concurrency", type=int, default=8, help="requests in flight")
+    p.add_argument("--warmup", type=int, default=2, help="unmeasured requests first (cold caches)")
+    p.add_argument("--gemini-latency", type=float, default=0.5, help="fake image model latency (s)")
+    p.add_argument("--agent-latency", type=float, default=0.3, help="fake rewriter agent latency (s)")
+    p.add_argument("--jitter", type=float, default=0.0, help="+/- uniform jitter on both latencies (s)")
+    p.add_argument("--error-rate", type=float, default=0.0, help="fraction of fake 503s from the image model")
+    p.add_argument("--rate-limit-rate", type=float, default=0.0, help="fraction of fake 429s from the image model")
+    p.add_argument("--image-edge", type=int, default=1024, help="size of the canned generated image (px)")
+    p.add_argument("--uploads", type=int, default=2, help="'image' scenario: uploaded reference images")
+    p.add_argument("--upload-edge", type=int, default=2048, help="'image' scenario: upload size (px)")
+    p.add_argument("--unique-uploads", action="store_true", help="'image' scenario: new upload bytes per request")
+    p.add_argument("--prompt", default="Two researchers discover a new comet")
+    p.add_argument("--manga", action="store_true", help="'image' scenario: include manga styles (runs the rewriter)")
+    p.add_argument("--google-styles", action="store_true", help="'image' scenario: include Google style presets")
+    p.add_argument("--character", action="store_true", help="'image' scenario: include the default character")
+    p.add_argument("--rewrite-cache", action="store_true", help="keep the rewrite cache enabled")
+    p.add_argument("--coalesce", action="store_true",
+                   help="coalesce identical default-flow generations (off: one upstream call per request)")
+    p.add_argument("--pool-size", type=int, default=0, help="default flows: pre-generated results kept ready")
+    p.add_argument("--pool-refill-concurrency", type=int, default=1, help="default flows: concurrent pool refills")
+    p.add_argument("--verbose", action="store_true", help="show the app's own logging")
+    p.add_argument("--save", help="write results as JSON")
+    p.add_argument("--baseline", help="compare against a JSON file from --save; exit 1 on regression")
+    p.add_argument("--tolerance", type=float, default=0.2, help="allowed regression vs. baseline (fraction)")
+    p.add_argument("--child", help=argparse.SUPPRESS)
+    return p
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = build_parser().parse_args(argv)
+
+    if args.child:
+        args.scenario = args.scenarios[0]
+        Path(args.child).write_text(json.dumps(run_scenario(args)))
+        return 0
+
+    results = []
+    for scenario in args.scenarios:
+        with tempfile.NamedTemporaryFile(suffix=".json", delete=False) as f:
+            result_file = f.name
+        try:
+            env = {"MALLOC_MMAP_THRESHOLD_": "131072", **os.environ}
+            if subprocess.run(_child_argv(args, scenario, result_file), cwd=REPO_ROOT, env=env).returncode != 0:
+                print(f"[error] scenario {scenario} crashed (rerun with --verbose for the app log)")
+                return 2
+            results.append(json.loads(Path(result_file).read_text()))
+        finally:
+            os.unlink(result_file)
+    print_table(results)
+
+    if args.save:
+        Path(args.save).write_text(json.dumps(results, indent=2))
+    if args.baseline:
+        problems = compare(results, json.loads(Path(args.baseline).read_text()), args.tolerance)
+        for problem in problems:
+            print(f"[regression] {problem}")
+        return 1 if problems else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,169 @@
+# coalesce.py
+import asyncio
+import time
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, Generic, Hashable, Optional, Set, Tuple, TypeVar
+
+T = TypeVar("T")
+
+
+class _Flight:
+    __slots__ = ("task", "waiters", "delivered")
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+        self.delivered = False
+
+
+class SingleFlight:
+    """
+    Coalesces identical in-flight calls: while a call for `key` is running,
+    further `run(key, ...)` calls wait for its result instead of starting
+    their own. The shared call keeps going as long as anyone waits for it
+    and is cancelled once every caller has gone away.
+    """
+
+    def __init__(self):
+        self._flights: Dict[Hashable, _Flight] = {}
+        self.started = 0
+        self.coalesced = 0
+
+    async def run(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> Tuple[T, bool]:
+        """
+        (result, first): `first` is True for exactly one caller per flight,
+        the first to receive its result (e.g. the one that should store it).
+        """
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = _Flight(asyncio.ensure_future(fn()))
+            self._flights[key] = flight
+            flight.task.add_done_callback(lambda _: self._forget(key, flight))
+            self.started += 1
+        else:
+            self.coalesced += 1
+        flight.waiters += 1
+        try:
+            result = await asyncio.shield(flight.task)
+        finally:
+            flight.waiters -= 1
+            if flight.waiters == 0 and not flight.task.done():
+                # nobody is waiting for it any more; forget it now so a caller
+                # arriving before the task has unwound starts a fresh flight
+                self._forget(key, flight)
+                flight.task.cancel()
+        first = not flight.delivered
+        flight.delivered = True
+        return result, first
+
+    def _forget(self, key: Hashable, flight: _Flight) -> None:
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+        if flight.task.done() and not flight.task.cancelled():
+            flight.task.exception()  # retrieved by the waiters; avoid "never retrieved" noise
+
+    def stats(self) -> dict:
+        return {"in_flight": len(self._flights), "started": self.started, "coalesced": self.coalesced}
+
+
+class ResultPool(Generic[T]):
+    """
+    Up to `size` pre-computed results for one fixed request, each handed out
+    at most once.
+
+    `produce()` returns (key, value); `take(key)` only serves values produced
+    for the same key, so results made from older inputs (e.g. before a
+    preset folder changed) are dropped. Every `take` tops the pool back up
+    in the background with at most `concurrency` `produce()` calls at a
+    time; failures back off exponentially up to `retry_max_seconds`.
+    """
+
+    def __init__(
+            self,
+            name: str,
+            produce: Callable[[], Awaitable[Tuple[str, T]]],
+            size: int,
+            concurrency: int = 1,
+            retry_base_seconds: float = 1.0,
+            retry_max_seconds: float = 60.0,
+    ):
+        self.name = name
+        self.produce = produce
+        self.size = size
+        self.concurrency = max(1, concurrency)
+        self.retry_base_seconds = retry_base_seconds
+        self.retry_max_seconds = retry_max_seconds
+        self._items: Deque[Tuple[str, T]] = deque()
+        self._tasks: Set[asyncio.Task] = set()
+        self._failures = 0
+        self._retry_at = 0.0
+        self._closed = False
+        self.hits = 0
+        self.misses = 0
+        self.dropped = 0
+        self.failed = 0
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def take(self, key: str) -> Optional[T]:
+        """A ready result for `key`, or None (the caller generates one itself)."""
+        value = None
+        while self._items:
+            item_key, item = self._items.popleft()
+            if item_key == key:
+                value = item
+                break
+            self.dropped += 1
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        self.fill()
+        return value
+
+    def fill(self) -> None:
+        """Start refills until `size` results are ready or being produced."""
+        while (not self._closed and len(self._tasks) < self.concurrency
+               and len(self._items) + len(self._tasks) < self.size):
+            task = asyncio.get_running_loop().create_task(self._refill())
+            self._tasks.add(task)
+            task.add_done_callback(self._refilled)
+
+    async def _refill(self) -> None:
+        delay = self._retry_at - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        try:
+            self._items.append(await self.produce())
+        except Exception as e:
+            self.failed += 1
+            self._failures += 1
+            backoff = min(self.retry_max_seconds, self.retry_base_seconds * 2 ** (self._failures - 1))
+            self._retry_at = time.monotonic() + backoff
+            print(f"[warn] {self.name} pool refill failed (retrying in {backoff:.0f}s): {e}")
+        else:
+            self._failures = 0
+
+    def _refilled(self, task: asyncio.Task) -> None:
+        self._tasks.discard(task)
+        if not task.cancelled():
+            self.fill()
+
+    async def close(self) -> None:
+        self._closed = True
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._items.clear()
+
+    def stats(self) -> dict:
+        return {
+            "ready": len(self._items),
+            "refilling": len(self._tasks),
+            "size": self.size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "dropped": self.dropped,
+            "failed": self.failed,
+        }
@@ -0,0 +1,122 @@
+# image_prep.py
+from dataclasses import dataclass
+from io import BytesIO
+from typing import TYPE_CHECKING
+
+from PIL import Image
+
+if TYPE_CHECKING:
+    from google.genai import types
+
+# Formats Gemini accepts as-is
+PASSTHROUGH_MIME_TYPES = {
+    "PNG": "image/png",
+    "JPEG": "image/jpeg",
+    "WEBP": "image/webp",
+}
+
+
+@dataclass(frozen=True)
+class PrepConfig:
+    """
+    How reference images are normalized before upload.
+
+    Images are downscaled so the long edge is at most `max_edge`. Photos are
+    sent as `photo_format` at `quality`; images with transparency or line
+    art (few colors / mostly ink on paper, e.g. manga pages) stay PNG. With
+    `enabled=False` every image is sent as a full-size RGB PNG (the old
+    behaviour).
+    """
+    enabled: bool = True
+    max_edge: int = 1536
+    photo_format: str = "JPEG"
+    quality: int = 85
+
+    def __post_init__(self):
+        if self.photo_format not in PASSTHROUGH_MIME_TYPES:
+            raise ValueError(f"REF_PHOTO_FORMAT must be one of {', '.join(PASSTHROUGH_MIME_TYPES)},"
+                             f" not {self.photo_format!r}")
+
+    def fingerprint(self) -> str:
+        return f"prep:{int(self.enabled)}:{self.max_edge}:{self.photo_format}:{self.quality}"
+
+
+def _has_alpha(img: Image.Image) -> bool:
+    if "transparency" in img.info:
+        return True
+    if img.mode in ("RGBA", "LA", "PA"):
+        return img.getchannel("A").getextrema()[0] < 255
+    return False
+
+
+def _is_grayscale(sample: Image.Image) -> bool:
+    """True if the (small RGB) sample has no meaningful color."""
+    hsv_s = sample.convert("HSV").getchannel("S")
+    return hsv_s.getextrema()[1] <= 24
+
+
+def _is_line_art(sample: Image.Image) -> bool:
+    """Flat graphics or ink-on-paper: few distinct colors or mostly near-black/near-white pixels."""
+    colors = sample.getcolors(maxcolors=64)
+    if colors is not None:
+        return True
+    hist = sample.convert("L").histogram()
+    extremes = sum(hist[:40]) + sum(hist[216:])
+    return extremes / (sample.width * sample.height) >= 0.85
+
+
+def _encode(img: Image.Image, fmt: str, quality: int) -> bytes:
+    buff = BytesIO()
+    if fmt == "JPEG":
+        img.save(buff, format="JPEG", quality=quality, optimize=True)
+    elif fmt == "WEBP":
+        img.save(buff, format="WEBP", quality=quality, method=4)
+    else:
+        img.save(buff, format="PNG")
+    return buff.getvalue()
+
+
+def prepare_reference(data: bytes, config: PrepConfig) -> "types.Part":
+    """Raw image bytes -> ready-to-send Part, downscaled/re-encoded per `config`."""
+    with Image.open(BytesIO(data)) as src:
+        src_format = src.format
+        palette_source = src.mode in ("1", "P")  # indexed color: flat graphics / line art
+        if not config.enabled:
+            return _to_part(_encode(src.convert("RGB"), "PNG", 0), "PNG")
+
+        scale = config.max_edge / max(src.size)
+        needs_resize = scale < 1
+        if needs_resize:
+            # JPEG can decode straight at a reduced scale, saving most of the decode work
+            src.draft("RGB", (max(1, int(src.width * scale)), max(1, int(src.height * scale))))
+            # Shrunk in place (integer box reduce, then LANCZOS) so no second
+            # full-resolution buffer is allocated
+            src.thumbnail((config.max_edge, config.max_edge), Image.Resampling.LANCZOS)
+        else:
+            src.load()
+        img = src
+
+    alpha = _has_alpha(img)
+    sample = img.convert("RGB").resize((64, 64), Image.Resampling.BILINEAR)
+    gray = _is_grayscale(sample)
+    if alpha:
+        fmt = "PNG"
+        img = img.convert("LA" if gray else "RGBA")
+    elif palette_source or _is_line_art(sample):
+        fmt = "PNG"
+        img = img.convert("L" if gray else "RGB")
+    else:
+        fmt = config.photo_format
+        img = img.convert("L" if gray and fmt == "JPEG" else "RGB")
+
+    encoded = _encode(img, fmt, config.quality)
+    # Never make things worse: keep the original when it is already acceptable and smaller
+    if not needs_resize and src_format in PASSTHROUGH_MIME_TYPES and len(data) <= len(encoded):
+        return _to_part(data, src_format)
+    return _to_part(encoded, fmt)
+
+
+def _to_part(data: bytes, fmt: str) -> "types.Part":
+    from google.genai import types  # imported on first use; it is slow to import
+
+    return types.Part(inline_data=types.Blob(mime_type=PASSTHROUGH_MIME_TYPES[fmt], data=data))
@@ -0,0 +1,349 @@
+# jobs.py
+import asyncio
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+TERMINAL_STATUSES = (SUCCEEDED, FAILED)
+
+Upload = Tuple[str, bytes]  # (filename, raw bytes)
+
+
+@dataclass
+class Job:
+    id: str
+    status: str
+    params: dict
+    result_name: Optional[str]
+    error: Optional[str]
+    attempts: int
+    created_at: float
+    updated_at: float
+
+    def to_dict(self) -> dict:
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "result_name": self.result_name,
+            "error": self.error,
+            "attempts": self.attempts,
+            "created_at": self.created_at,
+            "updated_at": self.updated_at,
+        }
+
+
+class JobStore:
+    """
+    SQLite-backed job table plus the raw uploads each job needs.
+    Queued jobs (and their inputs) survive restarts; claiming is atomic, so
+    several worker processes can share one database file.
+
+    A claim is a lease: the job records its owner (`claimed_by`) and when
+    the claim lapses (`lease_expires_at`). The owner renews it while the job
+    runs; a running job whose lease has expired (its process died) can be
+    claimed again by anyone, unless it has already been claimed
+    `max_attempts` times (0 = no limit): then it is marked failed, so a job
+    that keeps killing its worker (e.g. out of memory) is not retried forever.
+    """
+
+    _COLUMNS = "id, status, params, result_name, error, attempts, created_at, updated_at"
+
+    def __init__(self, path: Path, max_attempts: int = 3):
+        self.max_attempts = max_attempts
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(str(path), check_same_thread=False, isolation_level=None, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " id TEXT PRIMARY KEY, status TEXT NOT NULL, params TEXT NOT NULL,"
+            " result_name TEXT, error TEXT, attempts INTEGER NOT NULL DEFAULT 0,"
+            " created_at REAL NOT NULL, updated_at REAL NOT NULL)"
+        )
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(jobs)")}
+        for column, kind in (("claimed_by", "TEXT"), ("lease_expires_at", "REAL")):
+            if column not in columns:  # databases created before leases existed
+                self._db.execute(f"ALTER TABLE jobs ADD COLUMN {column} {kind}")
+        self._db.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs(status, created_at)")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS job_inputs ("
+            " job_id TEXT NOT NULL, idx INTEGER NOT NULL, filename TEXT NOT NULL, data BLOB NOT NULL,"
+            " PRIMARY KEY (job_id, idx))"
+        )
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _row_to_job(row) -> Job:
+        return Job(row[0], row[1], json.loads(row[2]), row[3], row[4], row[5], row[6], row[7])
+
+    def create(self, params: dict, uploads: List[Upload]) -> Job:
+        now = time.time()
+        job = Job(uuid.uuid4().hex, QUEUED, params, None, None, 0, now, now)
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                self._db.execute(
+                    f"INSERT INTO jobs ({self._COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (job.id, job.status, json.dumps(params), None, None, 0, now, now),
+                )
+                self._db.executemany(
+                    "INSERT INTO job_inputs (job_id, idx, filename, data) VALUES (?, ?, ?, ?)",
+                    [(job.id, i, name, data) for i, (name, data) in enumerate(uploads)],
+                )
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            row = self._db.execute(f"SELECT {self._COLUMNS} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._row_to_job(row) if row else None
+
+    def inputs(self, job_id: str) -> List[Upload]:
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT filename, data FROM job_inputs WHERE job_id = ? ORDER BY idx", (job_id,)
+            ).fetchall()
+        return [(name, bytes(data)) for name, data in rows]
+
+    def _fail_abandoned(self, now: float) -> int:
+        """Fail expired claims that have used up `max_attempts` (inside a transaction)."""
+        if self.max_attempts <= 0:
+            return 0
+        rows = self._db.execute(
+            "SELECT id, attempts FROM jobs WHERE status = ?"
+            " AND (lease_expires_at IS NULL OR lease_expires_at < ?) AND attempts >= ?",
+            (RUNNING, now, self.max_attempts),
+        ).fetchall()
+        for job_id, attempts in rows:
+            self._db.execute(
+                "UPDATE jobs SET status = ?, error = ?, updated_at = ?, claimed_by = NULL, lease_expires_at = NULL"
+                " WHERE id = ?",
+                (FAILED, f"Gave up after {attempts} attempts: the worker stopped while running it each time.",
+                 now, job_id),
+            )
+            self._db.execute("DELETE FROM job_inputs WHERE job_id = ?", (job_id,))
+        return len(rows)
+
+    def claim_next(self, owner: str, lease_seconds: float) -> Optional[Job]:
+        """
+        Atomically lease the oldest queued job (or running job whose lease
+        has expired) to `owner` and return it as running.
+        """
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                now = time.time()
+                self._fail_abandoned(now)
+                row = self._db.execute(
+                    f"SELECT {self._COLUMNS} FROM jobs WHERE status = ?"
+                    " OR (status = ? AND (lease_expires_at IS NULL OR lease_expires_at < ?))"
+                    " ORDER BY created_at LIMIT 1",
+                    (QUEUED, RUNNING, now),
+                ).fetchone()
+                if row is None:
+                    self._db.execute("COMMIT")
+                    return None
+                self._db.execute(
+                    "UPDATE jobs SET status = ?, attempts = attempts + 1, updated_at = ?,"
+                    " claimed_by = ?, lease_expires_at = ? WHERE id = ?",
+                    (RUNNING, now, owner, now + lease_seconds, row[0]),
+                )
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+        job = self._row_to_job(row)
+        job.status, job.attempts, job.updated_at = RUNNING, job.attempts + 1, now
+        return job
+
+    def renew(self, job_id: str, owner: str, lease_seconds: float) -> bool:
+        """Extend `owner`'s lease on a running job; False if the job is no longer theirs."""
+        with self._lock:
+            cur = self._db.execute(
+                "UPDATE jobs SET lease_expires_at = ? WHERE id = ? AND status = ? AND claimed_by = ?",
+                (time.time() + lease_seconds, job_id, RUNNING, owner),
+            )
+        return cur.rowcount == 1
+
+    def _finish(self, job_id: str, owner: str, status: str, result_name: Optional[str],
+                error: Optional[str]) -> bool:
+        """Record the outcome, unless the lease was lost and someone else now owns the job."""
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                cur = self._db.execute(
+                    "UPDATE jobs SET status = ?, result_name = ?, error = ?, updated_at = ?,"
+                    " claimed_by = NULL, lease_expires_at = NULL"
+                    " WHERE id = ? AND status = ? AND claimed_by = ?",
+                    (status, result_name, error, time.time(), job_id, RUNNING, owner),
+                )
+                if cur.rowcount and status in TERMINAL_STATUSES:
+                    self._db.execute("DELETE FROM job_inputs WHERE job_id = ?", (job_id,))
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+        return cur.rowcount == 1
+
+    def succeed(self, job_id: str, owner: str, result_name: str) -> bool:
+        return self._finish(job_id, owner, SUCCEEDED, result_name, None)
+
+    def fail(self, job_id: str, owner: str, error: str) -> bool:
+        return self._finish(job_id, owner, FAILED, None, error)
+
+    def release(self, job_id: str, owner: str) -> bool:
+        """Hand an unfinished job back to the queue (e.g. on shutdown)."""
+        return self._finish(job_id, owner, QUEUED, None, None)
+
+    def requeue_expired(self) -> Tuple[int, int]:
+        """
+        Running jobs whose lease has expired (their process died) go back to
+        the queue, or fail if they are out of attempts. Returns (requeued, failed).
+        """
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                now = time.time()
+                failed = self._fail_abandoned(now)
+                cur = self._db.execute(
+                    "UPDATE jobs SET status = ?, updated_at = ?, claimed_by = NULL, lease_expires_at = NULL"
+                    " WHERE status = ? AND (lease_expires_at IS NULL OR lease_expires_at < ?)",
+                    (QUEUED, now, RUNNING, now),
+                )
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+        return cur.rowcount, failed
+
+    def counts(self) -> dict:
+        with self._lock:
+            rows = self._db.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return dict(rows)
+
+
+JobHandler = Callable[[Job, List[Upload]], Awaitable[str]]
+
+
+class JobQueue:
+    """
+    Pool of asyncio workers draining a JobStore.
+
+    `handler(job, uploads)` performs the work and returns the stored result
+    name; any exception marks the job failed with its message. Waiters can
+    long-poll a job via `wait()`.
+
+    Claims are leased for `lease_seconds` and renewed every third of that
+    while the handler runs, so jobs of a live sibling process are never
+    taken over; those of a dead one are, once their lease expires.
+    """
+
+    def __init__(self, store: JobStore, handler: JobHandler, workers: int = 2, poll_interval: float = 1.0,
+                 lease_seconds: float = 60.0):
+        self.store = store
+        self.handler = handler
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._tasks: List[asyncio.Task] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._done: Dict[str, asyncio.Event] = {}
+        self._waiters: Dict[str, int] = {}
+
+    async def start(self) -> None:
+        self._wakeup = asyncio.Event()
+        requeued, failed = await asyncio.to_thread(self.store.requeue_expired)
+        if requeued:
+            print(f"[info] requeued {requeued} interrupted jobs")
+        if failed:
+            print(f"[warn] failed {failed} interrupted jobs that ran out of attempts")
+        self._tasks = [asyncio.create_task(self._worker(i)) for i in range(self.workers)]
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def submit(self, params: dict, uploads: List[Upload]) -> Job:
+        job = await asyncio.to_thread(self.store.create, params, uploads)
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return job
+
+    async def wait(self, job_id: str, timeout: float) -> Optional[Job]:
+        """Return the job once it reaches a terminal state or `timeout` seconds pass."""
+        job = await asyncio.to_thread(self.store.get, job_id)
+        if job is None or job.status in TERMINAL_STATUSES or timeout <= 0:
+            return job
+        event = self._done.setdefault(job_id, asyncio.Event())
+        self._waiters[job_id] = self._waiters.get(job_id, 0) + 1
+        deadline = time.monotonic() + timeout
+        try:
+            # the job may be run by another process, so re-check the store periodically
+            while time.monotonic() < deadline:
+                try:
+                    await asyncio.wait_for(event.wait(), min(self.poll_interval, deadline - time.monotonic()))
+                except asyncio.TimeoutError:
+                    pass
+                job = await asyncio.to_thread(self.store.get, job_id)
+                if job is None or job.status in TERMINAL_STATUSES:
+                    break
+        finally:
+            # the last waiter drops the event (the worker only drops events for jobs it ran)
+            left = self._waiters.pop(job_id) - 1
+            if left:
+                self._waiters[job_id] = left
+            elif self._done.get(job_id) is event:
+                del self._done[job_id]
+        return job
+
+    async def _keep_lease(self, job_id: str) -> None:
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            if not await asyncio.to_thread(self.store.renew, job_id, self.owner, self.lease_seconds):
+                print(f"[warn] job {job_id}: lease lost")
+                return
+
+    async def _worker(self, worker_id: int) -> None:
+        while True:
+            job = await asyncio.to_thread(self.store.claim_next, self.owner, self.lease_seconds)
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            lease = asyncio.create_task(self._keep_lease(job.id))
+            try:
+                uploads = await asyncio.to_thread(self.store.inputs, job.id)
+                result_name = await self.handler(job, uploads)
+            except asyncio.CancelledError:
+                self.store.release(job.id, self.owner)  # shutting down: back to the queue right away
+                raise
+            except Exception as e:
+                detail = getattr(e, "detail", None) or str(e) or type(e).__name__
+                print(f"[warn] job {job.id} failed: {detail}")
+                await asyncio.to_thread(self.store.fail, job.id, self.owner, str(detail))
+            else:
+                await asyncio.to_thread(self.store.succeed, job.id, self.owner, result_name)
+            finally:
+                lease.cancel()
+            event = self._done.pop(job.id, None)
+            if event is not None:
+                event.set()
@@ -1,67 +1,274 @@
 # main.py
-import os
-from io import BytesIO
-from pathlib import Path
-from datetime import datetime
-from typing import List, Optional
-
-from fastapi import FastAPI, Request, UploadFile, File, Form, HTTPException
-from fastapi.responses import HTMLResponse, FileResponse
-from fastapi.staticfiles import StaticFiles
-from fastapi.templating import Jinja2Templates
-from fastapi.middleware.cors import CORSMiddleware
+import time
 
-from dotenv import load_dotenv
-from google import genai
-from google.genai import types
-from PIL import Image
-import glob
+_IMPORT_STARTED = time.perf_counter()
 
+import asyncio
+import base64
+import hashlib
 import json
+import mimetypes
 import re
-from google.adk.runners import Runner
-from google.adk.sessions import InMemorySessionService
-from google.genai import types
-from nano_banana_prompt_agent.agent import root_agent  # your Agent(...) from the question
-import os
-from dotenv import load_dotenv
+import threading
+from contextlib import asynccontextmanager
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
 
-# ---------------- Paths & Env ----------------
-BASE_DIR = Path(__file__).resolve().parent
-STATIC_DIR = BASE_DIR / "static"
-TEMPLATES_DIR = BASE_DIR / "templates"
-OUTPUT_DIR = BASE_DIR / "generated"
+from fastapi import APIRouter, FastAPI, Request, UploadFile, File, Form, HTTPException
+from fastapi.responses import HTMLResponse, FileResponse, Response, StreamingResponse
+from fastapi.staticfiles import StaticFiles
+from fastapi.templating import Jinja2Templates
+from fastapi.middleware.cors import CORSMiddleware
+from starlette.background import BackgroundTask
+
+from assembly import ContentAssembly, ContentAssemblyError, ContentBuilder
+from coalesce import ResultPool, SingleFlight
+from part_cache import PartCache
+from presets import PresetLibrary
+from image_prep import prepare_reference
+from jobs import FAILED, SUCCEEDED, Job, JobQueue, JobStore, Upload
+from metrics import (
+    IMAGE_BYTES, PAYLOAD_BYTES, REFERENCE_BYTES_SAVED, REGISTRY, REQUEST_SECONDS, stage, timeline_scope,
+)
+from scheduler import (
+    PRIORITY_BACKGROUND, PRIORITY_BATCH, GeminiScheduler, current_client, is_rate_limited, scheduling_scope,
+)
+from settings import Settings
+from storage import AssetIndex, LocalStorage, S3Storage, Storage, StoredAsset
+from thumbnails import THUMBNAIL_FORMATS, THUMBNAIL_WIDTHS, render_thumbnail, thumbnail_name
+from uploads import RequestBodyLimit, UploadReader, UploadRejected
+
+# google.genai and google.adk take seconds to import; they are loaded on
+# first use (or by the background warmup), never at import time.
+if TYPE_CHECKING:
+    from google import genai
+    from google.genai import types
+    from rewrite_cache import RewriteCache
+    from rewriter import PromptRewriter
+
+# ---------------- Settings ----------------
+# Replaced by the Settings passed to create_app() once the app starts.
+SETTINGS = Settings.from_env()
+
+# ---------------- Startup timing ----------------
+STARTUP: Dict[str, float] = {}  # phase -> seconds
+
+
+def _record_startup(phase: str, seconds: float) -> None:
+    STARTUP[phase] = round(seconds, 3)
+    print(f"[startup] {phase}: {seconds:.3f}s")
+
+
+# ---------------- Resources ----------------
+# Built from the app's Settings by the lifespan handler (_init_resources).
+# The genai client and the ADK prompt rewriter are created on first use.
+client: Optional["genai.Client"] = None
+SCHEDULER: Optional[GeminiScheduler] = None
+STORAGE: Optional[Storage] = None
+PART_CACHE: Optional[PartCache] = None
+PRESET_GOOGLE: Optional[PresetLibrary] = None
+PRESET_MANGA: Optional[PresetLibrary] = None
+JOB_QUEUE: Optional[JobQueue] = None
+SINGLE_FLIGHT: Optional[SingleFlight] = None
+DEFAULT_POOLS: Dict[str, ResultPool] = {}  # flow -> pre-generated images
+REWRITE_CACHE: Optional["RewriteCache"] = None
+PROMPT_REWRITER: Optional["PromptRewriter"] = None
+TEMPLATES: Optional[Jinja2Templates] = None
+_client_lock = threading.Lock()
+_rewriter_lock = threading.Lock()
+
+
+def _build_storage(settings: Settings) -> Storage:
+    index = AssetIndex(settings.storage_index_path)
+    retention = dict(max_bytes=settings.storage_max_bytes, max_age_seconds=settings.storage_max_age_days * 86400)
+    if settings.storage_backend == "s3":
+        if not settings.s3_bucket:
+            raise RuntimeError("STORAGE_BACKEND=s3 requires S3_BUCKET.")
+        return S3Storage(settings.s3_bucket, index, prefix=settings.s3_prefix,
+                         endpoint_url=settings.s3_endpoint_url, **retention)
+    if settings.storage_backend != "local":
+        raise RuntimeError(f"Unknown STORAGE_BACKEND: {settings.storage_backend!r}")
+    return LocalStorage(settings.output_dir, index, **retention)
+
+
+def _init_resources(settings: Settings) -> None:
+    """Create the process-wide resources for `settings` (cheap: no network, no image decoding)."""
+    global SETTINGS, SCHEDULER, STORAGE, PART_CACHE, PRESET_GOOGLE, PRESET_MANGA, JOB_QUEUE, SINGLE_FLIGHT, DEFAULT_POOLS
+    global TEMPLATES
+    SETTINGS = settings
+    settings.output_dir.mkdir(parents=True, exist_ok=True)
+    TEMPLATES = Jinja2Templates(directory=str(settings.templates_dir))
+
+    # Every upstream model call (image generation and the ADK rewriter) goes
+    # through one scheduler: per-model concurrency + rate budget, fair queuing
+    # across clients, and retries with backoff.
+    SCHEDULER = GeminiScheduler(
+        max_retries=settings.gemini_max_retries,
+        base_delay=settings.gemini_retry_base_seconds,
+        max_delay=settings.gemini_retry_max_seconds,
+    )
+    SCHEDULER.configure(settings.model_name, settings.max_inflight_generations, settings.gemini_image_rpm)
 
-GOOGLE_STYLES_DIR = BASE_DIR / "GoogleStyles"
-MANGA_STYLES_DIR = BASE_DIR / "MangaStyles"
-DEFAULT_CHARACTER_PATH = BASE_DIR / "Default_Character" / "fornite_banana.png"
+    STORAGE = _build_storage(settings)
 
-OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
+    # Encoded reference images keyed by source-content hash (uploads + default character)
+    PART_CACHE = PartCache(max_bytes=settings.part_cache_max_bytes, namespace=settings.prep.fingerprint())
 
-# Load .env
-load_dotenv(dotenv_path=BASE_DIR / ".env")
+    # Style presets: loaded on first use (or by warmup), refreshed when files change
+    preset_options = dict(
+        rescan_interval=settings.preset_rescan_seconds,
+        pack_dir=settings.preset_pack_dir if settings.preset_pack else None,
+        fingerprint=settings.prep.fingerprint(),
+    )
+    PRESET_GOOGLE = PresetLibrary(settings.google_styles_dir, _encode_reference, **preset_options)
+    PRESET_MANGA = PresetLibrary(settings.manga_styles_dir, _encode_reference, **preset_options)
+
+    JOB_QUEUE = JobQueue(JobStore(settings.job_db_path, settings.job_max_attempts), _run_generation_job, workers=settings.job_workers,
+                         lease_seconds=settings.job_lease_seconds)
+
+    # Concurrent identical generations share one upstream call; the fixed
+    # default flows can also keep a few results ready (filled on first use or by warmup)
+    SINGLE_FLIGHT = SingleFlight() if settings.coalesce_generations else None
+    DEFAULT_POOLS = {}
+    if settings.default_pool_size > 0:
+        for flow in DEFAULT_FLOWS:
+            DEFAULT_POOLS[flow] = ResultPool(
+                flow,
+                lambda flow=flow: _produce_default(flow),
+                size=settings.default_pool_size,
+                concurrency=settings.default_pool_refill_concurrency,
+                retry_base_seconds=settings.gemini_retry_base_seconds,
+                retry_max_seconds=max(60.0, settings.gemini_retry_max_seconds),
+            )
 
-API_KEY = os.environ.get("GEMINI_API_KEY")
-if not API_KEY:
-    raise RuntimeError("GEMINI_API_KEY not set.")
 
-MODEL_NAME = "gemini-2.5-flash-image-preview"
+def _get_client() -> "genai.Client":
+    """The shared genai client, created on first use (blocking; the import is slow)."""
+    global client
+    if client is None:
+        with _client_lock:
+            if client is None:
+                if not SETTINGS.gemini_api_key:
+                    raise HTTPException(status_code=503, detail="GEMINI_API_KEY not set.")
+                from google import genai
+                client = genai.Client(api_key=SETTINGS.gemini_api_key)
+    return client
+
+
+def _get_rewriter() -> "PromptRewriter":
+    """The shared prompt rewriter (one ADK Runner, persistent cache), created on first use (blocking)."""
+    global REWRITE_CACHE, PROMPT_REWRITER
+    if PROMPT_REWRITER is None:
+        with _rewriter_lock:
+            if PROMPT_REWRITER is None:
+                from nano_banana_prompt_agent.agent import root_agent
+                from rewrite_cache import RewriteCache, agent_fingerprint
+                from rewriter import PromptRewriter
+
+                SCHEDULER.configure(root_agent.model, SETTINGS.rewriter_max_concurrency, SETTINGS.rewriter_rpm)
+                REWRITE_CACHE = RewriteCache(
+                    SETTINGS.rewrite_cache_path,
+                    fingerprint=agent_fingerprint(root_agent),
+                    ttl_seconds=SETTINGS.rewrite_cache_ttl_seconds,
+                    max_entries=SETTINGS.rewrite_cache_max_entries,
+                )
+                PROMPT_REWRITER = PromptRewriter(root_agent, cache=REWRITE_CACHE, scheduler=SCHEDULER)
+    return PROMPT_REWRITER
+
+
+async def _warmup() -> None:
+    """Pay the first-use costs in the background once the server is accepting requests."""
+    steps = [
+        ("warmup.presets", lambda: (PRESET_GOOGLE.snapshot(), PRESET_MANGA.snapshot())),
+        ("warmup.default_character", _load_default_character),
+        ("warmup.rewriter", _get_rewriter),
+    ]
+    if SETTINGS.gemini_api_key:
+        steps.insert(2, ("warmup.genai_client", _get_client))
+    started = time.perf_counter()
+    for phase, fn in steps:
+        step_started = time.perf_counter()
+        try:
+            await asyncio.to_thread(fn)
+        except Exception as e:
+            print(f"[warn] {phase} failed: {e}")
+        else:
+            _record_startup(phase, time.perf_counter() - step_started)
+    if SETTINGS.gemini_api_key:
+        for pool in DEFAULT_POOLS.values():
+            pool.fill()
+    _record_startup("warmup", time.perf_counter() - started)
+
 
 # ---------------- App ----------------
-app = FastAPI(title="Gemini Image Generator (Google + Manga)")
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],  # tighten for prod
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+def create_app(settings: Optional[Settings] = None) -> FastAPI:
+    """
+    Build the ASGI app. Resources are created when the app starts (lifespan),
+    so this is cheap and works offline. Resources are process-wide: run one
+    app per process.
+    """
+    settings = settings or Settings.from_env()
+
+    @asynccontextmanager
+    async def lifespan(app: FastAPI):
+        started = time.perf_counter()
+        _init_resources(settings)
+        if not settings.gemini_api_key:
+            print("[warn] GEMINI_API_KEY not set; generation requests will fail with 503.")
+        await JOB_QUEUE.start()
+        _record_startup("resources", time.perf_counter() - started)
+        _record_startup("ready", time.perf_counter() - _IMPORT_STARTED)
+        warmup = asyncio.create_task(_warmup()) if settings.warmup else None
+        try:
+            yield
+        finally:
+            if warmup is not None:
+                warmup.cancel()
+            await asyncio.gather(*(pool.close() for pool in DEFAULT_POOLS.values()))
+            await JOB_QUEUE.stop()
+
+    app = FastAPI(title="Gemini Image Generator (Google + Manga)", lifespan=lifespan)
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=["*"],  # tighten for prod
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
+    app.middleware("http")(scheduling_client)
+    app.middleware("http")(request_metrics)
+    # outermost: oversized bodies are refused before (or while) they are parsed
+    app.add_middleware(RequestBodyLimit, max_bytes=settings.uploads.max_body_bytes)
+    app.mount("/static", StaticFiles(directory=str(settings.static_dir)), name="static")
+    app.include_router(router)
+    return app
+
+
+router = APIRouter()
 
-app.mount("/static", StaticFiles(directory=str(STATIC_DIR)), name="static")
-templates = Jinja2Templates(directory=str(TEMPLATES_DIR))
 
-# ---------------- Google Client ----------------
-client = genai.Client(api_key=API_KEY)
+async def scheduling_client(request: Request, call_next):
+    """Tag upstream calls made for this request with the caller, for per-client fair queuing."""
+    client_id = request.headers.get("x-client-id") or (request.client.host if request.client else None)
+    with scheduling_scope(client_id=client_id):
+        return await call_next(request)
+
+
+async def request_metrics(request: Request, call_next):
+    """Per-route latency histogram, plus the optional per-request stage timeline."""
+    started = time.perf_counter()
+    status = 500
+    with timeline_scope(f"{request.method} {request.url.path}", enabled=SETTINGS.request_timelines) as timeline:
+        try:
+            response = await call_next(request)
+            status = response.status_code
+            return response
+        finally:
+            route = request.scope.get("route")
+            route_path = getattr(route, "path", None) or "unmatched"
+            REQUEST_SECONDS.observe(time.perf_counter() - started, request.method, route_path, str(status))
+            if timeline is not None:
+                timeline.name = f"{request.method} {route_path} {status}"
+
 
 # ---------------- Prompts ----------------
 DEFAULT_PROMPT = """
@@ -80,54 +287,60 @@ Typography: short, legible English text in balloons; 1–2 words for SFX. Ratio
 
 
 # ---------------- Utilities ----------------
-def _img_to_part(img: Image.Image, fmt: str = "PNG") -> types.Part:
-    """Convert PIL image to a types.Part with inline_data (data + mime_type)."""
-    buff = BytesIO()
-    img.save(buff, format=fmt)
-    return types.Part(inline_data=types.Blob(
-        mime_type=f"image/{fmt.lower()}",
-        data=buff.getvalue()
-    ))
-
-
-def _load_preset_parts_from_dir(folder: Path, patterns=("*.png", "*.jpg", "*.jpeg")) -> List[types.Part]:
-    """Load all images in a folder as types.Part; sorted by name for determinism."""
-    parts: List[types.Part] = []
-    if not folder.exists():
-        print(f"[warn] missing folder: {folder}")
-        return parts
-    files = []
-    for pat in patterns:
-        files.extend(glob.glob(str(folder / pat)))
-    for p in sorted(files):
-        try:
-            img = Image.open(p).convert("RGB")
-            parts.append(_img_to_part(img, fmt="PNG"))
-        except Exception as e:
-            print(f"[warn] failed to open {p}: {e}")
-    return parts
+ImageGroup = Tuple[List["types.Part"], List[int]]  # (parts, source sizes before preprocessing)
+
+
+def _encode_reference(data: bytes) -> "types.Part":
+    """Raw image bytes -> Part, downscaled and re-encoded according to SETTINGS.prep."""
+    return prepare_reference(data, SETTINGS.prep)
+
+
+def _load_default_character() -> Optional[ImageGroup]:
+    """Default character as a Part (+ source size), served from PART_CACHE after the first load."""
+    if not SETTINGS.default_character_path.exists():
+        return None
+    try:
+        data = SETTINGS.default_character_path.read_bytes()
+        return [PART_CACHE.get_or_create(data, _encode_reference)], [len(data)]
+    except Exception as e:
+        print(f"[warn] failed to load default character: {e}")
+        return None
 
 
-def _load_uploads(uploaded: Optional[List[UploadFile]]) -> List[types.Part]:
-    """Safely read uploaded images; skip empty fields; return as Parts."""
+async def _read_uploads(uploaded: Optional[List[UploadFile]]) -> List[Upload]:
+    """
+    Read uploaded files as (filename, bytes) within SETTINGS.uploads; skip
+    empty fields. 413 past a byte/pixel limit, 400 for unreadable images.
+    """
     if not uploaded:
         return []
-    parts: List[types.Part] = []
-    for f in uploaded:
-        if not f or not getattr(f, "filename", None):
-            continue
-        data = f.file.read()
-        if not data:
-            continue
+    uploads: List[Upload] = []
+    reader = UploadReader(SETTINGS.uploads)
+    with stage("read_uploads"):
+        for f in uploaded:
+            if not f or not getattr(f, "filename", None):
+                continue
+            try:
+                data = await reader.read(f)
+            except UploadRejected as e:
+                raise HTTPException(status_code=e.status, detail=str(e))
+            if data:
+                uploads.append((f.filename, data))
+    return uploads
+
+
+def _load_uploads(uploads: List[Upload]) -> ImageGroup:
+    """Safely decode uploaded images; return as Parts (+ source sizes)."""
+    parts: List["types.Part"] = []
+    for filename, data in uploads:
         try:
-            img = Image.open(BytesIO(data)).convert("RGB")
-            parts.append(_img_to_part(img, fmt="PNG"))
+            parts.append(PART_CACHE.get_or_create(data, _encode_reference))
         except Exception as e:
             raise HTTPException(
                 status_code=400,
-                detail=f"Could not read uploaded image '{getattr(f, 'filename', '') or '(unknown)'}': {e}"
+                detail=f"Could not read uploaded image '{filename or '(unknown)'}': {e}"
             )
-    return parts
+    return parts, [len(data) for _, data in uploads]
 
 
 def _extract_image_bytes(gen_response) -> bytes:
@@ -141,185 +354,398 @@ def _extract_image_bytes(gen_response) -> bytes:
     return b""
 
 
-def _save_png(image_bytes: bytes) -> Path:
-    ts = datetime.utcnow().strftime("%Y%m%d_%H%M%S%f")
-    out_path = OUTPUT_DIR / f"generated_{ts}.png"
-    img = Image.open(BytesIO(image_bytes))
-    img.save(out_path)
-    return out_path
+# magic-byte prefix -> (mime type, file extension)
+_IMAGE_SIGNATURES = (
+    (b"\x89PNG\r\n\x1a\n", "image/png", ".png"),
+    (b"\xff\xd8\xff", "image/jpeg", ".jpg"),
+    (b"RIFF", "image/webp", ".webp"),
+)
 
 
-def extract_json_block(text: str) -> str | None:
-    """
-    Try to recover a JSON object from a model response that may include
-    Markdown fences, prose, or other wrappers.
-    """
-    # 1) Fast path: direct JSON
-    try:
-        json.loads(text)
-        return text
-    except Exception:
-        pass
-
-    # 2) Strip Markdown code fences ```json ... ``` or ``` ... ```
-    fence_match = re.search(r"```(?:json)?\s*(.*?)\s*```", text, re.DOTALL | re.IGNORECASE)
-    if fence_match:
-        candidate = fence_match.group(1).strip()
-        try:
-            json.loads(candidate)
-            return candidate
-        except Exception:
-            text = candidate  # fall through
-
-    # 3) Fallback: extract the first balanced { ... } object
-    start = text.find("{")
-    while start != -1:
-        depth = 0
-        in_str = False
-        escape = False
-        for i, ch in enumerate(text[start:], start=start):
-            if in_str:
-                if escape:
-                    escape = False
-                elif ch == "\\":
-                    escape = True
-                elif ch == '"':
-                    in_str = False
-            else:
-                if ch == '"':
-                    in_str = True
-                elif ch == "{":
-                    depth += 1
-                elif ch == "}":
-                    depth -= 1
-                    if depth == 0:
-                        candidate = text[start:i + 1]
-                        try:
-                            json.loads(candidate)
-                            return candidate
-                        except Exception:
-                            break
-        start = text.find("{", start + 1)
+def _sniff_image(image_bytes: bytes) -> Optional[tuple]:
+    """(mime, ext) from the header bytes only, or None if it is not a known image format."""
+    for magic, mime, ext in _IMAGE_SIGNATURES:
+        if image_bytes.startswith(magic):
+            if mime == "image/webp" and image_bytes[8:12] != b"WEBP":
+                continue
+            return mime, ext
     return None
 
 
-def rewrite_prompt(raw_prompt: str) -> str:
+async def rewrite_prompt(raw_prompt: str) -> str:
     """
-    Run the root_agent pipeline synchronously to rewrite a user prompt.
+    Rewrite a user prompt with root_agent via the shared PROMPT_REWRITER.
     Returns the rewritten prompt, or the original raw prompt if rewriting fails.
     """
-    APP_NAME = "prompt_rewriter_app"
-    USER_ID = "local_user"
-    SESSION_ID = "test_session"
-
-    session_service = InMemorySessionService()
-    session_service.create_session(
-        app_name=APP_NAME, user_id=USER_ID, session_id=SESSION_ID
-    )
-    runner = Runner(
-        agent=root_agent,
-        app_name=APP_NAME,
-        session_service=session_service,
+    try:
+        rewriter = PROMPT_REWRITER or await asyncio.to_thread(_get_rewriter)
+    except Exception as e:
+        print(f"[warn] prompt rewriter unavailable, using the raw prompt: {e}")
+        return raw_prompt
+    return await rewriter.rewrite_prompt(raw_prompt)
+
+
+def _describe_output(image_bytes: bytes, prompt: Optional[str] = None) -> StoredAsset:
+    """Check the image header and name the asset it will be stored as."""
+    with stage("describe_output"):
+        sniffed = _sniff_image(image_bytes)
+        if sniffed is None:
+            raise HTTPException(status_code=502, detail="Gemini returned data that is not a PNG/JPEG/WebP image.")
+        mime, ext = sniffed
+        prompt_hash = hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:16] if prompt else None
+        return STORAGE.describe(image_bytes, mime, ext, prompt_hash=prompt_hash)
+
+
+def _store_output(asset: StoredAsset, image_bytes: bytes) -> None:
+    """Persist a generated image (blocking; run in a thread or as a background task)."""
+    with stage("store"):
+        STORAGE.put(asset, image_bytes)
+
+
+def _image_response(image_bytes: bytes, asset: StoredAsset, assembly: ContentAssembly,
+                    store: bool = True) -> Response:
+    """Serve the bytes straight from memory and persist them to STORAGE after the response is sent."""
+    return Response(
+        content=image_bytes,
+        media_type=asset.mime_type,
+        headers={
+            "Content-Disposition": f'attachment; filename="{asset.name}"',
+            "X-Reference-Bytes-Saved": str(assembly.bytes_saved),
+        },
+        background=BackgroundTask(_store_output, asset, image_bytes) if store else None,
     )
 
-    content = types.Content(role="user", parts=[types.Part(text=raw_prompt)])
-    final_text = None
-    for event in runner.run(user_id=USER_ID, session_id=SESSION_ID, new_message=content):
-        if event.is_final_response():
-            if event.content and event.content.parts and getattr(event.content.parts[0], "text", None):
-                final_text = event.content.parts[0].text.strip()
-            break
 
-    if not final_text:
-        return raw_prompt
+async def _generate_content(contents: list):
+    """Call Gemini through the async client, admitted by SCHEDULER (fairness, rate budget, retries)."""
+    gemini = client or await asyncio.to_thread(_get_client)
+    model = SETTINGS.model_name
+    with stage("gemini"):
+        return await SCHEDULER.call(
+            model,
+            lambda: gemini.aio.models.generate_content(model=model, contents=contents),
+        )
 
-    parsed = extract_json_block(final_text)
-    if not parsed:
-        return raw_prompt
 
+async def _generate_image_bytes(assembly: ContentAssembly) -> bytes:
+    """Run one Gemini generation for `assembly` and return the raw image bytes."""
     try:
-        obj = json.loads(parsed)
-        return obj.get("rewritten_prompt", raw_prompt)
-    except Exception:
-        return raw_prompt
+        response = await _generate_content(assembly.contents())
+    except HTTPException:
+        raise
+    except Exception as e:
+        if is_rate_limited(e):
+            raise HTTPException(status_code=503, detail=f"Gemini quota exhausted, try again shortly: {e}",
+                                headers={"Retry-After": str(int(SETTINGS.gemini_retry_max_seconds))})
+        raise HTTPException(status_code=502, detail=f"Gemini generation failed: {e}")
+
+    with stage("extract_image"):
+        image_bytes = _extract_image_bytes(response)
+    if not image_bytes:
+        raise HTTPException(status_code=502, detail="No image bytes returned from Gemini.")
+    IMAGE_BYTES.observe(len(image_bytes))
+    return image_bytes
+
+
+async def _generate_output(assembly: ContentAssembly) -> Tuple[bytes, StoredAsset]:
+    image_bytes = await _generate_image_bytes(assembly)
+    return image_bytes, _describe_output(image_bytes, assembly.prompt)
 
 
-# ---------------- Preloaded style refs ----------------
-PRESET_GOOGLE_PARTS = _load_preset_parts_from_dir(GOOGLE_STYLES_DIR)
-PRESET_MANGA_PARTS = _load_preset_parts_from_dir(MANGA_STYLES_DIR)
+def _generation_key(assembly: ContentAssembly) -> str:
+    return f"{SETTINGS.model_name}:{assembly.fingerprint()}"
+
+
+async def _generate_image_response(assembly: ContentAssembly, key: Optional[str] = None) -> Response:
+    """
+    Generate an image for `assembly` and return it; the stored copy is
+    written in the background. With a `key` (the fixed default flows),
+    identical requests already in flight share that generation (and its
+    stored copy); user requests always get their own.
+    """
+    if SINGLE_FLIGHT is None or key is None:
+        image_bytes, asset = await _generate_output(assembly)
+        return _image_response(image_bytes, asset, assembly)
+    (image_bytes, asset), first = await SINGLE_FLIGHT.run(key, lambda: _generate_output(assembly))
+    return _image_response(image_bytes, asset, assembly, store=first)
+
+
+def _assemble_contents(image_groups: List[ImageGroup], prompt: str) -> ContentAssembly:
+    """Build validated contents (images in order, then one prompt); 400 on malformed input."""
+    builder = ContentBuilder(max_images=SETTINGS.max_reference_images)
+    try:
+        with stage("assemble"):
+            for parts, source_sizes in image_groups:
+                builder.add_images(parts, source_sizes)
+            assembly = builder.set_prompt(prompt).build()
+    except ContentAssemblyError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    PAYLOAD_BYTES.observe(assembly.payload_bytes)
+    REFERENCE_BYTES_SAVED.inc(amount=assembly.bytes_saved)
+    return assembly
+
+
+def _prepare_reference_parts(uploads: List[Upload], include_default_character: bool) -> ImageGroup:
+    """Reference-image stage of generate_image_api: user uploads first, then the optional default character."""
+    with stage("prepare_references"):
+        parts, sizes = _load_uploads(uploads)
+        if include_default_character:
+            character = _load_default_character()
+            if character is not None:
+                parts += character[0]
+                sizes += character[1]
+    return parts, sizes
+
+
+async def _gather_or_cancel(*aws):
+    """asyncio.gather, but the remaining awaitables are cancelled as soon as one fails."""
+    tasks = [asyncio.ensure_future(a) for a in aws]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
+
+
+async def _prepare_image_groups(
+        uploads: List[Upload],
+        include_default_google_styles: bool,
+        include_default_character: bool,
+        include_manga_styles: bool,
+) -> List[ImageGroup]:
+    """Reference images in contents order: uploads, default character, manga styles, google styles."""
+    # CPU-bound decoding/encoding happens in a worker thread
+    image_groups = [await asyncio.to_thread(_prepare_reference_parts, uploads, include_default_character)]
+    with stage("presets"):
+        if include_manga_styles:
+            image_groups.append(await PRESET_MANGA.asnapshot())
+        if include_default_google_styles:
+            image_groups.append(await PRESET_GOOGLE.asnapshot())
+    return image_groups
+
+
+async def _resolve_prompt(prompt: str, include_manga_styles: bool) -> str:
+    """Final text prompt: agent-rewritten for manga requests, DEFAULT_PROMPT when blank."""
+    final_prompt = prompt.strip() or DEFAULT_PROMPT
+    if include_manga_styles:
+        with stage("rewrite"):
+            rewritten_prompt = await rewrite_prompt(prompt)
+        final_prompt = rewritten_prompt or final_prompt
+    return final_prompt
+
+
+async def _build_image_assembly(
+        prompt: str,
+        include_default_google_styles: bool,
+        include_default_character: bool,
+        include_manga_styles: bool,
+        uploads: List[Upload],
+) -> ContentAssembly:
+    """Contents for a /api/generate-image style request (also used by background jobs)."""
+    # The (network-bound) agent rewrite overlaps with the (CPU-bound) image
+    # preparation; both join before the contents are assembled.
+    image_groups, final_prompt = await _gather_or_cancel(
+        _prepare_image_groups(uploads, include_default_google_styles, include_default_character, include_manga_styles),
+        _resolve_prompt(prompt, include_manga_styles),
+    )
+    return _assemble_contents(image_groups, final_prompt)
+
+
+# ---------------- Serving generated files ----------------
+# Asset names embed a timestamp and content hash and are never rewritten.
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+def _etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/") == etag for tag in header.split(","))
+
+
+def _bytes_response(request: Request, data: bytes, media_type: str, headers: dict) -> Response:
+    """In-memory response with single byte-range support (for backends without local files)."""
+    headers = {**headers, "Accept-Ranges": "bytes"}
+    m = re.fullmatch(r"bytes=(\d*)-(\d*)", request.headers.get("range", "").strip())
+    if not m or m.group(1) == m.group(2) == "":
+        return Response(content=data, media_type=media_type, headers=headers)
+    size = len(data)
+    if m.group(1):
+        start = int(m.group(1))
+        end = min(int(m.group(2)), size - 1) if m.group(2) else size - 1
+    else:
+        start, end = max(0, size - int(m.group(2))), size - 1
+    if start >= size or start > end:
+        return Response(status_code=416, headers={"Content-Range": f"bytes */{size}"})
+    headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    return Response(content=data[start:end + 1], status_code=206, media_type=media_type, headers=headers)
+
+
+async def _serve_asset(request: Request, asset: StoredAsset, disposition: str = "attachment") -> Response:
+    """Serve a stored asset with its content-hash ETag, immutable caching and range support."""
+    etag = f'"{asset.sha256[:32]}"'
+    headers = {"ETag": etag, "Cache-Control": IMMUTABLE_CACHE_CONTROL}
+    if _etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+
+    path = STORAGE.local_path(asset)
+    if path is not None:
+        if not path.exists():
+            raise HTTPException(status_code=404, detail="File not found.")
+        return FileResponse(str(path), media_type=asset.mime_type, filename=asset.name,
+                            headers=headers, content_disposition_type=disposition)
+    try:
+        data = await asyncio.to_thread(STORAGE.read, asset)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="File not found.")
+    headers["Content-Disposition"] = f'{disposition}; filename="{asset.name}"'
+    return _bytes_response(request, data, asset.mime_type, headers)
 
 
 # ---------------- Routes ----------------
-@app.get("/", response_class=HTMLResponse)
+@router.get("/", response_class=HTMLResponse)
 async def read_root(request: Request):
-    return templates.TemplateResponse("index.html", {"request": request})
+    return TEMPLATES.TemplateResponse(request, "index.html")
+
 
+@router.get("/files/{filename}")
+async def serve_generated(request: Request, filename: str):
+    asset = await asyncio.to_thread(STORAGE.get, filename)
+    if asset is not None:
+        return await _serve_asset(request, asset)
 
-@app.get("/files/{filename}")
-async def serve_generated(filename: str):
-    path = OUTPUT_DIR / filename
-    if not path.exists():
+    # files written before the storage index existed live flat in the output dir
+    path = SETTINGS.output_dir / filename
+    if not path.is_file():
         raise HTTPException(status_code=404, detail="File not found.")
-    return FileResponse(str(path), media_type="image/png", filename=filename)
+    st = path.stat()
+    etag = f'"{st.st_mtime_ns:x}-{st.st_size:x}"'
+    headers = {"ETag": etag, "Cache-Control": IMMUTABLE_CACHE_CONTROL}
+    if _etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    media_type = mimetypes.guess_type(filename)[0] or "image/png"
+    return FileResponse(str(path), media_type=media_type, filename=filename, headers=headers, stat_result=st)
+
+
+@router.get("/files/{filename}/thumb")
+async def serve_thumbnail(request: Request, filename: str, w: int = THUMBNAIL_WIDTHS[0], format: str = "webp"):
+    fmt = format.lower()
+    if w not in THUMBNAIL_WIDTHS:
+        raise HTTPException(status_code=400, detail=f"Width must be one of {list(THUMBNAIL_WIDTHS)}.")
+    if fmt not in THUMBNAIL_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Format must be one of {list(THUMBNAIL_FORMATS)}.")
+
+    thumb_name = thumbnail_name(filename, w, fmt)
+    thumb = await asyncio.to_thread(STORAGE.get, thumb_name)
+    if thumb is None:
+        # first request for this size: render once, store next to the original
+        parent = await asyncio.to_thread(STORAGE.get, filename)
+        try:
+            if parent is not None:
+                source = await asyncio.to_thread(STORAGE.read, parent)
+            else:
+                legacy_path = SETTINGS.output_dir / filename
+                if not legacy_path.is_file():
+                    raise FileNotFoundError(filename)
+                source = await asyncio.to_thread(legacy_path.read_bytes)
+        except FileNotFoundError:
+            raise HTTPException(status_code=404, detail="File not found.")
+        try:
+            data = await asyncio.to_thread(render_thumbnail, source, w, fmt)
+        except Exception as e:
+            raise HTTPException(status_code=422, detail=f"Could not render thumbnail: {e}")
+        thumb = STORAGE.describe_derived(thumb_name, data, THUMBNAIL_FORMATS[fmt][1], parent)
+        await asyncio.to_thread(STORAGE.put, thumb, data)
+    return await _serve_asset(request, thumb, disposition="inline")
 
 
-@app.get("/api/ping")
+@router.get("/api/ping")
 def ping():
     return {"status": "ok"}
 
 
-@app.get("/api/get-default-prompt")
+@router.get("/api/cache-stats")
+def cache_stats():
+    return {
+        "rewrite": REWRITE_CACHE.stats() if REWRITE_CACHE is not None else None,
+        "parts": PART_CACHE.stats(),
+        "storage": STORAGE.stats(),
+        "coalescing": SINGLE_FLIGHT.stats() if SINGLE_FLIGHT is not None else None,
+        "default_pools": {flow: pool.stats() for flow, pool in DEFAULT_POOLS.items()},
+    }
+
+
+@router.get("/api/scheduler-stats")
+def scheduler_stats():
+    return SCHEDULER.stats()
+
+
+@router.get("/metrics")
+def metrics():
+    """Prometheus scrape endpoint."""
+    return Response(REGISTRY.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@router.get("/api/get-default-prompt")
 def get_default_prompt():
     return {"prompt": DEFAULT_PROMPT}
 
 
-@app.get("/api/get-manga-prompt")
+@router.get("/api/get-manga-prompt")
 def get_manga_prompt():
     return {"prompt": MANGA_DEFAULT_PROMPT}
 
 
-# --- Default Google flow ---
-@app.post("/api/generate-default")
-async def generate_default_api():
-    if not PRESET_GOOGLE_PARTS:
-        raise HTTPException(status_code=500, detail="Google style images missing.")
-    try:
-        response = client.models.generate_content(
-            model=MODEL_NAME,
-            contents=[*PRESET_GOOGLE_PARTS, DEFAULT_PROMPT],
-        )
-    except Exception as e:
-        raise HTTPException(status_code=502, detail=f"Gemini generation failed: {e}")
+# --- Default flows (fixed presets + fixed prompt) ---
+DEFAULT_FLOWS = ("default", "manga-default")
 
-    image_bytes = _extract_image_bytes(response)
-    if not image_bytes:
-        raise HTTPException(status_code=502, detail="No image bytes returned from Gemini.")
-    out_path = _save_png(image_bytes)
-    return FileResponse(str(out_path), media_type="image/png", filename=out_path.name)
 
+async def _default_assembly(flow: str) -> ContentAssembly:
+    library, prompt, missing = {
+        "default": (PRESET_GOOGLE, DEFAULT_PROMPT, "Google style images missing."),
+        "manga-default": (PRESET_MANGA, MANGA_DEFAULT_PROMPT, "Manga style images missing."),
+    }[flow]
+    with stage("presets"):
+        preset = await library.asnapshot()
+    if not preset[0]:
+        raise HTTPException(status_code=500, detail=missing)
+    return _assemble_contents([preset], prompt)
 
-# --- Default Manga flow ---
-@app.post("/api/generate-manga-default")
-async def generate_manga_default_api():
-    if not PRESET_MANGA_PARTS:
-        raise HTTPException(status_code=500, detail="Manga style images missing.")
-    try:
-        response = client.models.generate_content(
-            model=MODEL_NAME,
-            contents=[*PRESET_MANGA_PARTS, MANGA_DEFAULT_PROMPT],
-        )
-    except Exception as e:
-        raise HTTPException(status_code=502, detail=f"Gemini generation failed: {e}")
 
-    image_bytes = _extract_image_bytes(response)
-    if not image_bytes:
-        raise HTTPException(status_code=502, detail="No image bytes returned from Gemini.")
-    out_path = _save_png(image_bytes)
-    return FileResponse(str(out_path), media_type="image/png", filename=out_path.name)
+async def _produce_default(flow: str) -> Tuple[str, bytes]:
+    """ResultPool refill: one fresh generation for a default flow, at background priority."""
+    with timeline_scope(f"pool {flow}", enabled=SETTINGS.request_timelines):
+        with scheduling_scope(client_id=f"pool:{flow}", priority=PRIORITY_BACKGROUND):
+            assembly = await _default_assembly(flow)
+            return _generation_key(assembly), await _generate_image_bytes(assembly)
+
+
+async def _default_flow_response(flow: str) -> Response:
+    """A pre-generated image if the flow's pool has one ready, otherwise a (coalesced) generation."""
+    assembly = await _default_assembly(flow)
+    key = _generation_key(assembly)
+    pool = DEFAULT_POOLS.get(flow)
+    image_bytes = pool.take(key) if pool is not None else None
+    if image_bytes is None:
+        return await _generate_image_response(assembly, key)
+    return _image_response(image_bytes, _describe_output(image_bytes, assembly.prompt), assembly)
+
+
+@router.post("/api/generate-default")
+async def generate_default_api():
+    return await _default_flow_response("default")
+
+
+@router.post("/api/generate-manga-default")
+async def generate_manga_default_api():
+    return await _default_flow_response("manga-default")
 
 
 # --- General form-driven endpoint ---
-@app.post("/api/generate-image")
+@router.post("/api/generate-image")
 async def generate_image_api(
         prompt: str = Form(DEFAULT_PROMPT),
         include_default_google_styles: bool = Form(True),
@@ -330,57 +756,213 @@ async def generate_image_api(
         # top_p: float = Form(0.95),        # Default to a moderate top_p
         # output_length: int = Form(8192)  # Default to a reasonable output length
 ):
-    parts: List[types.Part] = []
+    # the raw uploads are not kept alive during the generation itself
+    assembly = await _build_image_assembly(
+        prompt, include_default_google_styles, include_default_character, include_manga_styles,
+        await _read_uploads(style_images),
+    )
+    return await _generate_image_response(assembly)
 
-    # user uploads first
-    parts.extend(_load_uploads(style_images))
 
-    # optional default character
-    if include_default_character and DEFAULT_CHARACTER_PATH.exists():
-        try:
-            char_img = Image.open(DEFAULT_CHARACTER_PATH).convert("RGB")
-            parts.append(_img_to_part(char_img, fmt="PNG"))
-        except Exception as e:
-            print(f"[warn] failed to load default character: {e}")
+# --- Batch / variations ---
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
 
-    # optional manga styles
-    if include_manga_styles:
-        parts.extend(PRESET_MANGA_PARTS)
-        rewritten_prompt = rewrite_prompt(prompt)
-        print(rewritten_prompt)
-        parts.append(rewritten_prompt or DEFAULT_PROMPT)
 
-    # optional google styles
-    if include_default_google_styles:
-        parts.extend(PRESET_GOOGLE_PARTS)
-        parts.extend(prompt or DEFAULT_PROMPT)
+@router.post("/api/generate-batch")
+async def generate_batch_api(
+        prompts: Optional[List[str]] = Form(None),
+        prompt: str = Form(DEFAULT_PROMPT),
+        variations: int = Form(1),
+        concurrency: Optional[int] = Form(None),
+        include_default_google_styles: bool = Form(True),
+        include_default_character: bool = Form(False),
+        include_manga_styles: bool = Form(False),
+        include_data: bool = Form(False),
+        style_images: Optional[List[UploadFile]] = File(None),
+):
+    """
+    Several generations sharing one set of reference images.
+
+    Either `prompts` (repeat the field) or `variations` copies of `prompt`.
+    Results stream back as Server-Sent Events in completion order:
+    `image` (index, prompt, name, url, optional base64 `data`), `error`
+    (index, detail), then a final `done`.
+    """
+    prompt_list = [p for p in (prompts or []) if p.strip()]
+    variations = max(1, variations)
+    # checked before the list is built: `variations` comes straight from the client
+    count = len(prompt_list) if prompt_list else variations
+    if count > SETTINGS.batch_max_items:
+        raise HTTPException(status_code=400, detail=f"At most {SETTINGS.batch_max_items} images per batch.")
+    prompt_list = prompt_list or [prompt] * variations
+    concurrency = max(1, min(concurrency or SETTINGS.batch_default_concurrency, SETTINGS.batch_max_concurrency))
+
+    # Shared stage, done once: reference images plus one rewrite per distinct prompt
+    uploads = await _read_uploads(style_images)
+    unique_prompts = list(dict.fromkeys(prompt_list))
+    image_groups, *final_prompts = await _gather_or_cancel(
+        _prepare_image_groups(uploads, include_default_google_styles, include_default_character, include_manga_styles),
+        *(_resolve_prompt(p, include_manga_styles) for p in unique_prompts),
+    )
+    resolved = dict(zip(unique_prompts, final_prompts))
+    assemblies = [_assemble_contents(image_groups, resolved[p]) for p in prompt_list]
 
-    # if (not include_manga_styles) or (not include_default_google_styles):
-    #     # prompt last
-    #     rewritten_prompt = rewrite_prompt(prompt)
-    #     print(rewritten_prompt)
-    #     parts.append(rewritten_prompt or DEFAULT_PROMPT)
+    # Fan-out stage: bounded per batch (and globally by the scheduler)
+    slots = asyncio.Semaphore(concurrency)
+    results: asyncio.Queue = asyncio.Queue()
 
-    parts.append(prompt or DEFAULT_PROMPT)
+    client_id = current_client.get()
 
-    try:
-        response = client.models.generate_content(
-            model=MODEL_NAME,
-            contents=parts,
-            # config=types.GenerateContentConfig(
-            #     temperature=temperature,
-            #     top_p=top_p,
-            #     max_output_tokens=output_length
-            # )
-        )
-    except Exception as e:
-        raise HTTPException(status_code=502, detail=f"Gemini generation failed: {e}")
+    async def run_one(index: int, assembly: ContentAssembly) -> None:
+        try:
+            async with slots:
+                with scheduling_scope(client_id=client_id, priority=PRIORITY_BATCH):
+                    image_bytes = await _generate_image_bytes(assembly)
+            asset = _describe_output(image_bytes, assembly.prompt)
+            await asyncio.to_thread(_store_output, asset, image_bytes)
+            payload = {"index": index, "prompt": prompt_list[index], "name": asset.name,
+                       "url": f"/files/{asset.name}", "mime_type": asset.mime_type, "size": asset.size,
+                       "reference_bytes_saved": assembly.bytes_saved}
+            if include_data:
+                payload["data"] = base64.b64encode(image_bytes).decode("ascii")
+            await results.put(("image", payload))
+        except Exception as e:
+            detail = getattr(e, "detail", None) or str(e)
+            await results.put(("error", {"index": index, "prompt": prompt_list[index], "detail": detail}))
 
-    image_bytes = _extract_image_bytes(response)
-    if not image_bytes:
-        raise HTTPException(status_code=502, detail="No image bytes returned from Gemini.")
-    out_path = _save_png(image_bytes)
-    return FileResponse(str(out_path), media_type="image/png", filename=out_path.name)
+    async def stream():
+        tasks = [asyncio.create_task(run_one(i, a)) for i, a in enumerate(assemblies)]
+        failed = 0
+        try:
+            for _ in tasks:
+                event, payload = await results.get()
+                failed += event == "error"
+                yield _sse(event, payload)
+            yield _sse("done", {"count": len(tasks), "failed": failed})
+        finally:
+            # client went away (or we finished): don't leave generations running
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+# --- Background jobs ---
+async def _run_generation_job(job: Job, uploads: List[Upload]) -> str:
+    """JobQueue handler: same pipeline as /api/generate-image, result goes to STORAGE."""
+    params = dict(job.params)
+    with timeline_scope("job", enabled=SETTINGS.request_timelines, job_id=job.id):
+        with scheduling_scope(client_id=params.pop("client_id", None), priority=PRIORITY_BACKGROUND):
+            assembly = await _build_image_assembly(uploads=uploads, **params)
+            image_bytes = await _generate_image_bytes(assembly)
+        asset = _describe_output(image_bytes, assembly.prompt)
+        await asyncio.to_thread(_store_output, asset, image_bytes)
+    return asset.name
+
+
+def _job_payload(job: Job) -> dict:
+    payload = job.to_dict()
+    payload["status_url"] = f"/api/jobs/{job.id}"
+    if job.result_name:
+        payload["result_url"] = f"/api/jobs/{job.id}/result"
+    return payload
+
+
+@router.post("/api/jobs", status_code=202)
+async def create_job_api(
+        prompt: str = Form(DEFAULT_PROMPT),
+        include_default_google_styles: bool = Form(True),
+        include_default_character: bool = Form(False),
+        include_manga_styles: bool = Form(False),
+        style_images: Optional[List[UploadFile]] = File(None),
+):
+    uploads = await _read_uploads(style_images)
+    job = await JOB_QUEUE.submit(
+        {
+            "prompt": prompt,
+            "include_default_google_styles": include_default_google_styles,
+            "include_default_character": include_default_character,
+            "include_manga_styles": include_manga_styles,
+            "client_id": current_client.get(),
+        },
+        uploads,
+    )
+    return _job_payload(job)
+
+
+@router.get("/api/jobs/{job_id}")
+async def get_job_api(job_id: str, wait: float = 0):
+    """Job status; `wait` (seconds, max JOB_MAX_WAIT_SECONDS) long-polls until the job finishes."""
+    job = await JOB_QUEUE.wait(job_id, timeout=max(0.0, min(wait, SETTINGS.job_max_wait_seconds)))
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found.")
+    return _job_payload(job)
+
+
+@router.get("/api/jobs/{job_id}/result")
+async def get_job_result_api(request: Request, job_id: str):
+    job = await asyncio.to_thread(JOB_QUEUE.store.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found.")
+    if job.status == FAILED:
+        raise HTTPException(status_code=409, detail=f"Job failed: {job.error}")
+    if job.status != SUCCEEDED or not job.result_name:
+        raise HTTPException(status_code=409, detail=f"Job is {job.status}.")
+    asset = await asyncio.to_thread(STORAGE.get, job.result_name)
+    if asset is None:
+        raise HTTPException(status_code=404, detail="Result no longer available.")
+    return await _serve_asset(request, asset)
+
+
+# ---------------- Metrics ----------------
+# Counters that already live on the caches/scheduler/stores are read at scrape time.
+def _cache_samples():
+    caches = [("parts", PART_CACHE), ("rewrite", REWRITE_CACHE),
+              *((f"pool:{flow}", pool) for flow, pool in DEFAULT_POOLS.items())]
+    for name, stats in ((name, cache.stats()) for name, cache in caches if cache is not None):
+        yield (name, "hit"), stats["hits"]
+        yield (name, "miss"), stats["misses"]
+
+
+def _lane_samples(*keys: str):
+    def read():
+        for model, stats in SCHEDULER.stats().items():
+            yield (model,), sum(stats[k] for k in keys)
+    return read
+
+
+REGISTRY.callback("cache_lookups_total", "Cache lookups by cache and result.", "counter",
+                  ("cache", "result"), _cache_samples)
+REGISTRY.callback("generations_coalesced_total", "Generation requests served by an identical in-flight call.",
+                  "counter", (), lambda: [((), SINGLE_FLIGHT.coalesced)] if SINGLE_FLIGHT is not None else [])
+REGISTRY.callback("default_pool_ready", "Pre-generated images ready per default flow.", "gauge",
+                  ("flow",), lambda: [((flow,), len(pool)) for flow, pool in DEFAULT_POOLS.items()])
+REGISTRY.callback("upstream_calls_completed_total", "Upstream model calls that succeeded.", "counter",
+                  ("model",), _lane_samples("completed"))
+REGISTRY.callback("upstream_calls_failed_total", "Upstream model calls that failed after retries.", "counter",
+                  ("model",), _lane_samples("failed"))
+REGISTRY.callback("upstream_retries_total", "Upstream model call retries.", "counter",
+                  ("model",), _lane_samples("retries"))
+REGISTRY.callback("upstream_rate_limited_total", "Upstream responses that were rate limited (429).", "counter",
+                  ("model",), _lane_samples("rate_limited"))
+REGISTRY.callback("upstream_queued", "Calls waiting for an upstream slot.", "gauge",
+                  ("model",), _lane_samples("queued"))
+REGISTRY.callback("upstream_active", "Upstream calls in flight.", "gauge",
+                  ("model",), _lane_samples("active"))
+REGISTRY.callback("storage_bytes", "Bytes of generated images in storage.", "gauge",
+                  (), lambda: [((), STORAGE.index.totals()["bytes"])])
+REGISTRY.callback("jobs", "Background jobs by status.", "gauge",
+                  ("status",), lambda: [((k,), v) for k, v in JOB_QUEUE.store.counts().items()])
+REGISTRY.callback("startup_phase_seconds", "Import, resource setup and warmup durations.", "gauge",
+                  ("phase",), lambda: [((k,), v) for k, v in STARTUP.items()])
+
+
+_record_startup("imports", time.perf_counter() - _IMPORT_STARTED)
+
+# `uvicorn main:app`, or `uvicorn main:create_app --factory`
+app = create_app(SETTINGS)
 
 
 # Local dev
@@ -0,0 +1,223 @@
+# metrics.py
+import bisect
+import json
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+LabelValues = Tuple[str, ...]
+
+# Seconds: covers a cache hit (sub-ms) up to a slow image generation (a minute+)
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40, 80)
+# Bytes: a prompt alone up to dozens of full-size reference images
+SIZE_BUCKETS = tuple(1024 * 4 ** i for i in range(10))  # 1 KiB .. 256 MiB
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Iterable[str], extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(str(v))}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+class Counter:
+    """Monotonic counter with optional labels."""
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values: Dict[LabelValues, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values: str, amount: float = 1) -> None:
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labels, k)} {_format_number(v)}" for k, v in items]
+
+
+class Histogram:
+    """Cumulative-bucket histogram (Prometheus semantics) with optional labels."""
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [per-bucket counts (+1 for +Inf), sum, count]
+        self._series: Dict[LabelValues, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values: str) -> None:
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            items = sorted((k, (list(s[0]), s[1], s[2])) for k, s in self._series.items())
+        lines = []
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, n in zip((*self.buckets, float("inf")), counts):
+                cumulative += n
+                le = 'le="%s"' % _format_number(bound)
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {_format_number(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {count}")
+        return lines
+
+
+class CallbackMetric:
+    """
+    Values read from elsewhere (cache/scheduler stats) at scrape time, so
+    the hot path pays nothing for them. `read` yields (label values, value).
+    """
+
+    def __init__(self, name: str, help: str, kind: str, labels: Sequence[str],
+                 read: Callable[[], Iterable[Tuple[LabelValues, float]]]):
+        self.name = name
+        self.help = help
+        self.kind = kind
+        self.labels = tuple(labels)
+        self.read = read
+
+    def samples(self) -> List[str]:
+        try:
+            values = list(self.read())
+        except Exception as e:
+            print(f"[warn] metric {self.name} unavailable: {e}")
+            return []
+        return [f"{self.name}{_format_labels(self.labels, k)} {_format_number(v)}" for k, v in values]
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, object] = {}
+
+    def register(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Duplicate metric: {metric.name}")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labels: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, help, labels))
+
+    def histogram(self, name: str, help: str, labels: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def callback(self, name: str, help: str, kind: str, labels: Sequence[str],
+                 read: Callable[[], Iterable[Tuple[LabelValues, float]]]) -> CallbackMetric:
+        return self.register(CallbackMetric(name, help, kind, labels, read))
+
+    def render(self) -> str:
+        """Prometheus text exposition format (version 0.0.4)."""
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+REQUEST_SECONDS = REGISTRY.histogram(
+    "http_request_duration_seconds", "Time to produce the response, by route.", ("method", "route", "status"))
+STAGE_SECONDS = REGISTRY.histogram(
+    "stage_duration_seconds", "Time spent in each pipeline stage.", ("stage",))
+STAGE_ERRORS = REGISTRY.counter(
+    "stage_errors_total", "Pipeline stages that raised.", ("stage",))
+PAYLOAD_BYTES = REGISTRY.histogram(
+    "generation_payload_bytes", "Size of the contents sent to the image model.", (), SIZE_BUCKETS)
+IMAGE_BYTES = REGISTRY.histogram(
+    "generation_image_bytes", "Size of the images returned by the image model.", (), SIZE_BUCKETS)
+REFERENCE_BYTES_SAVED = REGISTRY.counter(
+    "reference_bytes_saved_total", "Upload bytes saved by reference-image preprocessing.")
+
+
+# ---------------- Per-request timelines ----------------
+class Timeline:
+    """Ordered (stage, start offset, duration, ok) records for one request or job."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.started = time.perf_counter()
+        self.stages: List[Tuple[str, float, float, bool]] = []  # appended from threads too; list.append is atomic
+
+    def to_dict(self, **extra) -> dict:
+        return {
+            "name": self.name,
+            **extra,
+            "total_ms": round((time.perf_counter() - self.started) * 1000, 2),
+            "stages": [
+                {"stage": s, "start_ms": round(o * 1000, 2), "ms": round(d * 1000, 2), **({} if ok else {"error": True})}
+                for s, o, d, ok in self.stages
+            ],
+        }
+
+
+current_timeline: ContextVar[Optional[Timeline]] = ContextVar("current_timeline", default=None)
+
+
+@contextmanager
+def timeline_scope(name: str, enabled: bool = True, **extra):
+    """
+    Collect stage timings for everything run in this context and log them as
+    one JSON line on exit (requests that ran no stages are not logged).
+    """
+    if not enabled:
+        yield None
+        return
+    timeline = Timeline(name)
+    token = current_timeline.set(timeline)
+    try:
+        yield timeline
+    finally:
+        current_timeline.reset(token)
+        if timeline.stages:
+            print("[timeline] " + json.dumps(timeline.to_dict(**extra)))
+
+
+@contextmanager
+def stage(name: str):
+    """Time a pipeline stage into STAGE_SECONDS (and the current timeline, if any)."""
+    start = time.perf_counter()
+    ok = True
+    try:
+        yield
+    except BaseException:
+        ok = False
+        STAGE_ERRORS.inc(name)
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.observe(elapsed, name)
+        timeline = current_timeline.get()
+        if timeline is not None:
+            timeline.stages.append((name, start - timeline.started, elapsed, ok))
@@ -0,0 +1,83 @@
+# part_cache.py
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Callable, Dict, Optional
+
+if TYPE_CHECKING:
+    from google.genai import types
+
+
+class PartCache:
+    """
+    Content-addressed cache of ready-to-send image Parts.
+
+    Entries are keyed by the SHA-256 of the raw source bytes (salted with
+    `namespace`, e.g. the preprocessing settings) and evicted
+    least-recently-used first once the encoded payloads exceed `max_bytes`.
+    Safe to share between the event loop and worker threads.
+    """
+
+    def __init__(self, max_bytes: int, namespace: str = ""):
+        self.max_bytes = max_bytes
+        self.namespace = namespace.encode("utf-8")
+        self._entries: "OrderedDict[str, types.Part]" = OrderedDict()
+        self._sizes: Dict[str, int] = {}
+        self._total = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def key_for(self, data: bytes) -> str:
+        h = hashlib.sha256(self.namespace)
+        h.update(data)
+        return h.hexdigest()
+
+    @staticmethod
+    def _part_size(part: "types.Part") -> int:
+        blob = getattr(part, "inline_data", None)
+        return len(blob.data) if blob is not None and blob.data else 0
+
+    def get(self, key: str) -> Optional["types.Part"]:
+        with self._lock:
+            part = self._entries.get(key)
+            if part is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return part
+
+    def put(self, key: str, part: "types.Part") -> None:
+        size = self._part_size(part)
+        if size > self.max_bytes:
+            return  # never cache something that would evict everything else
+        with self._lock:
+            if key in self._entries:
+                self._total -= self._sizes[key]
+            self._entries[key] = part
+            self._entries.move_to_end(key)
+            self._sizes[key] = size
+            self._total += size
+            while self._total > self.max_bytes and self._entries:
+                old_key, _ = self._entries.popitem(last=False)
+                self._total -= self._sizes.pop(old_key)
+
+    def get_or_create(self, data: bytes, build: Callable[[bytes], "types.Part"]) -> "types.Part":
+        """Return the cached Part for `data`, building (and caching) it on a miss."""
+        key = self.key_for(data)
+        part = self.get(key)
+        if part is None:
+            part = build(data)
+            self.put(key, part)
+        return part
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._total,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
@@ -0,0 +1,175 @@
+# preset_pack.py
+import hashlib
+import json
+import mmap
+import os
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows: builds are not serialized, the atomic rename still keeps readers safe
+    fcntl = None
+
+if TYPE_CHECKING:
+    from google.genai import types
+
+FileSig = Tuple[int, int]  # (mtime_ns, size)
+PACK_VERSION = 1
+
+
+@dataclass(frozen=True)
+class PackEntry:
+    name: str
+    offset: int
+    length: int
+    sha256: str
+    mime_type: str
+    source_size: int
+
+
+def pack_key(files: Dict[Path, FileSig], fingerprint: str) -> str:
+    """Identifies one prepared state of a folder: its files (name, mtime, size) + the prep settings."""
+    h = hashlib.sha256(f"v{PACK_VERSION}\0{fingerprint}".encode("utf-8"))
+    for path in sorted(files, key=lambda p: p.name):
+        mtime_ns, size = files[path]
+        h.update(f"\0{path.name}\0{mtime_ns}\0{size}".encode("utf-8"))
+    return h.hexdigest()[:16]
+
+
+@contextmanager
+def _build_lock(path: Path):
+    with open(path, "a+b") as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+class PresetPack:
+    """
+    Prepared preset images for one folder state, stored as `<label>-<key>.pack`
+    (the encoded images back to back) plus a `.json` manifest of offsets,
+    lengths, hashes and mime types.
+
+    The pack is built once per host (under a file lock) and then mapped
+    read-only by every worker process, so the bytes live once in the page
+    cache instead of once per worker. google.genai's pydantic models only
+    accept `bytes`, so `parts()` copies each image out of the mapping for
+    the duration of a request rather than keeping a private copy per worker.
+    """
+
+    def __init__(self, pack_path: Path, entries: List[PackEntry]):
+        self.path = pack_path
+        self.entries = entries
+        with open(pack_path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else None
+
+    @property
+    def size(self) -> int:
+        return sum(e.length for e in self.entries)
+
+    def data(self, entry: PackEntry) -> bytes:
+        return self._map[entry.offset:entry.offset + entry.length]
+
+    def parts(self) -> List["types.Part"]:
+        from google.genai import types
+
+        return [types.Part(inline_data=types.Blob(mime_type=e.mime_type, data=self.data(e))) for e in self.entries]
+
+    def source_sizes(self) -> List[int]:
+        return [e.source_size for e in self.entries]
+
+    def verify(self) -> bool:
+        """Re-hash every entry (used after building; readers trust the manifest)."""
+        return all(hashlib.sha256(self.data(e)).hexdigest() == e.sha256 for e in self.entries)
+
+    @classmethod
+    def open(cls, manifest_path: Path) -> Optional["PresetPack"]:
+        try:
+            manifest = json.loads(manifest_path.read_text())
+            if manifest.get("version") != PACK_VERSION:
+                return None
+            entries = [PackEntry(**e) for e in manifest["entries"]]
+            return cls(manifest_path.with_suffix(".pack"), entries)
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+    @classmethod
+    def load_or_build(
+            cls,
+            pack_dir: Path,
+            label: str,
+            files: Dict[Path, FileSig],
+            prepare: Callable[[bytes], "types.Part"],
+            fingerprint: str,
+            max_workers: int = 4,
+    ) -> "PresetPack":
+        """Map the pack for this exact folder state, building it first if no process has yet."""
+        pack_dir.mkdir(parents=True, exist_ok=True)
+        manifest_path = pack_dir / f"{label}-{pack_key(files, fingerprint)}.json"
+        pack = cls.open(manifest_path)
+        if pack is not None:
+            return pack
+        with _build_lock(pack_dir / f"{label}.lock"):
+            pack = cls.open(manifest_path)  # another worker may have built it while we waited
+            if pack is None:
+                cls._build(manifest_path, files, prepare, max_workers)
+                pack = cls.open(manifest_path)
+                if pack is None or not pack.verify():
+                    raise RuntimeError(f"could not build preset pack {manifest_path}")
+                print(f"[info] built preset pack {manifest_path.name}: {len(pack.entries)} images, {pack.size} bytes")
+                cls._remove_stale(pack_dir, label, keep=manifest_path)
+        return pack
+
+    @staticmethod
+    def _build(manifest_path: Path, files: Dict[Path, FileSig], prepare, max_workers: int) -> None:
+        ordered = sorted(files, key=lambda p: p.name)  # same order as PresetLibrary
+
+        def load(path: Path):
+            try:
+                data = path.read_bytes()
+                return prepare(data).inline_data, len(data)
+            except Exception as e:
+                print(f"[warn] failed to open {path}: {e}")
+                return None
+
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            results = list(pool.map(load, ordered))
+
+        pack_path = manifest_path.with_suffix(".pack")
+        entries = []
+        offset = 0
+        tmp_pack = pack_path.with_name(pack_path.name + ".part")
+        with open(tmp_pack, "wb") as f:
+            for path, result in zip(ordered, results):
+                if result is None:
+                    continue
+                blob, source_size = result
+                f.write(blob.data)
+                entries.append(PackEntry(path.name, offset, len(blob.data),
+                                         hashlib.sha256(blob.data).hexdigest(), blob.mime_type, source_size))
+                offset += len(blob.data)
+        os.replace(tmp_pack, pack_path)
+
+        # the manifest is written last: its presence means the pack is complete
+        tmp_manifest = manifest_path.with_name(manifest_path.name + ".part")
+        tmp_manifest.write_text(json.dumps({"version": PACK_VERSION, "entries": [e.__dict__ for e in entries]}))
+        os.replace(tmp_manifest, manifest_path)
+
+    @staticmethod
+    def _remove_stale(pack_dir: Path, label: str, keep: Path) -> None:
+        # Workers still mapping an old pack keep their view: unlinking does not invalidate an mmap
+        for path in pack_dir.glob(f"{label}-*"):
+            if path.stem != keep.stem:
+                try:
+                    path.unlink()
+                except OSError:
+                    pass
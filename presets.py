@@ -0,0 +1,142 @@
+# presets.py
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional, Tuple
+
+from preset_pack import FileSig, PresetPack, pack_key
+
+if TYPE_CHECKING:
+    from google.genai import types
+
+Snapshot = Tuple[List["types.Part"], List[int]]  # (parts, source file sizes)
+
+
+class PresetLibrary:
+    """
+    Lazily loaded, self-refreshing set of style reference images in a folder.
+
+    Nothing is read until the first `parts()` call. After that the folder is
+    re-scanned at most every `rescan_interval` seconds; only added or modified
+    files are prepared (in a thread pool) and removed files are dropped.
+    `prepare` turns raw file bytes into the Part that is sent upstream.
+
+    With `pack_dir` set, prepared images are kept in a PresetPack shared by
+    all worker processes on the host instead of in this process's memory;
+    `fingerprint` must then identify the `prepare` settings.
+    """
+
+    def __init__(
+            self,
+            folder: Path,
+            prepare: Callable[[bytes], "types.Part"],
+            patterns=("*.png", "*.jpg", "*.jpeg"),
+            rescan_interval: float = 2.0,
+            max_workers: int = 4,
+            pack_dir: Optional[Path] = None,
+            fingerprint: str = "",
+    ):
+        self.folder = folder
+        self.prepare = prepare
+        self.patterns = patterns
+        self.rescan_interval = rescan_interval
+        self.max_workers = max_workers
+        self.pack_dir = pack_dir
+        self.fingerprint = fingerprint
+        self._pack: Optional[PresetPack] = None
+        self._pack_key: Optional[str] = None
+        self._entries: Dict[Path, Tuple[FileSig, "types.Part"]] = {}
+        self._snapshot: Optional[Snapshot] = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def _scan(self) -> Dict[Path, FileSig]:
+        if not self.folder.exists():
+            return {}
+        found: Dict[Path, FileSig] = {}
+        for pat in self.patterns:
+            for p in self.folder.glob(pat):
+                try:
+                    st = p.stat()
+                except OSError:
+                    continue
+                found[p] = (st.st_mtime_ns, st.st_size)
+        return found
+
+    def _is_stale(self) -> bool:
+        loaded = self._pack if self.pack_dir is not None else self._snapshot
+        return loaded is None or time.monotonic() - self._checked_at >= self.rescan_interval
+
+    def _refresh(self) -> None:
+        found = self._scan()
+        if not found and self._snapshot is None and self._pack is None:
+            print(f"[warn] missing or empty folder: {self.folder}")
+        if self.pack_dir is not None:
+            self._refresh_pack(found)
+            return
+        changed = [p for p, sig in found.items()
+                   if p not in self._entries or self._entries[p][0] != sig]
+        removed = [p for p in self._entries if p not in found]
+
+        if changed:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+                results = pool.map(self._try_load, changed)
+                for p, part in zip(changed, results):
+                    if part is not None:
+                        self._entries[p] = (found[p], part)
+                    else:
+                        self._entries.pop(p, None)
+        for p in removed:
+            del self._entries[p]
+
+        if changed or removed or self._snapshot is None:
+            # sorted by name for determinism
+            ordered = [self._entries[p] for p in sorted(self._entries, key=lambda q: q.name)]
+            self._snapshot = ([part for _, part in ordered], [sig[1] for sig, _ in ordered])
+        self._checked_at = time.monotonic()
+
+    def _refresh_pack(self, found: Dict[Path, FileSig]) -> None:
+        key = pack_key(found, self.fingerprint)
+        if key != self._pack_key:
+            # the replaced pack is unmapped when it is garbage collected
+            self._pack = PresetPack.load_or_build(
+                self.pack_dir, self.folder.name.lower(), found, self.prepare, self.fingerprint, self.max_workers
+            )
+            self._pack_key = key
+        self._checked_at = time.monotonic()
+
+    def _try_load(self, path: Path) -> Optional["types.Part"]:
+        try:
+            return self.prepare(path.read_bytes())
+        except Exception as e:
+            print(f"[warn] failed to open {path}: {e}")
+            return None
+
+    def _current(self) -> Snapshot:
+        pack = self._pack
+        if pack is not None:
+            # Parts are copied out of the shared mapping per request (genai only takes bytes)
+            return pack.parts(), pack.source_sizes()
+        return self._snapshot or ([], [])
+
+    def snapshot(self) -> Snapshot:
+        """Current (parts, source sizes), loading or refreshing the folder if needed."""
+        if self._is_stale():
+            with self._lock:
+                if self._is_stale():
+                    self._refresh()
+        return self._current()
+
+    async def asnapshot(self) -> Snapshot:
+        """Like `snapshot()`, but any disk work happens off the event loop."""
+        if self._is_stale():
+            return await asyncio.to_thread(self.snapshot)
+        return self._current()
+
+    def parts(self) -> List["types.Part"]:
+        return list(self.snapshot()[0])
+
+    async def aparts(self) -> List["types.Part"]:
+        return list((await self.asnapshot())[0])
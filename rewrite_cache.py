@@ -0,0 +1,124 @@
+# rewrite_cache.py
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional
+
+
+def normalize_prompt(text: str) -> str:
+    """Unicode-normalize and collapse whitespace so trivial edits share a key."""
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+def agent_fingerprint(agent) -> str:
+    """Short hash of the agent's model + instruction; changing either invalidates the cache."""
+    raw = f"{getattr(agent, 'model', '')}\0{getattr(agent, 'instruction', '')}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:16]
+
+
+class RewriteCache:
+    """
+    Persistent cache of parsed prompt-rewriter results.
+
+    Results live in a SQLite file so they survive restarts and are shared by
+    workers on the same host; a small in-process LRU in front of it answers
+    repeated prompts without touching disk. Entries expire after `ttl_seconds`
+    and the table is trimmed to the newest `max_entries` rows.
+    """
+
+    def __init__(
+            self,
+            path: Path,
+            fingerprint: str,
+            ttl_seconds: float = 7 * 24 * 3600,
+            max_entries: int = 10_000,
+            memory_entries: int = 512,
+    ):
+        self.path = path
+        self.fingerprint = fingerprint
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.memory_entries = memory_entries
+        self.hits = 0
+        self.misses = 0
+        self._memory: "OrderedDict[str, tuple[float, dict]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._writes = 0
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(str(path), check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS rewrites ("
+            " key TEXT PRIMARY KEY, result TEXT NOT NULL, created_at REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS rewrites_created ON rewrites(created_at)")
+
+    def key_for(self, prompt: str) -> str:
+        raw = f"{self.fingerprint}\0{normalize_prompt(prompt)}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _remember(self, key: str, created_at: float, result: dict) -> None:
+        self._memory[key] = (created_at, result)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def get(self, prompt: str) -> Optional[dict]:
+        key = self.key_for(prompt)
+        cutoff = time.time() - self.ttl_seconds
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and entry[0] >= cutoff:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return dict(entry[1])
+
+            row = self._db.execute(
+                "SELECT result, created_at FROM rewrites WHERE key = ? AND created_at >= ?",
+                (key, cutoff),
+            ).fetchone()
+            if row is None:
+                self._memory.pop(key, None)
+                self.misses += 1
+                return None
+            result = json.loads(row[0])
+            self._remember(key, row[1], result)
+            self.hits += 1
+            return dict(result)
+
+    def put(self, prompt: str, result: dict) -> None:
+        key = self.key_for(prompt)
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO rewrites (key, result, created_at) VALUES (?, ?, ?)",
+                (key, json.dumps(result), now),
+            )
+            self._remember(key, now, dict(result))
+            self._writes += 1
+            if self._writes % 100 == 1:
+                self._evict(now)
+
+    def _evict(self, now: float) -> None:
+        self._db.execute("DELETE FROM rewrites WHERE created_at < ?", (now - self.ttl_seconds,))
+        self._db.execute(
+            "DELETE FROM rewrites WHERE key NOT IN"
+            " (SELECT key FROM rewrites ORDER BY created_at DESC LIMIT ?)",
+            (self.max_entries,),
+        )
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries = self._db.execute("SELECT COUNT(*) FROM rewrites").fetchone()[0]
+            return {
+                "entries": entries,
+                "memory_entries": len(self._memory),
+                "hits": self.hits,
+                "misses": self.misses,
+            }
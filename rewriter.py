@@ -0,0 +1,110 @@
+# rewriter.py
+import asyncio
+import uuid
+from typing import Optional
+
+from google.adk.agents import BaseAgent
+from google.adk.runners import Runner
+from google.adk.sessions import InMemorySessionService
+from google.genai import types
+
+from agent_output import RewriteResult
+from rewrite_cache import RewriteCache
+from scheduler import GeminiScheduler
+
+
+class PromptRewriter:
+    """
+    Process-wide prompt rewriting service around one ADK Runner.
+
+    The Runner and session service are built once; every call gets its own
+    short-lived session, which is deleted as soon as the run finishes so
+    concurrent requests never share history and memory stays flat.
+    """
+
+    def __init__(
+            self,
+            agent: BaseAgent,
+            app_name: str = "prompt_rewriter_app",
+            user_id: str = "local_user",
+            cache: Optional[RewriteCache] = None,
+            scheduler: Optional[GeminiScheduler] = None,
+    ):
+        self.app_name = app_name
+        self.cache = cache
+        self.scheduler = scheduler
+        self.model = str(getattr(agent, "model", "") or agent.name)
+        self.user_id = user_id
+        self.session_service = InMemorySessionService()
+        self.runner = Runner(
+            agent=agent,
+            app_name=app_name,
+            session_service=self.session_service,
+        )
+
+    async def run(self, raw_prompt: str) -> Optional[str]:
+        """Run the agent once and return the text of its final response, if any."""
+        session_id = uuid.uuid4().hex
+        self.session_service.create_session(
+            app_name=self.app_name, user_id=self.user_id, session_id=session_id
+        )
+        content = types.Content(role="user", parts=[types.Part(text=raw_prompt)])
+        final_text = None
+        try:
+            # Drain the stream instead of breaking out early: closing ADK's
+            # nested generators mid-run trips its tracing context handling.
+            async for event in self.runner.run_async(
+                    user_id=self.user_id, session_id=session_id, new_message=content
+            ):
+                if final_text is None and event.is_final_response():
+                    if event.content and event.content.parts and getattr(event.content.parts[0], "text", None):
+                        final_text = event.content.parts[0].text.strip()
+                    else:
+                        final_text = ""
+        finally:
+            self.session_service.delete_session(
+                app_name=self.app_name, user_id=self.user_id, session_id=session_id
+            )
+        return final_text or None
+
+    async def rewrite(self, raw_prompt: str) -> Optional[RewriteResult]:
+        """
+        Validated agent output (rewritten prompt, template, aspect ratio,
+        followups), served from the cache when possible. None if the agent
+        gave no usable answer or could not be reached (e.g. the scheduler
+        gave up on a rate-limited model).
+
+        Cache reads and writes are SQLite queries (a write commits and syncs
+        the WAL), so they run in a worker thread, off the event loop.
+        """
+        if self.cache is not None:
+            cached = await asyncio.to_thread(self.cache.get, raw_prompt)
+            if cached is not None:
+                result = RewriteResult.from_dict(cached)
+                if result is not None:
+                    return result
+
+        try:
+            if self.scheduler is not None:
+                # one agent run (search + LLM turns) is admitted as one unit of the model's budget
+                final_text = await self.scheduler.call(self.model, lambda: self.run(raw_prompt))
+            else:
+                final_text = await self.run(raw_prompt)
+        except Exception as e:
+            print(f"[warn] prompt rewrite failed, using the raw prompt: {e}")
+            return None
+
+        result = RewriteResult.parse(final_text) if final_text else None
+        if result is None:
+            return None
+        if self.cache is not None:
+            await asyncio.to_thread(self.cache.put, raw_prompt, result.to_dict())
+        return result
+
+    async def rewrite_prompt(self, raw_prompt: str) -> str:
+        """
+        Rewrite a user prompt with the agent.
+        Returns the rewritten prompt, or the original raw prompt if rewriting fails.
+        """
+        result = await self.rewrite(raw_prompt)
+        return result.rewritten_prompt if result is not None else raw_prompt
@@ -0,0 +1,239 @@
+# scheduler.py
+import asyncio
+import random
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Awaitable, Callable, Deque, Dict, Optional, TypeVar
+
+T = TypeVar("T")
+
+# Who is asking and how urgent it is; set per request/job, read by the scheduler.
+# Lower priority numbers are served first.
+current_client: ContextVar[str] = ContextVar("current_client", default="anonymous")
+current_priority: ContextVar[int] = ContextVar("current_priority", default=0)
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BATCH = 1
+PRIORITY_BACKGROUND = 2
+
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+
+@contextmanager
+def scheduling_scope(client_id: Optional[str] = None, priority: Optional[int] = None):
+    """Temporarily set the client id and/or priority used for scheduled calls."""
+    tokens = []
+    if client_id is not None:
+        tokens.append((current_client, current_client.set(client_id)))
+    if priority is not None:
+        tokens.append((current_priority, current_priority.set(priority)))
+    try:
+        yield
+    finally:
+        for var, token in reversed(tokens):
+            var.reset(token)
+
+
+def error_status(exc: BaseException) -> Optional[int]:
+    """HTTP-ish status of an upstream error (google.genai APIError exposes `.code`)."""
+    for attr in ("code", "status_code"):
+        value = getattr(exc, attr, None)
+        if isinstance(value, int):
+            return value
+    return None
+
+
+def is_rate_limited(exc: BaseException) -> bool:
+    return error_status(exc) == 429 or "RESOURCE_EXHAUSTED" in str(exc)
+
+
+def is_retryable(exc: BaseException) -> bool:
+    if isinstance(exc, (ConnectionError, TimeoutError, asyncio.TimeoutError)):
+        return True
+    return error_status(exc) in RETRYABLE_STATUS_CODES or is_rate_limited(exc)
+
+
+class TokenBucket:
+    """`rate_per_minute` requests per minute with bursts up to `burst`; rate 0 = unlimited."""
+
+    def __init__(self, rate_per_minute: float, burst: Optional[float] = None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = burst if burst is not None else max(1.0, rate_per_minute / 60.0)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def time_until_token(self) -> float:
+        if self.rate <= 0:
+            return 0.0
+        self._refill()
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self) -> None:
+        if self.rate > 0:
+            self.tokens -= 1
+
+
+class ModelLane:
+    """
+    Admission control for one model: a concurrency cap, a token bucket and a
+    fair queue. Waiters are grouped by priority; within a priority, clients
+    are served round-robin so one bursty client cannot starve the others.
+    """
+
+    def __init__(self, model: str, max_concurrency: int, rate_per_minute: float = 0, burst: Optional[float] = None):
+        self.model = model
+        self.max_concurrency = max_concurrency
+        self.bucket = TokenBucket(rate_per_minute, burst)
+        self.active = 0
+        self._queues: Dict[int, "OrderedDict[str, Deque[asyncio.Future]]"] = {}
+        self._timer: Optional[asyncio.TimerHandle] = None
+        # stats
+        self.completed = 0
+        self.failed = 0
+        self.retries = 0
+        self.rate_limited = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.granted = 0
+
+    @property
+    def queued(self) -> int:
+        return sum(len(q) for clients in self._queues.values() for q in clients.values())
+
+    def _pop_next(self) -> Optional[asyncio.Future]:
+        for priority in sorted(self._queues):
+            clients = self._queues[priority]
+            while clients:
+                client_id, waiters = next(iter(clients.items()))
+                fut = waiters.popleft()
+                if waiters:
+                    clients.move_to_end(client_id)  # round-robin
+                else:
+                    del clients[client_id]
+                if not fut.done():
+                    return fut
+            del self._queues[priority]
+        return None
+
+    def _on_timer(self) -> None:
+        self._timer = None
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        while self.active < self.max_concurrency and self._queues:
+            wait = self.bucket.time_until_token()
+            if wait > 0:
+                if self._timer is None:
+                    self._timer = asyncio.get_running_loop().call_later(wait, self._on_timer)
+                return
+            fut = self._pop_next()
+            if fut is None:
+                return
+            self.bucket.take()
+            self.active += 1
+            fut.set_result(None)
+
+    async def acquire(self, client_id: str, priority: int) -> None:
+        fut = asyncio.get_running_loop().create_future()
+        self._queues.setdefault(priority, OrderedDict()).setdefault(client_id, deque()).append(fut)
+        started = time.monotonic()
+        self._dispatch()
+        try:
+            await fut
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                self.release()  # granted just as we were cancelled
+            raise
+        waited = time.monotonic() - started
+        self.granted += 1
+        self.wait_total += waited
+        self.wait_max = max(self.wait_max, waited)
+
+    def release(self) -> None:
+        self.active -= 1
+        self._dispatch()
+
+    def stats(self) -> dict:
+        return {
+            "queued": self.queued,
+            "active": self.active,
+            "max_concurrency": self.max_concurrency,
+            "rate_per_minute": self.bucket.rate * 60,
+            "completed": self.completed,
+            "failed": self.failed,
+            "retries": self.retries,
+            "rate_limited": self.rate_limited,
+            "wait_avg_seconds": self.wait_total / self.granted if self.granted else 0.0,
+            "wait_max_seconds": self.wait_max,
+        }
+
+
+class GeminiScheduler:
+    """
+    Central gate for upstream model calls: per-model lanes (concurrency +
+    token bucket + fair queue) and jittered exponential backoff on retryable
+    errors. Calls are plain zero-argument coroutine factories, so any client
+    (including a fake one) can be scheduled.
+    """
+
+    def __init__(self, max_retries: int = 3, base_delay: float = 1.0, max_delay: float = 20.0):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.lanes: Dict[str, ModelLane] = {}
+
+    def configure(self, model: str, max_concurrency: int, rate_per_minute: float = 0,
+                  burst: Optional[float] = None) -> ModelLane:
+        lane = ModelLane(model, max_concurrency, rate_per_minute, burst)
+        self.lanes[model] = lane
+        return lane
+
+    def _lane(self, model: str) -> ModelLane:
+        lane = self.lanes.get(model)
+        if lane is None:
+            lane = self.configure(model, max_concurrency=8)
+        return lane
+
+    def backoff(self, attempt: int) -> float:
+        """Full-jitter exponential backoff for retry number `attempt` (0-based)."""
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+    async def call(self, model: str, fn: Callable[[], Awaitable[T]],
+                   client_id: Optional[str] = None, priority: Optional[int] = None) -> T:
+        lane = self._lane(model)
+        client_id = client_id or current_client.get()
+        priority = current_priority.get() if priority is None else priority
+        attempt = 0
+        while True:
+            await lane.acquire(client_id, priority)
+            try:
+                result = await fn()
+            except Exception as e:
+                if is_rate_limited(e):
+                    lane.rate_limited += 1
+                if attempt >= self.max_retries or not is_retryable(e):
+                    lane.failed += 1
+                    raise
+                error = e
+            else:
+                lane.completed += 1
+                return result
+            finally:
+                lane.release()
+
+            delay = self.backoff(attempt)
+            attempt += 1
+            lane.retries += 1
+            print(f"[warn] {model} call failed ({error_status(error) or type(error).__name__}),"
+                  f" retry {attempt}/{self.max_retries} in {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+    def stats(self) -> dict:
+        return {model: lane.stats() for model, lane in self.lanes.items()}
@@ -0,0 +1,156 @@
+# settings.py
+import os
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Optional
+
+from image_prep import PrepConfig
+from uploads import UploadLimits
+
+BASE_DIR = Path(__file__).resolve().parent
+
+
+def _flag(name: str, default: str) -> bool:
+    return os.environ.get(name, default).lower() not in ("0", "false", "no", "")
+
+
+@dataclass(frozen=True)
+class Settings:
+    """
+    Process configuration. `Settings.from_env()` reads the environment (and
+    .env); nothing here touches the network or the disk beyond that.
+    """
+    gemini_api_key: Optional[str] = None
+    model_name: str = "gemini-2.5-flash-image-preview"
+
+    # Paths
+    static_dir: Path = BASE_DIR / "static"
+    templates_dir: Path = BASE_DIR / "templates"
+    output_dir: Path = BASE_DIR / "generated"
+    google_styles_dir: Path = BASE_DIR / "GoogleStyles"
+    manga_styles_dir: Path = BASE_DIR / "MangaStyles"
+    default_character_path: Path = BASE_DIR / "Default_Character" / "fornite_banana.png"
+
+    # Max Gemini image generations in flight per process; extra requests wait
+    # for a free slot without blocking the event loop.
+    max_inflight_generations: int = 8
+    # Upstream request budget (requests/minute, 0 = unlimited) and retry policy
+    gemini_image_rpm: float = 0
+    rewriter_max_concurrency: int = 8
+    rewriter_rpm: float = 0
+    gemini_max_retries: int = 3
+    gemini_retry_base_seconds: float = 1
+    gemini_retry_max_seconds: float = 20
+    # Identical default-flow generations in flight at the same time share one upstream call
+    coalesce_generations: bool = True
+    # Pre-generated results kept ready per default flow (0 = off), and how
+    # many generations may refill each pool at once
+    default_pool_size: int = 0
+    default_pool_refill_concurrency: int = 1
+
+    # Upper bound (bytes of encoded image data) for the reference-image Part cache
+    part_cache_max_bytes: int = 256 * 1024 * 1024
+
+    # Generated-image storage: "local" (sharded under output_dir) or "s3" (S3-compatible)
+    storage_backend: str = "local"
+    storage_index_path: Path = BASE_DIR / ".cache" / "assets.sqlite3"
+    storage_max_bytes: int = 0  # 0 = unlimited
+    storage_max_age_days: float = 0  # 0 = keep forever
+    s3_bucket: str = ""
+    s3_prefix: str = "generated"
+    s3_endpoint_url: Optional[str] = None
+
+    # Reference-image preprocessing before upload
+    prep: PrepConfig = field(default_factory=PrepConfig)
+    # Byte/pixel caps on uploaded reference images, per file and per request
+    uploads: UploadLimits = field(default_factory=UploadLimits)
+    # Max reference images (after de-duplication) sent with one generation
+    max_reference_images: int = 32
+    # Style preset folders are re-scanned at most this often
+    preset_rescan_seconds: float = 2
+    # Multi-worker mode: prepared presets live in one memory-mapped pack per
+    # host (built once, shared by all workers) instead of in every worker
+    preset_pack: bool = False
+    preset_pack_dir: Path = BASE_DIR / ".cache" / "presets"
+
+    # Background generation jobs (SQLite queue, drained by in-process workers)
+    job_db_path: Path = BASE_DIR / ".cache" / "jobs.sqlite3"
+    job_workers: int = 2
+    # A running job's claim lapses this long after its worker stops renewing it
+    job_lease_seconds: float = 60
+    # A job whose worker died this many times (lease expired each time) is failed
+    job_max_attempts: int = 3
+    job_max_wait_seconds: float = 30
+
+    # Batch endpoint limits
+    batch_max_items: int = 16
+    batch_default_concurrency: int = 4
+    batch_max_concurrency: int = 8
+
+    # Persistent cache of prompt-rewriter results (SQLite)
+    rewrite_cache_path: Path = BASE_DIR / ".cache" / "rewrites.sqlite3"
+    rewrite_cache_ttl_seconds: float = 7 * 24 * 3600
+    rewrite_cache_max_entries: int = 10000
+
+    # Log a one-line JSON timeline of pipeline stages for every request/job
+    request_timelines: bool = False
+    # Load presets, the genai client and the rewriter agent in the background
+    # right after startup instead of on first use
+    warmup: bool = True
+
+    @classmethod
+    def from_env(cls, env_file: Optional[Path] = BASE_DIR / ".env") -> "Settings":
+        if env_file is not None:
+            from dotenv import load_dotenv
+            load_dotenv(dotenv_path=env_file)
+        env = os.environ.get
+        return cls(
+            gemini_api_key=env("GEMINI_API_KEY") or None,
+            max_inflight_generations=int(env("MAX_INFLIGHT_GENERATIONS", "8")),
+            gemini_image_rpm=float(env("GEMINI_IMAGE_RPM", "0")),
+            rewriter_max_concurrency=int(env("REWRITER_MAX_CONCURRENCY", "8")),
+            rewriter_rpm=float(env("REWRITER_RPM", "0")),
+            gemini_max_retries=int(env("GEMINI_MAX_RETRIES", "3")),
+            gemini_retry_base_seconds=float(env("GEMINI_RETRY_BASE_SECONDS", "1")),
+            gemini_retry_max_seconds=float(env("GEMINI_RETRY_MAX_SECONDS", "20")),
+            coalesce_generations=_flag("COALESCE_GENERATIONS", "1"),
+            default_pool_size=int(env("DEFAULT_POOL_SIZE", "0")),
+            default_pool_refill_concurrency=int(env("DEFAULT_POOL_REFILL_CONCURRENCY", "1")),
+            part_cache_max_bytes=int(env("PART_CACHE_MAX_BYTES", str(256 * 1024 * 1024))),
+            storage_backend=env("STORAGE_BACKEND", "local").lower(),
+            storage_index_path=Path(env("STORAGE_INDEX_PATH", str(BASE_DIR / ".cache" / "assets.sqlite3"))),
+            storage_max_bytes=int(env("STORAGE_MAX_BYTES", "0")),
+            storage_max_age_days=float(env("STORAGE_MAX_AGE_DAYS", "0")),
+            s3_bucket=env("S3_BUCKET", ""),
+            s3_prefix=env("S3_PREFIX", "generated"),
+            s3_endpoint_url=env("S3_ENDPOINT_URL") or None,
+            prep=PrepConfig(
+                enabled=_flag("REF_PREPROCESS", "1"),
+                max_edge=int(env("REF_MAX_EDGE", "1536")),
+                photo_format=env("REF_PHOTO_FORMAT", "jpeg").upper(),
+                quality=int(env("REF_QUALITY", "85")),
+            ),
+            uploads=UploadLimits(
+                max_file_bytes=int(env("UPLOAD_MAX_FILE_BYTES", str(20 * 1024 * 1024))),
+                max_request_bytes=int(env("UPLOAD_MAX_REQUEST_BYTES", str(64 * 1024 * 1024))),
+                max_file_pixels=int(env("UPLOAD_MAX_FILE_PIXELS", "40000000")),
+                max_request_pixels=int(env("UPLOAD_MAX_REQUEST_PIXELS", "100000000")),
+            ),
+            max_reference_images=int(env("MAX_REFERENCE_IMAGES", "32")),
+            preset_rescan_seconds=float(env("PRESET_RESCAN_SECONDS", "2")),
+            preset_pack=_flag("PRESET_PACK", "0"),
+            preset_pack_dir=Path(env("PRESET_PACK_DIR", str(BASE_DIR / ".cache" / "presets"))),
+            job_db_path=Path(env("JOB_DB_PATH", str(BASE_DIR / ".cache" / "jobs.sqlite3"))),
+            job_workers=int(env("JOB_WORKERS", "2")),
+            job_lease_seconds=float(env("JOB_LEASE_SECONDS", "60")),
+            job_max_attempts=int(env("JOB_MAX_ATTEMPTS", "3")),
+            job_max_wait_seconds=float(env("JOB_MAX_WAIT_SECONDS", "30")),
+            batch_max_items=int(env("BATCH_MAX_ITEMS", "16")),
+            batch_default_concurrency=int(env("BATCH_DEFAULT_CONCURRENCY", "4")),
+            batch_max_concurrency=int(env("BATCH_MAX_CONCURRENCY", "8")),
+            rewrite_cache_path=Path(env("REWRITE_CACHE_PATH", str(BASE_DIR / ".cache" / "rewrites.sqlite3"))),
+            rewrite_cache_ttl_seconds=float(env("REWRITE_CACHE_TTL_SECONDS", str(7 * 24 * 3600))),
+            rewrite_cache_max_entries=int(env("REWRITE_CACHE_MAX_ENTRIES", "10000")),
+            request_timelines=_flag("REQUEST_TIMELINES", "0"),
+            warmup=_flag("WARMUP", "1"),
+        )
@@ -0,0 +1,265 @@
+# storage.py
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import List, Optional
+
+
+@dataclass
+class StoredAsset:
+    """One generated image: `name` is the public filename, `key` its backend location."""
+    name: str
+    key: str
+    mime_type: str
+    size: int
+    sha256: str
+    prompt_hash: Optional[str]
+    created_at: float
+
+
+class AssetIndex:
+    """SQLite index of generated assets (id, prompt hash, size, created_at, ...)."""
+
+    _COLUMNS = "name, key, mime_type, size, sha256, prompt_hash, created_at"
+
+    def __init__(self, path: Path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(str(path), check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS assets ("
+            " name TEXT PRIMARY KEY, key TEXT NOT NULL, mime_type TEXT NOT NULL,"
+            " size INTEGER NOT NULL, sha256 TEXT NOT NULL, prompt_hash TEXT,"
+            " created_at REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS assets_created ON assets(created_at)")
+        self._lock = threading.Lock()
+
+    def add(self, asset: StoredAsset) -> None:
+        with self._lock:
+            self._db.execute(
+                f"INSERT OR REPLACE INTO assets ({self._COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (asset.name, asset.key, asset.mime_type, asset.size, asset.sha256,
+                 asset.prompt_hash, asset.created_at),
+            )
+
+    def get(self, name: str) -> Optional[StoredAsset]:
+        with self._lock:
+            row = self._db.execute(
+                f"SELECT {self._COLUMNS} FROM assets WHERE name = ?", (name,)
+            ).fetchone()
+        return StoredAsset(*row) if row else None
+
+    def remove(self, name: str) -> None:
+        with self._lock:
+            self._db.execute("DELETE FROM assets WHERE name = ?", (name,))
+
+    def derived_of(self, name: str) -> List[StoredAsset]:
+        """Assets derived from `name` (e.g. generated_x.png -> generated_x.w256.webp)."""
+        prefix = name.rsplit(".", 1)[0] + "."
+        with self._lock:
+            rows = self._db.execute(
+                f"SELECT {self._COLUMNS} FROM assets WHERE substr(name, 1, ?) = ? AND name != ?",
+                (len(prefix), prefix, name),
+            ).fetchall()
+        return [StoredAsset(*r) for r in rows]
+
+    def oldest(self, limit: int = 100, before: Optional[float] = None) -> List[StoredAsset]:
+        query = f"SELECT {self._COLUMNS} FROM assets"
+        args: tuple = ()
+        if before is not None:
+            query += " WHERE created_at < ?"
+            args = (before,)
+        query += " ORDER BY created_at LIMIT ?"
+        with self._lock:
+            rows = self._db.execute(query, (*args, limit)).fetchall()
+        return [StoredAsset(*r) for r in rows]
+
+    def totals(self) -> dict:
+        with self._lock:
+            count, size = self._db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM assets").fetchone()
+        return {"assets": count, "bytes": size}
+
+
+class Storage(ABC):
+    """
+    Base class for generated-image storage.
+
+    Keys are sharded by date and content hash (YYYY/MM/DD/ab/<name>), every
+    asset is recorded in an AssetIndex, and `enforce_retention()` evicts the
+    oldest assets once they exceed `max_age_seconds` or the total exceeds
+    `max_bytes` (0 disables either limit). Subclasses implement the
+    `_write`/`_read`/`_delete` primitives.
+    """
+
+    retention_interval = 60.0
+
+    def __init__(self, index: AssetIndex, max_bytes: int = 0, max_age_seconds: float = 0):
+        self.index = index
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        self._last_retention = 0.0
+
+    # --- backend primitives ---
+    @abstractmethod
+    def _write(self, key: str, data: bytes, mime_type: str) -> None:
+        ...
+
+    @abstractmethod
+    def _read(self, key: str) -> bytes:
+        """The stored bytes; FileNotFoundError if `key` does not exist."""
+
+    @abstractmethod
+    def _delete(self, key: str) -> None:
+        ...
+
+    def local_path(self, asset: StoredAsset) -> Optional[Path]:
+        """Filesystem path for backends that have one (lets callers use FileResponse)."""
+        return None
+
+    # --- public API ---
+    def describe(self, data: bytes, mime_type: str, ext: str, prompt_hash: Optional[str] = None) -> StoredAsset:
+        """Name and key a new asset without writing it (the name is known before the bytes land)."""
+        now = time.time()
+        digest = hashlib.sha256(data).hexdigest()
+        ts = datetime.fromtimestamp(now, tz=timezone.utc)
+        name = f"generated_{ts.strftime('%Y%m%d_%H%M%S%f')}_{digest[:8]}{ext}"
+        key = f"{ts.strftime('%Y/%m/%d')}/{digest[:2]}/{name}"
+        return StoredAsset(name, key, mime_type, len(data), digest, prompt_hash, now)
+
+    def describe_derived(self, name: str, data: bytes, mime_type: str,
+                         parent: Optional[StoredAsset] = None) -> StoredAsset:
+        """Key a file derived from `parent` (thumbnails etc.) so it is stored right next to it."""
+        # files without an indexed parent (pre-index outputs) sit at the top level, like their originals
+        folder = parent.key.rsplit("/", 1)[0] if parent is not None and "/" in parent.key else ""
+        return StoredAsset(
+            name, f"{folder}/{name}" if folder else name, mime_type, len(data), hashlib.sha256(data).hexdigest(),
+            parent.prompt_hash if parent is not None else None, time.time(),
+        )
+
+    def put(self, asset: StoredAsset, data: bytes) -> None:
+        self._write(asset.key, data, asset.mime_type)
+        self.index.add(asset)
+        if (self.max_bytes or self.max_age_seconds) and \
+                time.monotonic() - self._last_retention >= self.retention_interval:
+            self.enforce_retention()
+
+    def get(self, name: str) -> Optional[StoredAsset]:
+        return self.index.get(name)
+
+    def read(self, asset: StoredAsset) -> bytes:
+        return self._read(asset.key)
+
+    def delete(self, asset: StoredAsset) -> int:
+        """Delete an asset and anything derived from it; returns the bytes freed."""
+        freed = 0
+        for derived in self.index.derived_of(asset.name):
+            self._delete_one(derived)
+            freed += derived.size
+        self._delete_one(asset)
+        return freed + asset.size
+
+    def _delete_one(self, asset: StoredAsset) -> None:
+        try:
+            self._delete(asset.key)
+        except FileNotFoundError:
+            pass
+        self.index.remove(asset.name)
+
+    def enforce_retention(self) -> int:
+        """Evict by age, then oldest-first until under max_bytes. Returns the number evicted."""
+        self._last_retention = time.monotonic()
+        evicted = 0
+        if self.max_age_seconds:
+            cutoff = time.time() - self.max_age_seconds
+            while True:
+                batch = self.index.oldest(before=cutoff)
+                if not batch:
+                    break
+                for asset in batch:
+                    self.delete(asset)
+                    evicted += 1
+        if self.max_bytes:
+            total = self.index.totals()["bytes"]
+            while total > self.max_bytes:
+                batch = self.index.oldest()
+                if not batch:
+                    break
+                for asset in batch:
+                    if total <= self.max_bytes:
+                        break
+                    total -= self.delete(asset)
+                    evicted += 1
+        if evicted:
+            print(f"[info] storage retention evicted {evicted} assets")
+        return evicted
+
+    def stats(self) -> dict:
+        return {**self.index.totals(), "max_bytes": self.max_bytes, "max_age_seconds": self.max_age_seconds}
+
+
+class LocalStorage(Storage):
+    """Sharded directories under `root`; writes go through a temp file + rename."""
+
+    def __init__(self, root: Path, index: AssetIndex, **kwargs):
+        super().__init__(index, **kwargs)
+        self.root = root
+        root.mkdir(parents=True, exist_ok=True)
+
+    def local_path(self, asset: StoredAsset) -> Optional[Path]:
+        return self.root / asset.key
+
+    def _write(self, key: str, data: bytes, mime_type: str) -> None:
+        path = self.root / key
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(path.name + ".part")
+        tmp_path.write_bytes(data)
+        os.replace(tmp_path, path)
+
+    def _read(self, key: str) -> bytes:
+        return (self.root / key).read_bytes()
+
+    def _delete(self, key: str) -> None:
+        (self.root / key).unlink()
+
+
+class S3Storage(Storage):
+    """
+    S3-compatible object storage (AWS S3, MinIO, a local moto server, ...).
+    Requires boto3, which is imported lazily so local deployments don't need it.
+    """
+
+    def __init__(self, bucket: str, index: AssetIndex, prefix: str = "",
+                 endpoint_url: Optional[str] = None, client=None, **kwargs):
+        super().__init__(index, **kwargs)
+        if client is None:
+            try:
+                import boto3
+            except ImportError as e:
+                raise RuntimeError("STORAGE_BACKEND=s3 requires boto3 (pip install boto3).") from e
+            client = boto3.client("s3", endpoint_url=endpoint_url)
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix.strip("/")
+
+    def _object_key(self, key: str) -> str:
+        return f"{self.prefix}/{key}" if self.prefix else key
+
+    def _write(self, key: str, data: bytes, mime_type: str) -> None:
+        self.client.put_object(Bucket=self.bucket, Key=self._object_key(key), Body=data, ContentType=mime_type)
+
+    def _read(self, key: str) -> bytes:
+        try:
+            obj = self.client.get_object(Bucket=self.bucket, Key=self._object_key(key))
+        except self.client.exceptions.NoSuchKey as e:
+            raise FileNotFoundError(key) from e
+        return obj["Body"].read()
+
+    def _delete(self, key: str) -> None:
+        self.client.delete_object(Bucket=self.bucket, Key=self._object_key(key))
@@ -0,0 +1,46 @@
+# tests/conftest.py
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from settings import Settings  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def make_settings(tmp_path_factory):
+    """Settings with every on-disk path in a fresh temporary directory; keyword overrides win."""
+    def make(**overrides) -> Settings:
+        tmp = tmp_path_factory.mktemp("app")
+        options = dict(
+            gemini_api_key="test",
+            output_dir=tmp / "generated",
+            storage_index_path=tmp / "assets.sqlite3",
+            job_db_path=tmp / "jobs.sqlite3",
+            rewrite_cache_path=tmp / "rewrites.sqlite3",
+            warmup=False,
+        )
+        options.update(overrides)
+        return Settings(**options)
+    return make
+
+
+@pytest.fixture(scope="module")
+def app_client(make_settings):
+    """The app on a TestClient, with the Gemini client and the rewriter agent replaced by local fakes."""
+    import main
+    from fastapi.testclient import TestClient
+
+    from benchmarks.fakes import FakeRewriterAgent, fake_genai_client, make_image
+    from rewriter import PromptRewriter
+
+    with TestClient(main.create_app(make_settings(coalesce_generations=False))) as http:
+        main.client = fake_genai_client(make_image(64, 64), latency=0)
+        agent = FakeRewriterAgent(name="fake_rewriter")
+        main.SCHEDULER.configure(agent.name, 1, 0)
+        main.PROMPT_REWRITER = PromptRewriter(agent, scheduler=main.SCHEDULER)
+        yield http
+    main.client = None
+    main.PROMPT_REWRITER = None
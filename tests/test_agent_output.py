@@ -0,0 +1,73 @@
+# tests/test_agent_output.py
+import json
+
+import pytest
+
+from agent_output import RewriteResult, extract_json_block, find_json_object
+
+ANSWER = {
+    "chosen_template_id": 6,
+    "chosen_template_name": "Sequential Art",
+    "rationale": "manga panels",
+    "rewritten_prompt": 'A manga page with {speech balloons} and "quotes"',
+    "suggested_aspect_ratio": "4:5",
+    "optional_followups": ["Color?"],
+    "meta": {"k": [1, 2]},
+}
+TEXT = json.dumps(ANSWER)
+
+
+@pytest.mark.parametrize("response", [
+    TEXT,
+    "\n  " + TEXT + "\ntrailing prose",
+    "Here you go:\n```json\n" + json.dumps(ANSWER, indent=2) + "\n```",
+    "```\n" + TEXT + "\n```",
+    "Template [6] uses {panel_count} panels and {style}.\n" + TEXT,
+    "An unclosed { brace, then " + TEXT,
+    'A stray "quote in prose, then ' + TEXT + " and more.",
+])
+def test_find_json_object_recovers_the_answer(response):
+    obj, (start, end) = find_json_object(response)
+    assert obj == ANSWER
+    assert json.loads(response[start:end]) == ANSWER
+    assert extract_json_block(response) == response[start:end]
+
+
+@pytest.mark.parametrize("response", ["", "no json here", "{not json}", "{\"a\": 1", "[1, 2, 3]"])
+def test_find_json_object_without_an_object(response):
+    assert find_json_object(response) is None
+    assert extract_json_block(response) is None
+
+
+def test_find_json_object_searches_inside_invalid_spans():
+    assert find_json_object('Wrapper {not json {"a": 1} still not} done')[0] == {"a": 1}
+
+
+@pytest.mark.parametrize("response", [
+    'b{ "\\{ }} ' + TEXT + '"b "',  # stray quotes make an inner object look like the answer
+    '{}"ba' + TEXT + '\\}a {,a}a" ',
+    '"{}b{,' + TEXT + ",ba",
+    'Example: {"k": [1, 2]}\n' + TEXT,  # a valid object that is not an answer comes first
+])
+def test_parse_keeps_trying_candidates(response):
+    result = RewriteResult.parse(response)
+    assert result is not None and result.rewritten_prompt == ANSWER["rewritten_prompt"]
+
+
+def test_parse_rejects_objects_without_a_prompt():
+    assert RewriteResult.parse('{"k": [1, 2]} {"rewritten_prompt": "  "}') is None
+    assert RewriteResult.parse(None) is None
+
+
+def test_from_dict_normalizes_fields():
+    result = RewriteResult.from_dict({
+        "rewritten_prompt": "  a cat  ",
+        "chosen_template_id": "6",
+        "suggested_aspect_ratio": " 16 x 9 ",
+        "optional_followups": "Color?",
+    })
+    assert result.rewritten_prompt == "a cat"
+    assert result.template_id == 6 and result.aspect_ratio == "16:9" and result.followups == ("Color?",)
+    assert RewriteResult.from_dict({"rewritten_prompt": "x", "chosen_template_id": 11}).template_id is None
+    assert RewriteResult.from_dict({"rewritten_prompt": "x", "chosen_template_id": True}).template_id is None
+    assert RewriteResult.from_dict(RewriteResult.parse(TEXT).to_dict()) == RewriteResult.parse(TEXT)
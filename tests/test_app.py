@@ -0,0 +1,12 @@
+# tests/test_app.py
+from fastapi.testclient import TestClient
+
+import main
+
+
+def test_index_uses_templates_dir_from_settings(make_settings, tmp_path):
+    (tmp_path / "index.html").write_text("<h1>custom index</h1>")
+    with TestClient(main.create_app(make_settings(templates_dir=tmp_path))) as http:
+        response = http.get("/")
+    assert response.status_code == 200
+    assert "custom index" in response.text
@@ -0,0 +1,92 @@
+# tests/test_assembly.py
+import itertools
+
+import pytest
+from google.genai import types
+
+import main
+from assembly import ContentAssemblyError, ContentBuilder
+from benchmarks.fakes import make_image
+
+
+def _part(data: bytes, mime_type: str = "image/png") -> types.Part:
+    return types.Part(inline_data=types.Blob(mime_type=mime_type, data=data))
+
+
+# ---------------- ContentBuilder ----------------
+def test_builder_keeps_images_in_order_then_one_prompt():
+    assembly = ContentBuilder().add_images([_part(b"a"), _part(b"b")]).set_prompt("  draw  ").build()
+    contents = assembly.contents()
+    assert [p.inline_data.data for p in contents[:-1]] == [b"a", b"b"]
+    assert contents[-1] == "draw"
+    assert assembly.part_count == 3
+
+
+def test_builder_drops_duplicate_images():
+    builder = ContentBuilder()
+    builder.add_images([_part(b"a"), _part(b"b")], [10, 20])
+    builder.add_images([_part(b"a"), _part(b"c")], [10, 30])
+    assembly = builder.set_prompt("x").build()
+    assert [p.inline_data.data for p in assembly.images] == [b"a", b"b", b"c"]
+    assert assembly.duplicates_dropped == 1
+    assert assembly.source_bytes == 60
+
+
+def test_builder_rejects_non_image_mime_type():
+    with pytest.raises(ContentAssemblyError, match="mime type"):
+        ContentBuilder().add_images([_part(b"a", "application/pdf")])
+
+
+def test_builder_rejects_empty_inline_data():
+    with pytest.raises(ContentAssemblyError, match="inline image data"):
+        ContentBuilder().add_images([_part(b"")])
+    with pytest.raises(ContentAssemblyError, match="inline image data"):
+        ContentBuilder().add_images([types.Part(text="not an image")])
+
+
+@pytest.mark.parametrize("prompt", [None, "", "   \n"])
+def test_builder_requires_a_prompt(prompt):
+    builder = ContentBuilder().add_images([_part(b"a")])
+    if prompt is not None:
+        builder.set_prompt(prompt)
+    with pytest.raises(ContentAssemblyError, match="prompt"):
+        builder.build()
+
+
+def test_builder_enforces_max_images():
+    images = [_part(bytes([i])) for i in range(3)]
+    assert ContentBuilder(max_images=3).add_images(images).set_prompt("x").build().part_count == 4
+    with pytest.raises(ContentAssemblyError, match="Too many"):
+        ContentBuilder(max_images=2).add_images(images).set_prompt("x").build()
+
+
+# ---------------- /api/generate-image ----------------
+@pytest.mark.parametrize(
+    "google_styles,character,manga,upload", list(itertools.product([False, True], repeat=4))
+)
+def test_generate_image_contents(app_client, google_styles, character, manga, upload):
+    data = {
+        "prompt": "Two researchers discover a new comet",
+        "include_default_google_styles": str(google_styles).lower(),
+        "include_default_character": str(character).lower(),
+        "include_manga_styles": str(manga).lower(),
+    }
+    files = [("style_images", ("ref.jpg", make_image(96, 96, "JPEG", seed=7), "image/jpeg"))] if upload else None
+    response = app_client.post("/api/generate-image", data=data, files=files)
+    assert response.status_code == 200, response.text
+
+    contents = main.client.aio.models.last_contents
+    strings = [c for c in contents if isinstance(c, str)]
+    assert len(strings) == 1 and contents[-1] is strings[0] and strings[0].strip()
+    assert all(isinstance(c, types.Part) and c.inline_data.data for c in contents[:-1])
+    if manga:
+        assert strings[0].startswith("Manga page")
+
+    expected_images = (
+        int(upload)
+        + int(character and main.SETTINGS.default_character_path.exists())
+        + (len(main.PRESET_MANGA.parts()) if manga else 0)
+        + (len(main.PRESET_GOOGLE.parts()) if google_styles else 0)
+    )
+    assert len(contents) == expected_images + 1
+
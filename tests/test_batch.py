@@ -0,0 +1,75 @@
+# tests/test_batch.py
+import base64
+import json
+
+import main
+
+
+def _events(response) -> list:
+    """(event, data) pairs from a text/event-stream body."""
+    events = []
+    for block in response.text.strip().split("\n\n"):
+        fields = dict(line.split(": ", 1) for line in block.splitlines())
+        events.append((fields["event"], json.loads(fields["data"])))
+    return events
+
+
+def test_batch_rejects_too_many_variations_up_front(app_client):
+    calls = main.client.aio.models.calls
+    for data in ({"variations": "1000000000"}, {"prompts": ["p"] * (main.SETTINGS.batch_max_items + 1)}):
+        response = app_client.post("/api/generate-batch", data=data)
+        assert response.status_code == 400
+        assert "per batch" in response.json()["detail"]
+    assert main.client.aio.models.calls == calls
+
+
+def test_batch_streams_images_errors_and_done(app_client, monkeypatch):
+    models = main.client.aio.models
+    generate = models.generate_content
+
+    async def fail_on_bad_prompt(model, contents, **kwargs):
+        if "bad" in contents[-1]:
+            raise ValueError("boom")
+        return await generate(model=model, contents=contents, **kwargs)
+
+    monkeypatch.setattr(models, "generate_content", fail_on_bad_prompt)
+    data = {
+        "prompts": ["good comet", "bad comet", "good comet"],
+        "include_default_google_styles": "false",
+        "include_data": "true",
+    }
+    response = app_client.post("/api/generate-batch", data=data)
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+
+    events = _events(response)
+    assert events[-1] == ("done", {"count": 3, "failed": 1})
+    images = {p["index"]: p for e, p in events if e == "image"}
+    errors = [p for e, p in events if e == "error"]
+    assert sorted(images) == [0, 2]
+    assert errors == [{"index": 1, "prompt": "bad comet", "detail": "Gemini generation failed: boom"}]
+    for payload in images.values():
+        assert payload["prompt"] == "good comet"
+        assert payload["url"] == f"/files/{payload['name']}"
+        assert base64.b64decode(payload["data"]) == models.image
+
+
+def test_batch_rewrites_each_distinct_prompt_once(app_client, monkeypatch):
+    rewriter = main.PROMPT_REWRITER
+    run = rewriter.run
+    rewritten = []
+
+    async def counting_run(raw_prompt):
+        rewritten.append(raw_prompt)
+        return await run(raw_prompt)
+
+    monkeypatch.setattr(rewriter, "run", counting_run)
+    data = {
+        "prompts": ["a cat", "a dog", "a cat", "a cat"],
+        "include_default_google_styles": "false",
+        "include_manga_styles": "true",
+    }
+    events = _events(app_client.post("/api/generate-batch", data=data))
+    assert sorted(rewritten) == ["a cat", "a dog"]
+    assert events[-1] == ("done", {"count": 4, "failed": 0})
+    assert sorted(p["index"] for e, p in events if e == "image") == [0, 1, 2, 3]
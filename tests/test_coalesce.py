@@ -0,0 +1,75 @@
+# tests/test_coalesce.py
+import asyncio
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from benchmarks.fakes import fake_genai_client, make_image
+from coalesce import SingleFlight
+
+
+def test_identical_calls_share_one_flight():
+    async def run():
+        flights = SingleFlight()
+        calls = 0
+
+        async def fn():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.01)
+            return "image"
+
+        results = await asyncio.gather(*(flights.run("k", fn) for _ in range(3)))
+        assert calls == 1
+        assert [r for r, _ in results] == ["image"] * 3
+        assert sorted(first for _, first in results) == [False, False, True]
+        assert flights.stats() == {"in_flight": 0, "started": 1, "coalesced": 2}
+
+    asyncio.run(run())
+
+
+def test_caller_arriving_after_last_waiter_left_starts_a_new_flight():
+    async def run():
+        flights = SingleFlight()
+        started = []
+
+        async def fn():
+            started.append(1)
+            await asyncio.sleep(0.05)
+            return len(started)
+
+        a = asyncio.ensure_future(flights.run("k", fn))
+        await asyncio.sleep(0)
+        a.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await a
+        # the cancelled flight has not unwound yet; B must not join it
+        result, first = await flights.run("k", fn)
+        assert (result, first) == (2, True)
+        assert flights.stats()["in_flight"] == 0
+
+    asyncio.run(run())
+
+
+def test_only_default_flows_are_coalesced(make_settings):
+    async def post_together(app, path, data):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as http:
+            return await asyncio.gather(http.post(path, data=data), http.post(path, data=data))
+
+    with TestClient(main.create_app(make_settings(coalesce_generations=True))) as client:
+        main.client = fake_genai_client(make_image(64, 64), latency=0.1)
+        models = main.client.aio.models
+        try:
+            data = {"prompt": "A comet", "include_default_google_styles": "false"}
+            responses = client.portal.call(post_together, client.app, "/api/generate-image", data)
+            assert [r.status_code for r in responses] == [200, 200]
+            assert models.calls == 2  # user requests each get their own generation
+
+            responses = client.portal.call(post_together, client.app, "/api/generate-default", None)
+            assert [r.status_code for r in responses] == [200, 200]
+            assert models.calls == 3
+        finally:
+            main.client = None
@@ -0,0 +1,123 @@
+# tests/test_files.py
+import asyncio
+
+import pytest
+
+import main
+from benchmarks.fakes import FakeS3Client, make_image
+from storage import AssetIndex, S3Storage
+from thumbnails import thumbnail_name
+
+DATA = bytes(range(10)) * 10  # 100 bytes
+
+
+def _put(data: bytes = DATA, mime_type: str = "image/png"):
+    asset = main.STORAGE.describe(data, mime_type, ".png")
+    main.STORAGE.put(asset, data)
+    return asset
+
+
+@pytest.fixture
+def s3_storage(monkeypatch, tmp_path):
+    storage = S3Storage("bucket", AssetIndex(tmp_path / "assets.sqlite3"), client=FakeS3Client())
+    monkeypatch.setattr(main, "STORAGE", storage)
+    return storage
+
+
+def test_etag_and_not_modified(app_client):
+    asset = _put()
+    response = app_client.get(f"/files/{asset.name}")
+    assert response.status_code == 200 and response.content == DATA
+    etag = response.headers["ETag"]
+    assert etag == f'"{asset.sha256[:32]}"'
+    assert "immutable" in response.headers["Cache-Control"]
+
+    for header in (etag, f'"other", W/{etag}', "*"):
+        cached = app_client.get(f"/files/{asset.name}", headers={"If-None-Match": header})
+        assert cached.status_code == 304 and cached.content == b""
+        assert cached.headers["ETag"] == etag
+    assert app_client.get(f"/files/{asset.name}", headers={"If-None-Match": '"other"'}).status_code == 200
+
+
+@pytest.mark.parametrize("range_header,content_range,body", [
+    ("bytes=0-3", "bytes 0-3/100", DATA[:4]),
+    ("bytes=95-", "bytes 95-99/100", DATA[95:]),
+    ("bytes=-5", "bytes 95-99/100", DATA[95:]),
+    ("bytes=90-500", "bytes 90-99/100", DATA[90:]),
+])
+def test_ranges_from_object_storage(app_client, s3_storage, range_header, content_range, body):
+    asset = _put()
+    response = app_client.get(f"/files/{asset.name}", headers={"Range": range_header})
+    assert response.status_code == 206
+    assert response.headers["Content-Range"] == content_range
+    assert response.content == body
+    assert response.headers["Content-Disposition"] == f'attachment; filename="{asset.name}"'
+
+
+@pytest.mark.parametrize("range_header", ["bytes=100-", "bytes=7-3"])
+def test_unsatisfiable_range(app_client, s3_storage, range_header):
+    asset = _put()
+    response = app_client.get(f"/files/{asset.name}", headers={"Range": range_header})
+    assert response.status_code == 416
+    assert response.headers["Content-Range"] == "bytes */100"
+
+
+def test_object_storage_without_range(app_client, s3_storage):
+    asset = _put()
+    response = app_client.get(f"/files/{asset.name}", headers={"Range": "items=0-1"})
+    assert response.status_code == 200 and response.content == DATA
+    assert response.headers["Accept-Ranges"] == "bytes"
+    s3_storage.client.objects.clear()
+    assert app_client.get(f"/files/{asset.name}").status_code == 404
+
+
+def test_legacy_file_etag(app_client):
+    path = main.SETTINGS.output_dir / "generated_legacy.png"
+    path.write_bytes(DATA)
+    st = path.stat()
+    response = app_client.get("/files/generated_legacy.png")
+    assert response.status_code == 200 and response.content == DATA
+    assert response.headers["ETag"] == f'"{st.st_mtime_ns:x}-{st.st_size:x}"'
+    cached = app_client.get("/files/generated_legacy.png", headers={"If-None-Match": response.headers["ETag"]})
+    assert cached.status_code == 304
+    assert app_client.get("/files/missing.png").status_code == 404
+
+
+def test_thumbnail_is_rendered_once_then_served_from_storage(app_client, monkeypatch):
+    asset = _put(make_image(600, 400))
+    response = app_client.get(f"/files/{asset.name}/thumb", params={"w": 256})
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "image/webp"
+    stored = main.STORAGE.get(thumbnail_name(asset.name, 256, "webp"))
+    assert stored is not None and stored.key.rsplit("/", 1)[0] == asset.key.rsplit("/", 1)[0]
+
+    def no_render(*args):
+        raise AssertionError("thumbnail rendered twice")
+
+    monkeypatch.setattr(main, "render_thumbnail", no_render)
+    again = app_client.get(f"/files/{asset.name}/thumb", params={"w": 256})
+    assert again.status_code == 200 and again.content == response.content
+    assert again.headers["ETag"] == f'"{stored.sha256[:32]}"'
+
+
+def test_thumbnail_errors(app_client):
+    asset = _put(make_image(64, 64))
+    assert app_client.get(f"/files/{asset.name}/thumb", params={"w": 300}).status_code == 400
+    assert app_client.get(f"/files/{asset.name}/thumb", params={"format": "gif"}).status_code == 400
+    assert app_client.get("/files/missing.png/thumb").status_code == 404
+    broken = _put(b"not an image")
+    assert app_client.get(f"/files/{broken.name}/thumb").status_code == 422
+
+
+def test_index_lookups_run_off_the_event_loop(app_client, monkeypatch):
+    asset = _put()
+    lookup = main.STORAGE.get
+
+    def get(name):
+        with pytest.raises(RuntimeError):
+            asyncio.get_running_loop()  # a worker thread has no running loop
+        return lookup(name)
+
+    monkeypatch.setattr(main.STORAGE, "get", get)
+    assert app_client.get(f"/files/{asset.name}").status_code == 200
+    assert app_client.get(f"/files/{asset.name}/thumb").status_code == 422
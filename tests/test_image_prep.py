@@ -0,0 +1,20 @@
+# tests/test_image_prep.py
+import pytest
+
+from benchmarks.fakes import make_image
+from image_prep import PrepConfig, prepare_reference
+from settings import Settings
+
+
+@pytest.mark.parametrize("fmt,mime_type", [("JPEG", "image/jpeg"), ("WEBP", "image/webp"), ("PNG", "image/png")])
+def test_large_photo_is_resized_to_photo_format(fmt, mime_type):
+    part = prepare_reference(make_image(600, 400), PrepConfig(max_edge=300, photo_format=fmt))
+    assert part.inline_data.mime_type == mime_type
+
+
+def test_unsupported_photo_format_fails_at_startup(monkeypatch):
+    with pytest.raises(ValueError, match="REF_PHOTO_FORMAT"):
+        PrepConfig(photo_format="GIF")
+    monkeypatch.setenv("REF_PHOTO_FORMAT", "gif")
+    with pytest.raises(ValueError, match="'GIF'"):
+        Settings.from_env(env_file=None)
@@ -0,0 +1,108 @@
+# tests/test_jobs.py
+import asyncio
+import time
+
+from jobs import FAILED, QUEUED, RUNNING, SUCCEEDED, JobQueue, JobStore
+
+
+def test_live_lease_is_not_taken_over(tmp_path):
+    store = JobStore(tmp_path / "jobs.sqlite3")
+    job = store.create({"prompt": "x"}, [("a.png", b"data")])
+    assert store.claim_next("worker-a", lease_seconds=60).id == job.id
+
+    # a sibling process starting up leaves the live claim alone
+    sibling = JobStore(tmp_path / "jobs.sqlite3")
+    assert sibling.requeue_expired() == (0, 0)
+    assert sibling.claim_next("worker-b", lease_seconds=60) is None
+    assert store.renew(job.id, "worker-a", 60)
+    assert store.succeed(job.id, "worker-a", "out.png")
+    assert store.get(job.id).status == SUCCEEDED
+    assert store.inputs(job.id) == []
+
+
+def test_expired_lease_is_reclaimed_and_old_owner_cannot_finish(tmp_path):
+    store = JobStore(tmp_path / "jobs.sqlite3")
+    job = store.create({"prompt": "x"}, [])
+    store.claim_next("worker-a", lease_seconds=0.01)
+    time.sleep(0.05)
+
+    reclaimed = store.claim_next("worker-b", lease_seconds=60)
+    assert reclaimed.id == job.id and reclaimed.attempts == 2
+    assert not store.renew(job.id, "worker-a", 60)
+    assert not store.fail(job.id, "worker-a", "too late")
+    assert store.get(job.id).status == RUNNING
+    assert store.fail(job.id, "worker-b", "boom")
+    assert store.get(job.id).status == FAILED
+
+
+def test_release_and_requeue_expired(tmp_path):
+    store = JobStore(tmp_path / "jobs.sqlite3")
+    job = store.create({}, [("a.png", b"data")])
+    store.claim_next("worker-a", lease_seconds=60)
+    assert store.release(job.id, "worker-a")
+    assert store.get(job.id).status == QUEUED
+    assert store.inputs(job.id) == [("a.png", b"data")]
+
+    store.claim_next("worker-a", lease_seconds=0)
+    time.sleep(0.01)
+    assert store.requeue_expired() == (1, 0)
+    assert store.get(job.id).status == QUEUED
+
+
+def test_job_that_keeps_killing_its_worker_fails(tmp_path):
+    store = JobStore(tmp_path / "jobs.sqlite3", max_attempts=2)
+    job = store.create({}, [("a.png", b"data")])
+    for worker in ("worker-a", "worker-b"):  # each claim lapses: the process died
+        assert store.claim_next(worker, lease_seconds=0).id == job.id
+        time.sleep(0.01)
+
+    assert store.claim_next("worker-c", lease_seconds=60) is None
+    failed = store.get(job.id)
+    assert failed.status == FAILED and failed.attempts == 2
+    assert "2 attempts" in failed.error
+    assert store.inputs(job.id) == []
+
+
+def test_out_of_attempts_on_restart(tmp_path):
+    store = JobStore(tmp_path / "jobs.sqlite3", max_attempts=0)
+    crashed = store.create({}, [])
+    released = store.create({}, [])
+    assert store.claim_next("worker-a", lease_seconds=0.05).id == crashed.id
+    assert store.claim_next("worker-a", lease_seconds=60).id == released.id
+    assert store.release(released.id, "worker-a")  # graceful shutdown: not a failed attempt
+    time.sleep(0.1)
+
+    restarted = JobStore(tmp_path / "jobs.sqlite3", max_attempts=1)
+    assert restarted.requeue_expired() == (0, 1)
+    assert restarted.get(crashed.id).status == FAILED
+    assert restarted.claim_next("worker-b", lease_seconds=60).id == released.id
+
+
+def test_wait_drops_its_event(tmp_path):
+    async def run():
+        store = JobStore(tmp_path / "jobs.sqlite3")
+        queue = JobQueue(store, handler=None, workers=0, poll_interval=0.01)
+        job = store.create({}, [])  # never run by this process
+        results = await asyncio.gather(queue.wait(job.id, 0.05), queue.wait(job.id, 0.02))
+        assert [r.status for r in results] == [QUEUED, QUEUED]
+        assert queue._done == {} and queue._waiters == {}
+
+    asyncio.run(run())
+
+
+def test_worker_runs_and_renews(tmp_path):
+    async def run():
+        store = JobStore(tmp_path / "jobs.sqlite3")
+
+        async def handler(job, uploads):
+            await asyncio.sleep(0.1)  # several renewals
+            return "result.png"
+
+        queue = JobQueue(store, handler, workers=1, poll_interval=0.01, lease_seconds=0.03)
+        await queue.start()
+        job = await queue.submit({}, [])
+        done = await queue.wait(job.id, 2)
+        await queue.stop()
+        assert done.status == SUCCEEDED and done.result_name == "result.png" and done.attempts == 1
+
+    asyncio.run(run())
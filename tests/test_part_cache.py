@@ -0,0 +1,60 @@
+# tests/test_part_cache.py
+from google.genai import types
+
+from part_cache import PartCache
+
+
+def _part(size: int, fill: bytes = b"x") -> types.Part:
+    return types.Part(inline_data=types.Blob(mime_type="image/png", data=fill * size))
+
+
+def test_evicts_least_recently_used_by_bytes():
+    cache = PartCache(max_bytes=250)
+    cache.put("a", _part(100))
+    cache.put("b", _part(100))
+    assert cache.get("a") is not None  # a is now the most recent
+    cache.put("c", _part(100))
+    assert cache.get("b") is None
+    assert cache.get("a") is not None and cache.get("c") is not None
+    assert cache.stats()["bytes"] == 200
+
+
+def test_one_large_part_evicts_several_small_ones():
+    cache = PartCache(max_bytes=300)
+    for key in "abc":
+        cache.put(key, _part(100))
+    cache.put("big", _part(250))
+    assert [cache.get(k) is not None for k in ("a", "b", "c", "big")] == [False, False, False, True]
+    assert cache.stats()["entries"] == 1
+
+
+def test_replacing_an_entry_updates_the_byte_total():
+    cache = PartCache(max_bytes=300)
+    cache.put("a", _part(200))
+    cache.put("a", _part(50))
+    cache.put("b", _part(200))
+    assert cache.stats()["bytes"] == 250 and cache.stats()["entries"] == 2
+
+
+def test_parts_larger_than_the_cache_are_not_kept():
+    cache = PartCache(max_bytes=100)
+    cache.put("a", _part(60))
+    cache.put("huge", _part(101))
+    assert cache.get("huge") is None
+    assert cache.get("a") is not None
+
+
+def test_get_or_create_is_keyed_by_content_and_namespace():
+    built = []
+
+    def build(data):
+        built.append(data)
+        return _part(len(data))
+
+    cache = PartCache(max_bytes=1000, namespace="prep:1")
+    first = cache.get_or_create(b"image", build)
+    assert cache.get_or_create(b"image", build) is first
+    cache.get_or_create(b"other", build)
+    assert built == [b"image", b"other"]
+    assert (cache.hits, cache.misses) == (1, 2)
+    assert PartCache(1000, namespace="prep:2").key_for(b"image") != cache.key_for(b"image")
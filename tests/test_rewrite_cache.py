@@ -0,0 +1,54 @@
+# tests/test_rewrite_cache.py
+import time
+
+from rewrite_cache import RewriteCache, agent_fingerprint
+
+RESULT = {"rewritten_prompt": "Manga page: a cat", "chosen_template_id": 6}
+
+
+def test_persists_across_instances(tmp_path):
+    RewriteCache(tmp_path / "rewrites.sqlite3", fingerprint="v1").put("a cat", RESULT)
+    reopened = RewriteCache(tmp_path / "rewrites.sqlite3", fingerprint="v1")
+    assert reopened.get("  a   cat ") == RESULT
+    assert reopened.stats() == {"entries": 1, "memory_entries": 1, "hits": 1, "misses": 0}
+
+
+def test_fingerprint_change_invalidates(tmp_path):
+    RewriteCache(tmp_path / "rewrites.sqlite3", fingerprint="v1").put("a cat", RESULT)
+    assert RewriteCache(tmp_path / "rewrites.sqlite3", fingerprint="v2").get("a cat") is None
+
+    class Agent:
+        model = "gemini-a"
+        instruction = "rewrite"
+
+    before = agent_fingerprint(Agent)
+    Agent.instruction = "rewrite as manga"
+    assert agent_fingerprint(Agent) != before
+
+
+def test_entries_expire_after_ttl(tmp_path):
+    cache = RewriteCache(tmp_path / "rewrites.sqlite3", fingerprint="v1", ttl_seconds=0.05)
+    cache.put("a cat", RESULT)
+    assert cache.get("a cat") == RESULT  # from memory
+    time.sleep(0.1)
+    assert cache.get("a cat") is None
+    assert RewriteCache(tmp_path / "rewrites.sqlite3", fingerprint="v1", ttl_seconds=0.05).get("a cat") is None
+
+
+def test_table_is_trimmed_to_max_entries(tmp_path):
+    cache = RewriteCache(tmp_path / "rewrites.sqlite3", fingerprint="v1", max_entries=3, memory_entries=2)
+    for i in range(101):  # trimming runs on the first write and every 100th after it
+        cache.put(f"prompt {i}", {"rewritten_prompt": f"rewrite {i}"})
+    assert cache.stats()["entries"] == 3
+    assert cache.stats()["memory_entries"] == 2
+
+    reopened = RewriteCache(tmp_path / "rewrites.sqlite3", fingerprint="v1")
+    assert reopened.get("prompt 100") == {"rewritten_prompt": "rewrite 100"}
+    assert reopened.get("prompt 0") is None
+
+
+def test_returned_results_are_copies(tmp_path):
+    cache = RewriteCache(tmp_path / "rewrites.sqlite3", fingerprint="v1")
+    cache.put("a cat", dict(RESULT))
+    cache.get("a cat")["rewritten_prompt"] = "changed"
+    assert cache.get("a cat") == RESULT
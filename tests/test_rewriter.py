@@ -0,0 +1,109 @@
+# tests/test_rewriter.py
+import asyncio
+from typing import AsyncGenerator
+
+import pytest
+from google.adk.agents.invocation_context import InvocationContext
+from google.adk.events import Event
+from google.genai import errors
+
+import main
+from benchmarks.fakes import FakeRewriterAgent
+from rewrite_cache import RewriteCache
+from rewriter import PromptRewriter
+from scheduler import GeminiScheduler
+
+
+class BrokenAgent(FakeRewriterAgent):
+    async def _run_async_impl(self, ctx: InvocationContext) -> AsyncGenerator[Event, None]:
+        raise RuntimeError("agent crashed")
+        yield  # pragma: no cover
+
+
+def _sessions(rewriter: PromptRewriter) -> list:
+    return rewriter.session_service.list_sessions(app_name=rewriter.app_name, user_id=rewriter.user_id).sessions
+
+
+def _counting(rewriter: PromptRewriter) -> list:
+    """Record the prompts that actually reach the agent."""
+    calls = []
+    run = rewriter.run
+
+    async def counting_run(raw_prompt):
+        calls.append(raw_prompt)
+        return await run(raw_prompt)
+
+    rewriter.run = counting_run
+    return calls
+
+
+def test_each_run_gets_a_session_that_is_deleted_afterwards():
+    async def run():
+        rewriter = PromptRewriter(FakeRewriterAgent(name="fake_rewriter"))
+        results = await asyncio.gather(*(rewriter.rewrite_prompt(f"prompt {i}") for i in range(3)))
+        assert results == [f"Manga page, 4 panels, crisp ink lineart: prompt {i}" for i in range(3)]
+        assert _sessions(rewriter) == []
+
+        broken = PromptRewriter(BrokenAgent(name="broken"))
+        with pytest.raises(RuntimeError):
+            await broken.run("x")
+        assert _sessions(broken) == []
+
+    asyncio.run(run())
+
+
+def test_cache_miss_then_hit(tmp_path):
+    async def run():
+        cache = RewriteCache(tmp_path / "rewrites.sqlite3", fingerprint="test")
+        rewriter = PromptRewriter(FakeRewriterAgent(name="fake_rewriter"), cache=cache)
+        calls = _counting(rewriter)
+
+        first = await rewriter.rewrite("a cat  in space")
+        second = await rewriter.rewrite(" a cat in space ")  # same prompt after normalization
+        assert calls == ["a cat  in space"]
+        assert second == first and second.template_id == 6
+        assert (cache.hits, cache.misses) == (1, 1)
+
+    asyncio.run(run())
+
+
+def test_unusable_answers_are_not_cached(tmp_path):
+    async def run():
+        cache = RewriteCache(tmp_path / "rewrites.sqlite3", fingerprint="test")
+        rewriter = PromptRewriter(FakeRewriterAgent(name="fake_rewriter"), cache=cache)
+
+        async def no_json(raw_prompt):
+            return "Sorry, I cannot help with that."
+
+        rewriter.run = no_json
+        assert await rewriter.rewrite_prompt("a cat") == "a cat"
+        assert cache.stats()["entries"] == 0
+
+    asyncio.run(run())
+
+
+def test_rate_limited_rewriter_falls_back_to_the_raw_prompt():
+    async def run():
+        scheduler = GeminiScheduler(max_retries=1, base_delay=0, max_delay=0)
+        rewriter = PromptRewriter(FakeRewriterAgent(name="fake_rewriter"), scheduler=scheduler)
+
+        async def exhausted(raw_prompt):
+            raise errors.ClientError(429, {"error": {"code": 429, "message": "quota", "status": "RESOURCE_EXHAUSTED"}})
+
+        rewriter.run = exhausted
+        assert await rewriter.rewrite_prompt("a cat") == "a cat"
+        assert scheduler.lanes[rewriter.model].rate_limited == 2
+
+    asyncio.run(run())
+
+
+def test_manga_request_falls_back_to_raw_prompt_when_rewriter_fails(app_client, monkeypatch):
+    async def exhausted(raw_prompt):
+        raise RuntimeError("429 RESOURCE_EXHAUSTED")
+
+    monkeypatch.setattr(main.PROMPT_REWRITER, "run", exhausted)
+    monkeypatch.setattr(main.SCHEDULER, "base_delay", 0)  # retried, then given up on
+    data = {"prompt": "A comet over Tokyo", "include_manga_styles": "true", "include_default_google_styles": "false"}
+    response = app_client.post("/api/generate-image", data=data)
+    assert response.status_code == 200, response.text
+    assert main.client.aio.models.last_contents[-1] == "A comet over Tokyo"
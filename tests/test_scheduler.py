@@ -0,0 +1,132 @@
+# tests/test_scheduler.py
+import asyncio
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+from google.genai import errors
+
+import main
+from benchmarks.fakes import FakeModels, fake_genai_client, make_image
+from scheduler import GeminiScheduler, ModelLane, TokenBucket
+
+
+def _generate(models: FakeModels):
+    return lambda: models.generate_content(model="m", contents=["prompt"])
+
+
+def test_retries_after_429_then_succeeds():
+    async def run():
+        scheduler = GeminiScheduler(max_retries=2, base_delay=0, max_delay=0)
+        models = FakeModels(b"image", latency=0, rate_limited_calls=1)
+        response = await scheduler.call("m", _generate(models))
+        assert response.candidates[0].content.parts[0].inline_data.data == b"image"
+        assert models.calls == 2
+        lane = scheduler.lanes["m"]
+        assert (lane.rate_limited, lane.retries, lane.completed, lane.failed) == (1, 1, 1, 0)
+        assert lane.active == 0
+
+    asyncio.run(run())
+
+
+def test_gives_up_when_quota_stays_exhausted():
+    async def run():
+        scheduler = GeminiScheduler(max_retries=2, base_delay=0, max_delay=0)
+        models = FakeModels(b"image", latency=0, rate_limit_rate=1.0)
+        with pytest.raises(errors.ClientError) as info:
+            await scheduler.call("m", _generate(models))
+        assert info.value.code == 429
+        assert models.calls == 3
+        lane = scheduler.lanes["m"]
+        assert (lane.rate_limited, lane.retries, lane.failed, lane.active) == (3, 2, 1, 0)
+
+    asyncio.run(run())
+
+
+def test_token_bucket():
+    assert TokenBucket(0).time_until_token() == 0.0  # unlimited
+    bucket = TokenBucket(60, burst=2)
+    bucket.take()
+    assert bucket.time_until_token() == 0.0
+    bucket.take()
+    assert 0.9 < bucket.time_until_token() <= 1.0
+
+
+def test_lane_paces_calls_to_the_rate():
+    async def run():
+        lane = ModelLane("m", max_concurrency=10, rate_per_minute=1200, burst=1)  # one every 50 ms
+        granted = []
+        for _ in range(3):
+            await lane.acquire("c", 0)
+            granted.append(time.monotonic())
+            lane.release()
+        assert granted[1] - granted[0] >= 0.04
+        assert granted[2] - granted[0] >= 0.09
+
+    asyncio.run(run())
+
+
+def test_priority_then_round_robin_per_client():
+    async def run():
+        lane = ModelLane("m", max_concurrency=1)
+        await lane.acquire("holder", 0)
+        order = []
+
+        async def call(client_id, priority, label):
+            await lane.acquire(client_id, priority)
+            order.append(label)
+            lane.release()
+
+        tasks = []
+        for client_id, priority, label in [("a", 1, "a1"), ("a", 1, "a2"), ("a", 1, "a3"),
+                                           ("b", 1, "b1"), ("c", 0, "c1"), ("b", 1, "b2")]:
+            tasks.append(asyncio.ensure_future(call(client_id, priority, label)))
+            await asyncio.sleep(0)  # queue in this order
+        assert lane.queued == 6
+        lane.release()
+        await asyncio.gather(*tasks)
+        assert order == ["c1", "a1", "b1", "a2", "b2", "a3"]
+        assert lane.active == 0
+
+    asyncio.run(run())
+
+
+def test_cancelled_acquire_does_not_leak_a_slot():
+    async def run():
+        lane = ModelLane("m", max_concurrency=1)
+        await lane.acquire("holder", 0)
+
+        # cancelled while queued: the slot goes to the next waiter
+        waiting = asyncio.ensure_future(lane.acquire("a", 0))
+        await asyncio.sleep(0)
+        waiting.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiting
+
+        # granted and cancelled before it could run: the slot is handed back
+        granted = asyncio.ensure_future(lane.acquire("b", 0))
+        await asyncio.sleep(0)
+        lane.release()
+        assert lane.active == 1
+        granted.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await granted
+        assert lane.active == 0
+
+        await asyncio.wait_for(lane.acquire("c", 0), 1)
+        assert lane.active == 1
+
+    asyncio.run(run())
+
+
+def test_exhausted_quota_is_a_503_with_retry_after(make_settings):
+    settings = make_settings(gemini_max_retries=1, gemini_retry_base_seconds=0, gemini_retry_max_seconds=7)
+    with TestClient(main.create_app(settings)) as http:
+        main.client = fake_genai_client(make_image(64, 64), latency=0, rate_limit_rate=1.0)
+        try:
+            response = http.post("/api/generate-image", data={"prompt": "x", "include_default_google_styles": "false"})
+            assert response.status_code == 503
+            assert response.headers["Retry-After"] == "7"
+            assert main.client.aio.models.calls == 2  # one retry, then mapped to 503
+        finally:
+            main.client = None
@@ -0,0 +1,99 @@
+# tests/test_storage.py
+import re
+import time
+from dataclasses import replace
+
+import pytest
+
+from benchmarks.fakes import FakeS3Client
+from storage import AssetIndex, LocalStorage, S3Storage, Storage
+
+
+@pytest.fixture
+def local(tmp_path):
+    return LocalStorage(tmp_path / "generated", AssetIndex(tmp_path / "assets.sqlite3"))
+
+
+def _store(storage, data: bytes, age: float = 0.0):
+    asset = storage.describe(data, "image/png", ".png")
+    asset = replace(asset, created_at=asset.created_at - age)
+    storage.put(asset, data)
+    return asset
+
+
+def test_storage_primitives_are_abstract(tmp_path):
+    with pytest.raises(TypeError):
+        Storage(AssetIndex(tmp_path / "assets.sqlite3"))
+
+
+def test_local_names_and_shards_by_date_and_hash(local):
+    asset = _store(local, b"image-bytes")
+    assert re.fullmatch(r"generated_\d{8}_\d{12}_[0-9a-f]{8}\.png", asset.name)
+    assert asset.name[-12:-4] == asset.sha256[:8]
+    day = asset.name[10:14] + "/" + asset.name[14:16] + "/" + asset.name[16:18]
+    assert asset.key == f"{day}/{asset.sha256[:2]}/{asset.name}"
+
+    path = local.local_path(asset)
+    assert path == local.root / asset.key and path.read_bytes() == b"image-bytes"
+    assert list(path.parent.glob("*.part")) == []
+    assert local.get(asset.name) == asset
+    assert local.read(asset) == b"image-bytes"
+
+
+def test_derived_assets_sit_next_to_their_parent(local):
+    asset = _store(local, b"image-bytes")
+    thumb = local.describe_derived(asset.name.replace(".png", ".w256.webp"), b"thumb", "image/webp", asset)
+    assert thumb.key.rsplit("/", 1)[0] == asset.key.rsplit("/", 1)[0]
+    assert thumb.prompt_hash == asset.prompt_hash
+    # outputs from before the index existed live at the top level
+    assert local.describe_derived("old.w256.webp", b"thumb", "image/webp").key == "old.w256.webp"
+
+    local.put(thumb, b"thumb")
+    assert local.delete(asset) == len(b"image-bytes") + len(b"thumb")
+    assert local.get(asset.name) is None and local.get(thumb.name) is None
+    assert not local.local_path(asset).exists() and not local.local_path(thumb).exists()
+
+
+def test_age_retention_also_removes_derived_files(local):
+    old = _store(local, b"old", age=3600)
+    thumb = local.describe_derived(old.name.replace(".png", ".w256.webp"), b"t", "image/webp", old)
+    local.put(thumb, b"t")
+    new = _store(local, b"new")
+
+    local.max_age_seconds = 60
+    assert local.enforce_retention() == 1
+    assert local.get(old.name) is None and local.get(thumb.name) is None
+    assert not local.local_path(thumb).exists()
+    assert local.get(new.name) is not None
+
+
+def test_size_retention_evicts_oldest_first(local):
+    assets = [_store(local, bytes([i]) * 100, age=30 - i) for i in range(3)]
+    local.max_bytes = 250
+    assert local.enforce_retention() == 1
+    assert [local.get(a.name) is not None for a in assets] == [False, True, True]
+    assert local.stats()["bytes"] == 200
+
+
+def test_put_enforces_retention_at_most_once_per_interval(local):
+    local.max_bytes = 150
+    _store(local, b"a" * 100)
+    _store(local, b"b" * 100)  # within the interval: no sweep yet
+    assert local.stats()["assets"] == 2
+    local._last_retention = time.monotonic() - local.retention_interval
+    _store(local, b"c" * 100)
+    assert local.stats()["assets"] == 1
+
+
+def test_s3_storage_against_a_fake_client(tmp_path):
+    client = FakeS3Client()
+    s3 = S3Storage("bucket", AssetIndex(tmp_path / "assets.sqlite3"), prefix="/generated/", client=client)
+    asset = _store(s3, b"image-bytes")
+    assert client.objects[("bucket", f"generated/{asset.key}")] == (b"image-bytes", "image/png")
+    assert s3.local_path(asset) is None
+    assert s3.read(asset) == b"image-bytes"
+
+    assert s3.delete(asset) == len(b"image-bytes")
+    assert client.objects == {} and s3.get(asset.name) is None
+    with pytest.raises(FileNotFoundError):
+        s3.read(asset)
@@ -0,0 +1,141 @@
+# tests/test_uploads.py
+import asyncio
+from io import BytesIO
+from typing import Optional
+
+import pytest
+from fastapi import UploadFile
+from fastapi.testclient import TestClient
+from starlette.requests import ClientDisconnect, Request
+from starlette.responses import JSONResponse
+
+import main
+from benchmarks.fakes import fake_genai_client, make_image
+from uploads import RequestBodyLimit, UploadLimits, UploadReader, UploadRejected, _mb
+
+PNG = make_image(100, 100)  # 10,000 pixels
+
+
+def _upload(data: bytes, name: str = "ref.png", size: Optional[int] = -1) -> UploadFile:
+    return UploadFile(BytesIO(data), filename=name, size=len(data) if size == -1 else size)
+
+
+def _read_all(limits: UploadLimits, *files: UploadFile) -> list:
+    async def run():
+        reader = UploadReader(limits)
+        return [await reader.read(f) for f in files]
+    return asyncio.run(run())
+
+
+@pytest.mark.parametrize("n,text", [
+    (8 * 1024 * 1024, "8 MB"),
+    (200_000, "200,000 bytes"),
+    (1536 * 1024, "1,572,864 bytes"),
+    (0, "0 bytes"),
+])
+def test_limit_messages_are_exact(n, text):
+    assert _mb(n) == text
+
+
+# ---------------- UploadReader ----------------
+def test_files_within_limits_are_read():
+    limits = UploadLimits(max_file_bytes=len(PNG), max_request_bytes=2 * len(PNG),
+                          max_file_pixels=10_000, max_request_pixels=20_000)
+    assert _read_all(limits, _upload(PNG), _upload(PNG)) == [PNG, PNG]
+
+
+@pytest.mark.parametrize("size", [-1, None])  # size from the multipart parser, or unknown
+def test_per_file_byte_limit(size):
+    f = _upload(PNG, size=size)
+    with pytest.raises(UploadRejected, match="'ref.png' is larger than 1,000 bytes") as info:
+        _read_all(UploadLimits(max_file_bytes=1000), f)
+    assert info.value.status == 413
+    assert f.file.closed
+
+
+def test_unknown_size_reads_no_more_than_the_budget():
+    f = _upload(PNG, size=None)
+    reads = []
+    original = f.read
+
+    async def read(size=-1):
+        reads.append(size)
+        return await original(size)
+
+    f.read = read
+    with pytest.raises(UploadRejected):
+        _read_all(UploadLimits(max_file_bytes=1000), f)
+    assert reads == [1001]
+
+
+def test_per_request_byte_limit():
+    with pytest.raises(UploadRejected, match="exceed .* per request") as info:
+        _read_all(UploadLimits(max_request_bytes=len(PNG) + 10), _upload(PNG), _upload(PNG, "second.png"))
+    assert info.value.status == 413
+
+
+def test_pixel_limits_come_from_the_header():
+    with pytest.raises(UploadRejected, match="100x100; at most 9999 pixels") as info:
+        _read_all(UploadLimits(max_file_pixels=9_999), _upload(PNG))
+    assert info.value.status == 413
+    with pytest.raises(UploadRejected, match="20000 pixels per request"):
+        _read_all(UploadLimits(max_request_pixels=20_000), _upload(PNG), _upload(PNG), _upload(PNG))
+
+
+def test_unreadable_image_is_a_400():
+    with pytest.raises(UploadRejected, match="Could not read uploaded image 'notes.txt'") as info:
+        _read_all(UploadLimits(), _upload(b"not an image", "notes.txt"))
+    assert info.value.status == 400
+
+
+def test_endpoint_maps_rejections_to_status(make_settings):
+    settings = make_settings(uploads=UploadLimits(max_file_bytes=len(PNG) - 1))
+    with TestClient(main.create_app(settings)) as http:
+        main.client = fake_genai_client(make_image(64, 64), latency=0)
+        try:
+            data = {"prompt": "x", "include_default_google_styles": "false"}
+            big = http.post("/api/generate-image", data=data, files=[("style_images", ("big.png", PNG, "image/png"))])
+            assert big.status_code == 413 and "big.png" in big.json()["detail"]
+            bad = http.post("/api/generate-image", data=data, files=[("style_images", ("bad.png", b"??", "image/png"))])
+            assert bad.status_code == 400
+            assert main.client.aio.models.calls == 0
+        finally:
+            main.client = None
+
+
+# ---------------- RequestBodyLimit ----------------
+async def _body_length(scope, receive, send):
+    request = Request(scope, receive)
+    try:
+        body = await request.body()
+    except ClientDisconnect:
+        return  # what the app sees once the middleware has answered 413
+    await JSONResponse({"received": len(body), "content_length": request.headers.get("content-length")})(
+        scope, receive, send)
+
+
+@pytest.fixture
+def limited():
+    return TestClient(RequestBodyLimit(_body_length, max_bytes=100))
+
+
+def test_body_within_limit_passes(limited):
+    assert limited.post("/", content=b"x" * 100).json() == {"received": 100, "content_length": "100"}
+
+
+def test_content_length_over_limit_is_refused_up_front(limited):
+    response = limited.post("/", content=b"x" * 101)
+    assert response.status_code == 413
+    assert response.json() == {"detail": "Request body is larger than 100 bytes."}
+
+
+def test_chunked_body_over_limit_is_refused_while_streaming(limited):
+    def chunks():
+        for _ in range(10):
+            yield b"x" * 30
+
+    response = limited.post("/", content=chunks())
+    assert response.status_code == 413
+    assert response.json()["detail"] == "Request body is larger than 100 bytes."
+    streamed = limited.post("/", content=iter([b"x" * 40, b"x" * 40]))
+    assert streamed.json() == {"received": 80, "content_length": None}
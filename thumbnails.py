@@ -0,0 +1,38 @@
+# thumbnails.py
+from io import BytesIO
+from pathlib import PurePath
+
+from PIL import Image
+
+# Standard preview widths (px); requests for other widths are rejected so the
+# number of stored variants per image stays bounded.
+THUMBNAIL_WIDTHS = (256, 512, 1024)
+
+# format -> (PIL format, mime type, extension)
+THUMBNAIL_FORMATS = {
+    "webp": ("WEBP", "image/webp", ".webp"),
+    "jpeg": ("JPEG", "image/jpeg", ".jpg"),
+}
+
+
+def thumbnail_name(filename: str, width: int, fmt: str) -> str:
+    """generated_x.png -> generated_x.w256.webp (stored next to the original)."""
+    return f"{PurePath(filename).stem}.w{width}{THUMBNAIL_FORMATS[fmt][2]}"
+
+
+def render_thumbnail(data: bytes, width: int, fmt: str, quality: int = 80) -> bytes:
+    """Resize to at most `width` px wide (never upscales) and encode as WebP/JPEG."""
+    pil_format, _, _ = THUMBNAIL_FORMATS[fmt]
+    with Image.open(BytesIO(data)) as img:
+        # JPEG sources can be decoded at reduced scale directly
+        img.draft("RGB", (width, max(1, img.height * width // max(1, img.width))))
+        img.thumbnail((width, 10 * width), Image.Resampling.LANCZOS)
+        if pil_format == "JPEG" or img.mode not in ("RGB", "RGBA"):
+            has_alpha = "A" in img.getbands() or "transparency" in img.info
+            img = img.convert("RGBA" if pil_format == "WEBP" and has_alpha else "RGB")
+        out = BytesIO()
+        if pil_format == "WEBP":
+            img.save(out, format="WEBP", quality=quality, method=4)
+        else:
+            img.save(out, format="JPEG", quality=quality, optimize=True, progressive=True)
+    return out.getvalue()
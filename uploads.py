@@ -0,0 +1,154 @@
+# uploads.py
+from dataclasses import dataclass
+from io import BytesIO
+from typing import Optional, Tuple
+
+from fastapi import UploadFile
+from PIL import Image
+from starlette.responses import JSONResponse
+
+# Room for the non-file form fields and multipart framing on top of the upload budget
+FORM_OVERHEAD_BYTES = 1024 * 1024
+
+
+class UploadRejected(ValueError):
+    """An upload is over a limit (status 413) or is not a readable image (status 400)."""
+
+    def __init__(self, message: str, status: int = 413):
+        super().__init__(message)
+        self.status = status
+
+
+@dataclass(frozen=True)
+class UploadLimits:
+    """Caps on uploaded reference images, per file and per request (0 = unlimited)."""
+    max_file_bytes: int = 20 * 1024 * 1024
+    max_request_bytes: int = 64 * 1024 * 1024
+    max_file_pixels: int = 40_000_000
+    max_request_pixels: int = 100_000_000
+
+    @property
+    def max_body_bytes(self) -> int:
+        return self.max_request_bytes + FORM_OVERHEAD_BYTES if self.max_request_bytes else 0
+
+
+def _mb(n: int) -> str:
+    """Whole megabytes when the limit is one, otherwise the exact byte count."""
+    mb, rest = divmod(n, 1024 * 1024)
+    return f"{mb} MB" if mb and not rest else f"{n:,} bytes"
+
+
+def image_size(data: bytes) -> Tuple[int, int]:
+    """(width, height) from the image header; the pixels are not decoded."""
+    with Image.open(BytesIO(data)) as img:
+        return img.size
+
+
+class UploadReader:
+    """
+    Reads one request's uploaded files under UploadLimits.
+
+    Starlette spools each file to disk past 1 MB while the body streams in;
+    a file is then read in a single call capped at the bytes it may still
+    use, so an oversized upload is never fully loaded. Pixel counts come
+    from the image header, before anything is decoded.
+    """
+
+    def __init__(self, limits: UploadLimits):
+        self.limits = limits
+        self.total_bytes = 0
+        self.total_pixels = 0
+
+    def _byte_budget(self) -> Optional[int]:
+        """Bytes the next file may still use; None if unlimited."""
+        limits = self.limits
+        budgets = []
+        if limits.max_file_bytes:
+            budgets.append(limits.max_file_bytes)
+        if limits.max_request_bytes:
+            budgets.append(max(0, limits.max_request_bytes - self.total_bytes))
+        return min(budgets) if budgets else None
+
+    def _check_bytes(self, name: str, size: int) -> None:
+        limits = self.limits
+        if limits.max_file_bytes and size > limits.max_file_bytes:
+            raise UploadRejected(f"Uploaded image '{name}' is larger than {_mb(limits.max_file_bytes)}.")
+        if limits.max_request_bytes and self.total_bytes + size > limits.max_request_bytes:
+            raise UploadRejected(f"Uploaded images exceed {_mb(limits.max_request_bytes)} per request.")
+
+    def _check_pixels(self, name: str, data: bytes) -> None:
+        limits = self.limits
+        try:
+            width, height = image_size(data)
+        except Exception as e:  # includes PIL's DecompressionBombError
+            raise UploadRejected(f"Could not read uploaded image '{name}': {e}", status=400)
+        pixels = width * height
+        if limits.max_file_pixels and pixels > limits.max_file_pixels:
+            raise UploadRejected(
+                f"Uploaded image '{name}' is {width}x{height}; at most {limits.max_file_pixels} pixels are allowed."
+            )
+        if limits.max_request_pixels and self.total_pixels + pixels > limits.max_request_pixels:
+            raise UploadRejected(f"Uploaded images exceed {limits.max_request_pixels} pixels per request.")
+        self.total_pixels += pixels
+
+    async def read(self, f: UploadFile) -> bytes:
+        """The file's bytes (checked against the limits); the spooled upload is closed right away."""
+        name = f.filename or "(unknown)"
+        try:
+            if f.size is not None:
+                self._check_bytes(name, f.size)  # known from the multipart parser: fail before reading
+            budget = self._byte_budget()
+            data = await f.read() if budget is None else await f.read(budget + 1)
+        finally:
+            await f.close()
+        self._check_bytes(name, len(data))
+        if data:
+            self._check_pixels(name, data)
+        self.total_bytes += len(data)
+        return data
+
+
+class RequestBodyLimit:
+    """
+    ASGI middleware: 413 for request bodies over `max_bytes`, checked from
+    Content-Length up front and by counting the body as it streams in.
+    """
+
+    def __init__(self, app, max_bytes: int):
+        self.app = app
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.max_bytes:
+            return await self.app(scope, receive, send)
+        detail = f"Request body is larger than {_mb(self.max_bytes)}."
+        for key, value in scope.get("headers", ()):
+            if key == b"content-length" and value.isdigit() and int(value) > self.max_bytes:
+                return await JSONResponse({"detail": detail}, status_code=413)(scope, receive, send)
+
+        received = 0
+        rejected = False
+        response_started = False
+
+        async def limited_receive():
+            nonlocal received, rejected
+            if rejected:
+                return {"type": "http.disconnect"}
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes and not response_started:
+                    # answer now and make the app see a client that went away
+                    rejected = True
+                    await JSONResponse({"detail": detail}, status_code=413)(scope, receive, send)
+                    return {"type": "http.disconnect"}
+            return message
+
+        async def guarded_send(message):
+            nonlocal response_started
+            if rejected:
+                return  # the 413 has already been sent
+            response_started = True
+            await send(message)
+
+        await self.app(scope, limited_receive, guarded_send)